@@ -26,6 +26,20 @@ To install the OLD on your Ubuntu (or Debian?) server, run::
 All downloaded source will be saved to ./tmp/. All stdout and stderr will be
 saved to .log files in ./log/.
 
+The version, hash and install time of each installed component are recorded in
+an install manifest at ./.installold.json. Re-running the script checks all
+components in one batch and skips those that are already installed (and the
+tests of those that have already passed them). To ignore the manifest and re-run
+all of the tests::
+
+    $ ./installold.py --recheck
+
+To benchmark the thumbnailing and .wav transcoding that the OLD performs on
+upload, over the bundled media and over synthesized larger inputs, and write a
+JSON report to ./log/benchmark.json::
+
+    $ ./installold.py --benchmark
+
 
 Summary
 ================================================================================
@@ -102,6 +116,10 @@ import pprint
 import json
 import datetime
 import tarfile
+import hashlib
+import time
+import wave
+import multiprocessing
 from subprocess import Popen, PIPE, STDOUT
 
 
@@ -213,15 +231,49 @@ def get_linux_release():
     return shell(['lsb_release', '-rs']).strip()
 
 
-def library_installed(name):
+def get_shared_libraries():
+    """Return a dict from the names of the shared libraries in the dynamic
+    linker cache (e.g., 'libmagic.so.1') to their paths. This is one call to
+    `ldconfig -p`, so callers that need to check several libraries should call
+    this once and reuse the result.
+
+    """
+
+    libraries = {}
+    try:
+        stdout = shell(['ldconfig', '-p'])
+    except OSError:
+        stdout = shell(['/sbin/ldconfig', '-p'])
+    for line in stdout.splitlines():
+        if '=>' not in line:
+            continue
+        left, path = line.split('=>', 1)
+        libraries[left.strip().split(' ')[0]] = path.strip()
+    return libraries
+
+
+def library_installed(name, libraries=None):
     """Return `True` if the Linux library identifiable by `name` is installed.
+    Pass in the output of `get_shared_libraries()` as `libraries` to avoid
+    re-running `ldconfig`.
 
     """
 
-    stdout = shell(['ldconfig', '-p', '|', 'grep', name])
-    if stdout.strip():
-        return True
-    return False
+    return get_library_path(name, libraries) is not None
+
+
+def get_library_path(name, libraries=None):
+    """Return the path to the first shared library whose name contains `name`,
+    or `None` if there is no such library.
+
+    """
+
+    if libraries is None:
+        libraries = get_shared_libraries()
+    for libname in sorted(libraries):
+        if name in libname:
+            return libraries[libname]
+    return None
 
 
 def add_optparser_options(parser):
@@ -235,6 +287,33 @@ def add_optparser_options(parser):
             " is/will be installed in (in your home directory). Defaults"
             " to 'env'.")
 
+    parser.add_option("--benchmark", dest="benchmark",
+        action="store_true", default=False, metavar="BENCHMARK",
+        help="Do not install anything; instead, benchmark the thumbnailing and"
+            " .wav transcoding that the OLD performs on upload and write a JSON"
+            " report to BENCHMARK_REPORT.")
+
+    parser.add_option("--benchmark-report", dest="benchmark_report",
+        metavar="BENCHMARK_REPORT",
+        help="Path of the JSON report written by --benchmark. Defaults to"
+            " ./log/benchmark.json.")
+
+    parser.add_option("--benchmark-iterations", dest="benchmark_iterations",
+        type="int", default=10, metavar="BENCHMARK_ITERATIONS",
+        help="How many times --benchmark should convert each input file."
+            " Defaults to 10.")
+
+    parser.add_option("--benchmark-processes", dest="benchmark_processes",
+        type="int", metavar="BENCHMARK_PROCESSES",
+        help="The number of processes used in the multi-process variants of"
+            " --benchmark. Defaults to the number of CPUs.")
+
+    parser.add_option("--recheck", dest="recheck",
+        action="store_true", default=False, metavar="RECHECK",
+        help="Ignore the install manifest and re-run the checks and tests of"
+            " every component, even those that were previously recorded as"
+            " installed and working.")
+
 
 def get_params():
     """Get parameters based on the arg and/or options entered at the command
@@ -247,7 +326,14 @@ def get_params():
     add_optparser_options(parser)
     (options, args) = parser.parse_args()
     params = {
-        'env_dir': options.env_dir or 'env'
+        'env_dir': options.env_dir or 'env',
+        'recheck': options.recheck,
+        'benchmark': options.benchmark,
+        'benchmark_report': options.benchmark_report or os.path.join(
+            get_log_path(), 'benchmark.json'),
+        'benchmark_iterations': options.benchmark_iterations,
+        'benchmark_processes': options.benchmark_processes or
+            multiprocessing.cpu_count()
     }
     return params
 
@@ -311,15 +397,188 @@ def get_log_path():
 # Installed Checkers
 ################################################################################
 
+# The Python modules that must be importable in the virtual environment, keyed
+# by the name of the component that provides them.
+PYTHON_MODULES = {
+    'OLD': 'onlinelinguisticdatabase',
+    'MySQL-python': 'MySQLdb',
+    'importlib': 'importlib',
+    'PIL': 'Image'
+}
+
+# The executables that each binary component must provide.
+BINARIES = {
+    'easy_install': ['easy_install'],
+    'virtualenv': ['virtualenv'],
+    'FFmpeg': ['ffmpeg'],
+    'm4': ['m4'],
+    'bison': ['/usr/local/bison/bin/bison'],
+    'flex': ['flex'],
+    'subversion': ['svn'],
+    'foma': ['foma', 'flookup'],
+    'MITLM': ['estimate-ngram', 'evaluate-ngram']
+}
+
+# The shared libraries that each native library component must provide.
+LIBRARIES = {
+    'libmagic': ['libmagic.so']
+}
+
+# This script is run with the Python of the virtual environment in order to
+# check all of the Python modules in `PYTHON_MODULES` in a single interpreter
+# launch. It prints a JSON object from module names to `null` (not importable)
+# or to an object with the module's version and path.
+PROBE_SCRIPT = '''
+import sys
+try:
+    import json
+except ImportError:
+    import simplejson as json
+result = {}
+for name in sys.argv[1:]:
+    try:
+        module = __import__(name)
+    except Exception:
+        result[name] = None
+        continue
+    version = None
+    for attr in ('__version__', 'VERSION', 'version'):
+        if isinstance(getattr(module, attr, None), basestring):
+            version = getattr(module, attr)
+            break
+    result[name] = {'version': version,
+        'path': getattr(module, '__file__', None)}
+sys.stdout.write(json.dumps(result))
+'''
+
+
+def hash_file(path):
+    """Return the SHA-1 hex digest of the file at `path`, or `None` if there is
+    no such file.
+
+    """
+
+    if not path or not os.path.isfile(path):
+        return None
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def probe_python_modules(params, components=None):
+    """Return a dict from the components in `PYTHON_MODULES` (or just those in
+    `components`) to `None` or to a dict with 'version', 'path' and 'hash'
+    keys. All of the imports are attempted in one virtual environment
+    interpreter launch.
+
+    """
+
+    if components is None:
+        components = sorted(PYTHON_MODULES)
+    result = dict((c, None) for c in components)
+    if not components or not os.path.isfile(get_python_path(params)):
+        return result
+    modules = [PYTHON_MODULES[c] for c in components]
+    stdout = shell([get_python_path(params), '-c', PROBE_SCRIPT] + modules)
+    # Importing a module may print warnings; the JSON is the last line.
+    try:
+        probed = json.loads(stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        log('probe-python-modules.log', stdout)
+        return result
+    for component in components:
+        info = probed.get(PYTHON_MODULES[component])
+        if info:
+            path = info['path']
+            if path and path.endswith(('.pyc', '.pyo')) and \
+                    os.path.isfile(path[:-1]):
+                path = path[:-1]
+            result[component] = {'version': info['version'], 'path': path,
+                'hash': hash_file(path)}
+    return result
+
+
+def probe_binaries(components=None):
+    """Return a dict from the components in `BINARIES` (or just those in
+    `components`) to `None` or to a dict describing the component's first
+    executable. This is a pass over $PATH; no processes are spawned.
+
+    """
+
+    if components is None:
+        components = sorted(BINARIES)
+    result = {}
+    for component in components:
+        paths = [which(program) for program in BINARIES[component]]
+        if None in paths:
+            result[component] = None
+        else:
+            result[component] = {'version': None, 'path': paths[0],
+                'hash': hash_file(paths[0])}
+    return result
+
+
+def probe_libraries(components=None):
+    """Return a dict from the components in `LIBRARIES` (or just those in
+    `components`) to `None` or to a dict describing the component's first
+    shared library. This is a single `ldconfig -p` call.
+
+    """
+
+    if components is None:
+        components = sorted(LIBRARIES)
+    libraries = get_shared_libraries()
+    result = {}
+    for component in components:
+        paths = [get_library_path(n, libraries) for n in LIBRARIES[component]]
+        if None in paths:
+            result[component] = None
+        else:
+            result[component] = {'version': None, 'path': paths[0],
+                'hash': hash_file(os.path.realpath(paths[0]))}
+    return result
+
+
+def probe(params, components=None):
+    """Check whether the components in `components` (default: all known
+    components) are installed, using one batch per kind of component. The
+    result is cached in `params['probe']` and returned.
+
+    """
+
+    cache = params.setdefault('probe', {})
+    if components is None:
+        components = sorted(PYTHON_MODULES) + sorted(BINARIES) + \
+            sorted(LIBRARIES)
+    cache.update(probe_python_modules(params,
+        [c for c in components if c in PYTHON_MODULES]))
+    cache.update(probe_binaries([c for c in components if c in BINARIES]))
+    libraries = [c for c in components if c in LIBRARIES]
+    if libraries:
+        cache.update(probe_libraries(libraries))
+    return cache
+
+
+def installed(params, component, reprobe=False):
+    """Return `True` if `component` is installed. The cached batch probe result
+    is used unless `reprobe` is `True`, in which case `component` alone is
+    probed again (e.g., after an attempt to install it).
+
+    """
+
+    if reprobe or component not in params.get('probe', {}):
+        probe(params, [component])
+    return params['probe'][component] is not None
+
+
 def old_installed(params):
     """Return `True` if OLD is installed in ~/env/.
 
     """
 
-    stdout = shell([get_python_path(params), '-c', 'import onlinelinguisticdatabase'])
-    if stdout.strip():
-        return False
-    return True
+    return installed(params, 'OLD')
 
 
 def importlib_installed(params):
@@ -327,21 +586,15 @@ def importlib_installed(params):
 
     """
 
-    stdout = shell([get_python_path(params), '-c', 'import importlib'])
-    if stdout.strip():
-        return False
-    return True
+    return installed(params, 'importlib')
 
 
-def mysql_python_installed():
+def mysql_python_installed(params):
     """Return `True` if MySQL-python is installed in ~/env/.
 
     """
 
-    stdout = shell([get_python_path(), '-c', 'import MySQLdb'])
-    if stdout.strip():
-        return False
-    return True
+    return installed(params, 'MySQL-python')
 
 
 def pil_installed(params):
@@ -349,10 +602,122 @@ def pil_installed(params):
 
     """
 
-    stdout = shell([get_python_path(params), '-c', 'import Image'])
-    if stdout.strip():
+    return installed(params, 'PIL')
+
+
+# Install Manifest
+################################################################################
+
+def get_manifest_path():
+    """Return an absolute path to the install manifest, ./.installold.json.
+
+    """
+
+    return os.path.join(get_script_dir_path(), '.installold.json')
+
+
+def get_manifest():
+    """Return the install manifest: a dict from component names to dicts with
+    'version', 'hash' and 'timestamp' keys (and a 'tested' key for components
+    that have passed their tests).
+
+    """
+
+    manifest = {}
+    path = get_manifest_path()
+    if os.path.isfile(path):
+        try:
+            manifest = json.load(open(path))
+            assert type(manifest) is type({})
+        except:
+            print ('%sWarning: unable to read the install manifest at %s; it'
+                ' will be overwritten.%s' % (ANSI_WARNING, path, ANSI_ENDC))
+            manifest = {}
+    return manifest
+
+
+def save_manifest(manifest):
+    """Write `manifest` to ./.installold.json atomically.
+
+    """
+
+    path = get_manifest_path()
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as fo:
+        json.dump(manifest, fo, indent=4, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+def record_installed(params, component):
+    """Record the probed version and hash of `component` in the manifest. If
+    the hash differs from the one recorded previously, the component has
+    changed and any record of it having passed its tests is dropped.
+
+    """
+
+    info = params['probe'].get(component)
+    if not info:
+        return
+    manifest = params['manifest']
+    entry = manifest.get(component, {})
+    if entry.get('hash') != info['hash'] or \
+            entry.get('version') != info['version']:
+        entry = {
+            'version': info['version'],
+            'hash': info['hash'],
+            'timestamp': datetime.datetime.utcnow().isoformat()
+        }
+        manifest[component] = entry
+        save_manifest(manifest)
+
+
+def record_tested(params, component):
+    """Record in the manifest that `component` has passed its tests.
+
+    """
+
+    entry = params['manifest'].get(component)
+    if entry is not None and not entry.get('tested'):
+        entry['tested'] = datetime.datetime.utcnow().isoformat()
+        save_manifest(params['manifest'])
+
+
+def tested(params, component):
+    """Return `True` if the manifest says that `component`, as currently
+    installed, has already passed its tests.
+
+    """
+
+    if params.get('recheck'):
         return False
-    return True
+    info = params['probe'].get(component)
+    entry = params['manifest'].get(component, {})
+    return bool(info and entry.get('tested') and
+        entry.get('hash') == info['hash'])
+
+
+def verify_installed(params, component):
+    """Probe `component` again after an attempt to install it. If it is now
+    installed, record it in the manifest and return `True`.
+
+    """
+
+    if installed(params, component, reprobe=True):
+        record_installed(params, component)
+        return True
+    return False
+
+
+def already_installed(params, component):
+    """Record `component` in the manifest if it is installed and return `True`;
+    otherwise return `False`.
+
+    """
+
+    if installed(params, component):
+        record_installed(params, component)
+        return True
+    return False
 
 
 # Installers
@@ -381,36 +746,36 @@ def get_system_python_version():
             ' Aborting.%s' % (ANSI_FAIL, version, ANSI_ENDC))
 
 
-def install_easy_install():
+def install_easy_install(params):
     """sudo apt-get install python-setuptools
 
     """
 
-    if which('easy_install'):
+    if already_installed(params, 'easy_install'):
         print 'easy_install is already installed.'
         return
     flush('Installing easy_install ...')
     stdout = aptget(['python-setuptools'])
     log('install-easy-install.log', stdout)
-    if which('easy_install'):
+    if verify_installed(params, 'easy_install'):
         print 'Done.'
     else:
         sys.exit('%sFailed to install easy_install. Aborting.%s' % (
             ANSI_FAIL, ANSI_ENDC))
 
 
-def install_virtualenv():
+def install_virtualenv(params):
     """sudo easy_install virtualenv
 
     """
 
-    if which('virtualenv'):
+    if already_installed(params, 'virtualenv'):
         print 'virtualenv is already installed.'
         return
     flush('Installing virtualenv ...')
     stdout = shell(['sudo', 'easy_install', 'virtualenv'])
     log('install-virtualenv.log', stdout)
-    if which('virtualenv'):
+    if verify_installed(params, 'virtualenv'):
         print 'Done.'
     else:
         sys.exit('%sFailed to install virtualenv. Aborting.%s' % (
@@ -430,6 +795,8 @@ def create_env(params):
     stdout = shell(['virtualenv', '--no-site-packages', path])
     log('create-env.log', stdout)
     if os.path.isfile(os.path.join(path, 'bin', 'python')):
+        # The modules were probed before the env existed; probe them again.
+        probe(params, sorted(PYTHON_MODULES))
         print 'Done.'
     else:
         sys.exit('%sFailed to create a new virtual environment in'
@@ -441,13 +808,13 @@ def install_old(params):
 
     """
 
-    if old_installed(params):
+    if already_installed(params, 'OLD'):
         print 'OLD is already installed.'
         return
     flush('Installing OLD ...')
     stdout = shell([get_easy_install_path(params), 'onlinelinguisticdatabase'])
     log('install-old.log', stdout)
-    if old_installed(params):
+    if verify_installed(params, 'OLD'):
         print 'Done.'
     else:
         sys.exit('%sFailed to install the OLD.%s' % (ANSI_FAIL, ANSI_ENDC))
@@ -461,14 +828,14 @@ def install_mysql_python(params):
 
     """
 
-    if mysql_python_installed():
+    if already_installed(params, 'MySQL-python'):
         print 'MySQL-python is already installed.'
         return
     flush('Installing MySQL-python ...')
     aptget(['libmysqlclient-dev', 'python-dev'])
     stdout = shell([get_easy_install_path(params), 'MySQL-python'])
     log('install-mysql-python.log', stdout)
-    if mysql_python_installed():
+    if verify_installed(params, 'MySQL-python'):
         print 'Done.'
     else:
         sys.exit('%s.Failed to install MySQL-python.%s' % (
@@ -480,13 +847,13 @@ def install_importlib(params):
 
     """
 
-    if importlib_installed(params):
+    if already_installed(params, 'importlib'):
         print 'importlib is already installed.'
         return
     flush('Installing importlib ...')
     stdout = shell([get_easy_install_path(params), 'importlib'])
     log('install-importlib.log', stdout)
-    if importlib_installed(params):
+    if verify_installed(params, 'importlib'):
         print 'Done.'
     else:
         sys.exit('%sFailed to install importlib.%s' % (ANSI_FAIL,
@@ -525,7 +892,7 @@ def install_PIL(params):
 
     """
 
-    if pil_installed(params):
+    if already_installed(params, 'PIL'):
         print 'PIL is already installed.'
         return
     flush('Installing PIL ...')
@@ -556,7 +923,7 @@ def install_PIL(params):
         pildirpath)
     logtext.append(stdout)
     log('install-PIL.log', '\n'.join(logtext))
-    if pil_installed(params):
+    if verify_installed(params, 'PIL'):
         print 'Done.'
     else:
         print 'Failed.'
@@ -568,7 +935,9 @@ def test_PIL(params):
 
     """
 
-    if pil_installed(params):
+    if tested(params, 'PIL'):
+        print 'PIL has already been tested.'
+    elif pil_installed(params):
         flush('Testing PIL ...')
         stdout = shell([get_python_path(params), 'tests/pil.py'])
         try:
@@ -579,6 +948,7 @@ def test_PIL(params):
                 convpth = os.path.join(get_script_dir_path(), 'media', convnm)
                 assert os.path.isfile(convpth)
                 assert os.path.getsize(convpth) < os.path.getsize(origpth)
+            record_tested(params, 'PIL')
             print 'PIL is working correctly.'
         except AssertionError:
             print ('%sWarning: the PIL installation does not seem to be able to'
@@ -604,32 +974,35 @@ def install_FFmpeg_dependencies():
     log('install-ffmpeg-dependencies.log', stdout)
 
 
-def install_FFmpeg():
+def install_FFmpeg(params):
     """sudo apt-get -y install ffmpeg
 
     """
 
-    if which('ffmpeg'):
+    if already_installed(params, 'FFmpeg'):
         print 'FFmpeg is already installed.'
         return
     flush('Installing FFmpeg ...')
     install_FFmpeg_dependencies()
     stdout = aptget(['ffmpeg'])
     log('install-ffmpeg.log', stdout)
-    if which('ffmpeg'):
+    if verify_installed(params, 'FFmpeg'):
         print 'Done.'
     else:
         print 'Failed.'
 
 
-def test_FFmpeg():
+def test_FFmpeg(params):
     """Test to make sure that FFmpeg can convert .wav to both .mp3 and .ogg.
 
     """
 
-    if not which('ffmpeg'):
+    if not installed(params, 'FFmpeg'):
         print 'No tests possible: FFmpeg not installed.'
         return
+    if tested(params, 'FFmpeg'):
+        print 'FFmpeg has already been tested.'
+        return
     flush('Testing FFmpeg ...')
     wavpth = os.path.join(get_script_dir_path(), 'media', 'sample.wav')
     mp3pth = os.path.join(get_script_dir_path(), 'media', 'sample.mp3')
@@ -645,6 +1018,7 @@ def test_FFmpeg():
         assert os.path.isfile(oggpth)
         assert os.path.getsize(mp3pth) < os.path.getsize(wavpth)
         assert os.path.getsize(oggpth) < os.path.getsize(wavpth)
+        record_tested(params, 'FFmpeg')
         print 'FFmpeg is working correctly.'
     except AssertionError:
         print ('%sWarning: the FFmpeg install does not appear to be able to'
@@ -656,7 +1030,181 @@ def test_FFmpeg():
         os.remove(oggpth)
 
 
-def install_m4():
+# Benchmarks
+################################################################################
+
+# Synthesized benchmark inputs are this many times larger than the bundled
+# samples: images are scaled up by this factor in each dimension and .wav files
+# are this many copies of media/sample.wav concatenated.
+BENCHMARK_SCALE = 8
+
+
+def get_media_path(fname):
+    """Return an absolute path to `fname` in ./media/.
+
+    """
+
+    return os.path.join(get_script_dir_path(), 'media', fname)
+
+
+def synthesize_wav(inpath, outpath, repeat):
+    """Write a .wav file to `outpath` that is `repeat` copies of the .wav file
+    at `inpath`.
+
+    """
+
+    wi = wave.open(inpath, 'rb')
+    frames = wi.readframes(wi.getnframes())
+    wo = wave.open(outpath, 'wb')
+    wo.setparams(wi.getparams())
+    for i in range(repeat):
+        wo.writeframes(frames)
+    wo.close()
+    wi.close()
+
+
+def get_wav_duration(path):
+    """Return the duration in seconds of the .wav file at `path`.
+
+    """
+
+    w = wave.open(path, 'rb')
+    duration = w.getnframes() / float(w.getframerate())
+    w.close()
+    return duration
+
+
+def transcode(args):
+    """Transcode the .wav file at `wavpth` to `outpth` using FFmpeg. This is a
+    module-level function so that it can be mapped over a process pool.
+
+    """
+
+    wavpth, outpth = args
+    shell(['ffmpeg', '-y', '-i', wavpth, outpth])
+    return outpth
+
+
+def benchmark_PIL(params):
+    """Benchmark PIL's thumbnailing of the bundled images and of synthesized
+    larger copies of them, in a single process and in a pool of processes.
+    The work is done by tests/pilbench.py in the virtual environment's Python.
+
+    """
+
+    if not pil_installed(params):
+        print 'No PIL benchmarks possible: PIL not installed.'
+        return None
+    bench = os.path.join(get_script_dir_path(), 'tests', 'pilbench.py')
+    bundled = [get_media_path('sample.%s' % ext) for ext in ('jpg', 'png',
+        'gif')]
+    synthesized = []
+    for path in bundled:
+        synthpth = os.path.join(get_tmp_path(), 'large_%s' %
+            os.path.basename(path))
+        shell([get_python_path(params), bench, 'synthesize', path, synthpth,
+            str(BENCHMARK_SCALE)])
+        if os.path.isfile(synthpth):
+            synthesized.append(synthpth)
+    results = {}
+    for inputs_name, paths in (('bundled', bundled),
+            ('synthesized', synthesized)):
+        for variant, processes in (('single-process', 1),
+                ('multi-process', params['benchmark_processes'])):
+            flush('Benchmarking PIL (%s images, %s) ...' % (inputs_name,
+                variant))
+            stdout = shell([get_python_path(params), bench, 'run',
+                get_tmp_path(), str(params['benchmark_iterations']),
+                str(processes)] + paths)
+            try:
+                result = json.loads(stdout.strip().splitlines()[-1])
+                print '%.2f images/sec.' % result['images_per_second']
+            except (ValueError, IndexError, TypeError):
+                log('benchmark-PIL.log', stdout)
+                print 'Failed.'
+                result = None
+            results['%s %s' % (inputs_name, variant)] = result
+    for path in synthesized:
+        os.remove(path)
+    return results
+
+
+def benchmark_FFmpeg(params):
+    """Benchmark FFmpeg's transcoding of .wav files to .mp3 and .ogg, using
+    media/sample.wav and a synthesized longer .wav file, in a single process
+    and in a pool of processes.
+
+    """
+
+    if not installed(params, 'FFmpeg'):
+        print 'No FFmpeg benchmarks possible: FFmpeg not installed.'
+        return None
+    bundled = get_media_path('sample.wav')
+    synthesized = os.path.join(get_tmp_path(), 'long_sample.wav')
+    synthesize_wav(bundled, synthesized, BENCHMARK_SCALE)
+    results = {}
+    for inputs_name, wavpth in (('bundled', bundled),
+            ('synthesized', synthesized)):
+        duration = get_wav_duration(wavpth)
+        jobs = []
+        for i in range(params['benchmark_iterations']):
+            for ext in ('mp3', 'ogg'):
+                jobs.append((wavpth, os.path.join(get_tmp_path(),
+                    'bench_%d.%s' % (i, ext))))
+        for variant, processes in (('single-process', 1),
+                ('multi-process', params['benchmark_processes'])):
+            flush('Benchmarking FFmpeg (%s audio, %s) ...' % (inputs_name,
+                variant))
+            start = time.time()
+            if processes > 1:
+                pool = multiprocessing.Pool(processes)
+                outpaths = pool.map(transcode, jobs)
+                pool.close()
+                pool.join()
+            else:
+                outpaths = map(transcode, jobs)
+            seconds = time.time() - start
+            converted = [p for p in outpaths if os.path.isfile(p)]
+            for path in converted:
+                os.remove(path)
+            audio_seconds = duration * len(converted)
+            result = {
+                'conversions': len(converted),
+                'failed_conversions': len(jobs) - len(converted),
+                'processes': processes,
+                'seconds': seconds,
+                'audio_seconds': audio_seconds,
+                'audio_seconds_per_second': (audio_seconds / seconds if seconds
+                    else None)
+            }
+            print '%.2f audio seconds/sec.' % (
+                result['audio_seconds_per_second'] or 0)
+            results['%s %s' % (inputs_name, variant)] = result
+    os.remove(synthesized)
+    return results
+
+
+def benchmark(params):
+    """Benchmark the media conversions that the OLD performs on upload and
+    write a JSON report to `params['benchmark_report']`.
+
+    """
+
+    probe(params, ['PIL', 'FFmpeg'])
+    report = {
+        'date': datetime.datetime.utcnow().isoformat(),
+        'cpus': multiprocessing.cpu_count(),
+        'iterations': params['benchmark_iterations'],
+        'scale': BENCHMARK_SCALE,
+        'PIL': benchmark_PIL(params),
+        'FFmpeg': benchmark_FFmpeg(params)
+    }
+    with open(params['benchmark_report'], 'w') as fo:
+        json.dump(report, fo, indent=4, sort_keys=True)
+    print 'Benchmark report written to %s.' % params['benchmark_report']
+
+
+def install_m4(params):
     """Install m4, a bison dep, which is a foma dep::
 
         $ wget ftp://ftp.gnu.org/gnu/m4/m4-1.4.10.tar.gz
@@ -668,7 +1216,7 @@ def install_m4():
 
     """
 
-    if which('m4'):
+    if already_installed(params, 'm4'):
         print 'm4 is already installed.'
         return
     flush('Installing m4 ...')
@@ -697,13 +1245,13 @@ def install_m4():
     logtext.append('\n\nsudo make install run in m4\n\n')
     logtext.append(stdout)
     log('install-m4.log', '\n'.join(logtext))
-    if which('m4'):
+    if verify_installed(params, 'm4'):
         print 'Done.'
     else:
         print 'Failed.'
 
 
-def install_bison():
+def install_bison(params):
     """Method::
 
         $ wget http://ftp.gnu.org/gnu/bison/bison-2.3.tar.gz
@@ -716,7 +1264,7 @@ def install_bison():
 
     """
 
-    if os.path.isdir('/usr/local/bison/'):
+    if already_installed(params, 'bison'):
         print 'bison is already installed.'
         return
     flush('Installing bison ...')
@@ -746,47 +1294,47 @@ def install_bison():
     logtext.append('\n\n`sudo make install` run in bison\n\n')
     logtext.append(stdout)
     log('install-bison.log', '\n'.join(logtext))
-    if os.path.isdir('/usr/local/bison/'):
+    if verify_installed(params, 'bison'):
         print 'Done.'
     else:
         print 'Failed.'
 
 
-def install_flex():
+def install_flex(params):
     """sudo apt-get install flex
 
     """
 
-    if which('flex'):
+    if already_installed(params, 'flex'):
         print 'flex is already installed.'
         return
     flush('Installing flex ...')
     stdout = aptget(['flex'])
     log('install-flex.log', stdout)
-    if which('flex'):
+    if verify_installed(params, 'flex'):
         print 'Done.'
     else:
         print 'Failed.'
 
 
-def install_subversion():
+def install_subversion(params):
     """sudo apt-get install subversion
 
     """
 
-    if which('svn'):
+    if already_installed(params, 'subversion'):
         print 'subversion is already installed.'
         return
     flush('Installing subversion ...')
     stdout = aptget(['subversion'])
     log('install-subversion.log', stdout)
-    if which('svn'):
+    if verify_installed(params, 'subversion'):
         print 'Done.'
     else:
         print 'Failed.'
 
 
-def install_foma():
+def install_foma(params):
     """Method::
 
         $ svn co http://foma.googlecode.com/svn/trunk/foma/
@@ -798,10 +1346,10 @@ def install_foma():
 
     """
 
-    if which('foma') and which('flookup'):
+    if already_installed(params, 'foma'):
         print 'foma is already installed.'
         return
-    if not which('svn'):
+    if not installed(params, 'subversion'):
         print 'Subversion not installed; can\'t install foma. Aborting.'
         return
     flush('Installing foma ...')
@@ -830,13 +1378,13 @@ def install_foma():
     stdout = shell(['sudo', 'make', 'install'], fomadir)
     logtext.append('\n\nRunning `sudo make install` in foma\n\n')
     logtext.append(stdout)
-    if which('foma') and which('flookup'):
+    if verify_installed(params, 'foma'):
         print 'Done.'
     else:
         print 'Failed.'
 
 
-def install_mitlm():
+def install_mitlm(params):
     """Method::
 
         $ sudo apt-get install autoconf automake libtool gfortran
@@ -850,7 +1398,7 @@ def install_mitlm():
 
     """
 
-    if which('estimate-ngram') and which('evaluate-ngram'):
+    if already_installed(params, 'MITLM'):
         print 'MITLM is already installed.'
         return
     flush('Installing MITLM ...')
@@ -879,7 +1427,7 @@ def install_mitlm():
     log('sudo-make-install-mitlm.log', stdout)
     stdout = shell(['sudo', 'ldconfig'], mitlmdirpath)
     log('sudo-ldconfig-mitlm.log', stdout)
-    if which('estimate-ngram') and which('evaluate-ngram'):
+    if verify_installed(params, 'MITLM'):
         print 'Done.'
     else:
         print('MITLM was not installed correctly. Please see'
@@ -887,17 +1435,21 @@ def install_mitlm():
             ' install it on your system.')
 
 
-def install_libmagic():
+def install_libmagic(params):
     """sudo apt-get install libmagic-dev
 
-    TODO: test for success.
-
     """
 
+    if already_installed(params, 'libmagic'):
+        print 'libmagic is already installed.'
+        return
     flush('Installing libmagic ...')
     stdout = aptget(['libmagic-dev'])
     log('install-libmagic.log', stdout)
-    print 'Done.'
+    if verify_installed(params, 'libmagic'):
+        print 'Done.'
+    else:
+        print 'Failed.'
 
 
 def install(params):
@@ -911,10 +1463,15 @@ def install(params):
     clear_log()
     clear_tmp()
 
+    # Check every component up front, in one batch per kind of component, so
+    # that a re-run on an already-provisioned host skips straight through.
+    params['manifest'] = get_manifest()
+    probe(params)
+
     # Core dependencies: these must be installed in order for the OLD to be
     # minimally functional.
-    install_easy_install()
-    install_virtualenv()
+    install_easy_install(params)
+    install_virtualenv(params)
     create_env(params)
     install_old(params)
     install_mysql_python(params)
@@ -924,20 +1481,23 @@ def install(params):
     # fully functional unless all of them are installed.
     install_PIL(params)
     test_PIL(params)
-    install_FFmpeg()
-    test_FFmpeg()
-    install_m4()
-    install_bison()
-    install_flex()
-    install_subversion()
-    install_foma()
-    install_mitlm()
-    install_libmagic()
+    install_FFmpeg(params)
+    test_FFmpeg(params)
+    install_m4(params)
+    install_bison(params)
+    install_flex(params)
+    install_subversion(params)
+    install_foma(params)
+    install_mitlm(params)
+    install_libmagic(params)
 
 
 def main():
     params = get_params()
-    install(params)
+    if params['benchmark']:
+        benchmark(params)
+    else:
+        install(params)
 
 
 if __name__ == '__main__':
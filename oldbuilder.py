@@ -0,0 +1,4153 @@
+"""The OLD builder: everything that buildold.py does besides the read-only
+queries answered by oldstate. See buildold.py for its usage.
+
+"""
+
+import re
+import os
+import sys
+import shutil
+import optparse
+import getpass
+import pprint
+import json
+import datetime
+import time
+import socket
+import select
+import pipes
+import signal
+import hashlib
+import threading
+import fcntl
+import pwd
+import grp
+from subprocess import Popen, PIPE, STDOUT
+from multiprocessing.pool import ThreadPool
+from oldstate import (STORE, ANSI_HEADER, ANSI_OKGREEN, ANSI_WARNING,
+    ANSI_FAIL, ANSI_ENDC, get_state, write_state, query_olds, list_built,
+    create_dative_servers_file, get_dative_server, write_dative_servers,
+    add_query_options)
+
+# The script that runs this builder (and the activators of suspended OLDs).
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'buildold.py')
+
+# The state of --suspend-idle: how far it has read each Apache access log and
+# when each OLD last received a request.
+ACTIVITY = '.buildold.activity'
+
+# Matches the OLD directory name in the request line of an access log entry.
+ACCESS_LOG_PATH_RE = re.compile(r'"[A-Z]+ /(\w+)/')
+
+# Seconds that an activator waits for its OLD to start.
+ACTIVATION_TIMEOUT = 120
+
+# The pool of pre-built OLD slots (see --fill-pool) is recorded here. A build
+# claims a slot from it, if there is one for its apps_path and vh_path, instead
+# of running make-config and setup-app. --fill-pool builds POOL_SIZE slots,
+# unless told otherwise.
+POOL = '.buildold.pool.json'
+POOL_SIZE = 2
+
+# The capacity records of the hosts in the --hosts-file, as last probed.
+CAPACITY = '.buildold.capacity.json'
+
+# Each OLD may hold this many MySQL connections at once: SQLAlchemy's default
+# pool_size (5) plus max_overflow (10).
+POOL_CONNECTIONS = 15
+
+# This many of a MySQL server's max_connections are kept free for other
+# clients (backups, administration).
+MYSQL_RESERVED_CONNECTIONS = 10
+
+# Run on each host in the --hosts-file (via its executor) to measure its
+# capacity; prints key=value lines. It is fed to `sh -s` on stdin, so that the
+# MySQL password (passed to mysql in its environment) never appears in a
+# command line.
+HOST_PROBE_SCRIPT = """
+MYSQL_PWD=%(mysql_pwd)s
+export MYSQL_PWD
+awk '/^MemTotal:/ {print "mem_total_kb=" $2}
+    /^MemAvailable:/ {print "mem_available_kb=" $2}' /proc/meminfo
+echo cores=$(nproc)
+df -Pk %(apps_path)s | awk 'NR == 2 {print "disk_total_kb=" $2;
+    print "disk_free_kb=" $4}'
+echo max_connections=$(mysql -N -B -u %(mysql_user)s \
+    -e 'SELECT @@max_connections' 2>/dev/null)
+olds=$(%(python)s %(buildold)s --list --format=tsv 2>/dev/null) &&
+    echo olds=$(printf '%%s\\n' "$olds" | wc -l)
+"""
+
+# Default settings of the connections that Apache proxies to an OLD's paster
+# server, and of the compression of its responses. Override them fleet-wide in
+# a 'proxy' object in the config file and per OLD in the 'olds' object (see
+# RESPONSE_CACHE). The PROXY_PARAMETERS are rendered as mod_proxy worker
+# parameters of the OLD's ProxyPass line (a value of null omits one): reuse
+# up to `max` pooled connections (paster serves 10 requests at a time) for
+# `ttl` seconds, wait `acquire` ms for a free one, give up on connecting after
+# `connectiontimeout` and on a response after `timeout` seconds, and retry a
+# failed backend after `retry` seconds. Responses of the types in 'deflate' are
+# gzipped by mod_deflate.
+PROXY = {
+    'retry': 5,
+    'keepalive': 'On',
+    'max': 10,
+    'ttl': 60,
+    'acquire': 3000,
+    'connectiontimeout': 5,
+    'timeout': 300,
+    'deflate': ['application/json', 'text/html', 'text/plain']
+}
+PROXY_PARAMETERS = ['retry', 'keepalive', 'max', 'ttl', 'acquire',
+    'connectiontimeout', 'timeout']
+
+# Default settings of the servers that serve the OLDs (see the *Server classes).
+# Override them fleet-wide in a 'server' object in the config file (whose
+# 'backend' is the default server for new OLDs) and per OLD in the 'olds'
+# object. waitress serves with `threads` threads, gunicorn with `workers`
+# processes. A server that has not exited `stop_grace` seconds after SIGTERM
+# is sent SIGKILL.
+SERVER = {
+    'threads': 8,
+    'workers': 3,
+    'gunicorn_path': None,
+    'stop_grace': 30
+}
+
+# systemd units for OLDs built with --service-manager=systemd are installed
+# here.
+SYSTEMD_DIR = '/etc/systemd/system'
+
+# Default settings of the OLDs' systemd units. Override them fleet-wide in a
+# 'systemd' object in the config file and per OLD in the 'olds' object. The
+# SYSTEMD_LIMITS map these settings to the unit's resource control directives
+# (a value of null omits one).
+SYSTEMD = {
+    'restart_sec': 5,
+    'memory_max': '512M',
+    'cpu_quota': '100%',
+    'tasks_max': 64,
+    'io_weight': 100
+}
+SYSTEMD_LIMITS = [('memory_max', 'MemoryMax'), ('cpu_quota', 'CPUQuota'),
+    ('tasks_max', 'TasksMax'), ('io_weight', 'IOWeight')]
+
+# Seconds to wait for a newly started server to accept connections.
+SERVE_TIMEOUT = 60
+
+# Default settings of the (disk) cache of proxied OLD responses. Override them
+# fleet-wide in a 'response_cache' object in the config file and per OLD in
+# the 'olds' object, e.g., {"olds": {"bla": {"response_cache": {"enabled":
+# true}}}}. Only GET responses for URL paths starting with /<old>/<path>, for
+# the paths in 'paths', are cached, for 'ttl' seconds.
+RESPONSE_CACHE = {
+    'enabled': False,
+    'paths': ['forms', 'applicationsettings', 'orthographies'],
+    'ttl': 300,
+    'root': '/var/cache/apache2/mod_cache_disk',
+    'max_size': '512M'
+}
+
+# Logrotate configs for the OLDs' logs and the Apache logs are installed here.
+LOGROTATE_DIR = '/etc/logrotate.d'
+
+# Default log rotation options; override them in a 'logrotate' object in the
+# config file. Logs are rotated at this frequency or when they exceed maxsize,
+# whichever comes first.
+LOGROTATE = {
+    'frequency': 'daily',
+    'maxsize': '100M',
+    'rotate': 14
+}
+
+LOGROTATE_TEMPLATE = """    %(frequency)s
+    maxsize %(maxsize)s
+    rotate %(rotate)s
+    compress
+    delaycompress
+    missingok
+    notifempty
+"""
+
+# Commands run by run_command are killed if they run for longer than
+# COMMAND_TIMEOUT seconds (LONG_COMMAND_TIMEOUT for setup-app and for copying
+# an OLD's database and files); those that ignore SIGTERM are sent SIGKILL
+# COMMAND_KILL_GRACE seconds later. At most COMMAND_CONCURRENCY commands run at
+# once.
+COMMAND_TIMEOUT = 120
+LONG_COMMAND_TIMEOUT = 3600
+COMMAND_KILL_GRACE = 5
+COMMAND_CONCURRENCY = 8
+COMMAND_SLOTS = threading.BoundedSemaphore(COMMAND_CONCURRENCY)
+
+# These values specify the range of ports that we can serve OLDs on.
+PORT_START = 9000
+PORT_END = 9100
+
+
+def get_crontab():
+    """Return the python-crontab module
+    (https://pypi.python.org/pypi/python-crontab), or `None` if it is not
+    installed. It is imported here, rather than at the top of this module, so
+    that the read-only commands do not pay for the import.
+
+    """
+
+    try:
+        import crontab
+    except ImportError:
+        crontab = None
+    return crontab
+
+
+class DBCheckError(Exception):
+    pass
+
+
+class DirPathIsFile(Exception):
+    pass
+
+
+def catcherror(func):
+    """This is a decorator to wrap all functions that take a `params` dict as
+    their only argument. If something goes wrong, we clean up what we've done
+    in `abort` and we exit the script.
+
+    Note: this decorator should not be used in the "destructive" functions like
+    `destroy_cronjob`.
+
+    """
+
+    def new_func(params):
+        try:
+            return func(params)
+        except DirPathIsFile:
+            print ('%sError: attempted to create a directory where a file'
+                ' already existed. Aborting.%s' % (ANSI_FAIL, ANSI_ENDC))
+            abort(params)
+            sys.exit('Goodbye.')
+        except DBCheckError:
+            print ('%sError occurred when attempting to check if the MySQL'
+                ' database %s already exists. Aborting.%s' % (ANSI_FAIL, db_name,
+                ANSI_ENDC))
+            abort(params)
+            sys.exit('Goodbye.')
+        except Exception, e:
+            print ('%sAn error occurred. Aborting.%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+            print e
+            abort(params)
+            sys.exit('Goodbye.')
+    return new_func
+
+
+class CommandResult(object):
+    """The result of a command run by `run_command`: the command, its exit
+    status (`None` if it could not be started or was killed for running longer
+    than its timeout), its output (stdout and stderr, merged) and how many
+    seconds it ran.
+
+    """
+
+    def __init__(self, cmd, returncode, output, seconds, timed_out=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.output = output
+        self.seconds = seconds
+        self.timed_out = timed_out
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __str__(self):
+        # Don't show the MySQL password.
+        cmd = ' '.join(['-p***' if arg.startswith('-p') and len(arg) > 2
+            else arg for arg in map(unicode, self.cmd)])
+        if self.timed_out:
+            status = 'was killed after %.0f seconds' % self.seconds
+        elif self.returncode is None:
+            status = 'could not be run'
+        else:
+            status = 'exited with status %s' % self.returncode
+        output = self.output.strip()
+        return '`%s` %s%s' % (cmd, status, output and ':\n%s' % output or '.')
+
+
+def run_command(cmd, timeout=COMMAND_TIMEOUT, input=None, cwd=None,
+        echo=False):
+    """Run the command `cmd` (a list) and return its CommandResult. Its output
+    is captured line by line as it is produced (and printed, if `echo` is
+    `True`). `input` is written to its stdin, which is otherwise /dev/null. If
+    it runs for more than `timeout` seconds, it is sent SIGTERM and, if it is
+    still running COMMAND_KILL_GRACE seconds later, SIGKILL; so a hung sudo
+    password prompt or a stuck Apache restart cannot block this script forever.
+    At most COMMAND_CONCURRENCY commands run at once, however many threads
+    call this.
+
+    """
+
+    with COMMAND_SLOTS:
+        start = time.time()
+        try:
+            proc = Popen(cmd, stdin=PIPE if input is not None else
+                open(os.devnull), stdout=PIPE, stderr=STDOUT, cwd=cwd,
+                close_fds=True)
+        except OSError, e:
+            return CommandResult(cmd, None, '%s: %s' % (cmd[0], e),
+                time.time() - start)
+        lines = []
+        exited = threading.Event()
+        killed = []
+
+        def read():
+            for line in iter(proc.stdout.readline, ''):
+                lines.append(line)
+                if echo:
+                    sys.stdout.write(line)
+
+        def write():
+            try:
+                proc.stdin.write(input)
+                proc.stdin.close()
+            except IOError:
+                pass
+
+        def kill():
+            killed.append(True)
+            for sig in [signal.SIGTERM, signal.SIGKILL]:
+                try:
+                    os.kill(proc.pid, sig)
+                except OSError:
+                    return
+                if exited.wait(COMMAND_KILL_GRACE):
+                    return
+
+        threads = [threading.Thread(target=read)]
+        if input is not None:
+            threads.append(threading.Thread(target=write))
+        timer = threading.Timer(timeout, kill)
+        for thread in threads + [timer]:
+            thread.daemon = True
+            thread.start()
+        proc.wait()
+        exited.set()
+        timer.cancel()
+        timer.join()
+        # A daemon that the command started may hold its output open.
+        for thread in threads:
+            thread.join(COMMAND_KILL_GRACE)
+        return CommandResult(cmd, None if killed else proc.returncode,
+            ''.join(lines), time.time() - start, bool(killed))
+
+
+def run_mysql(params, sql, *options):
+    """Run the MySQL statements `sql` with the MySQL credentials in `params`
+    and return the CommandResult.
+
+    """
+
+    return run_command(['mysql', '-u', params['mysql_user'],
+        '-p%s' % params['mysql_pwd']] + list(options) + ['-e', sql])
+
+
+def get_virtual_host_olds(params):
+    """Return the OLDs that this script has built with the virtual hosts file
+    `params['vh_path']`, plus the one described by `params`. Each gets a block
+    of directives in that file.
+
+    """
+
+    return [o for o in get_state() if o.get('vh_path') == params['vh_path']
+        and o['old_dir_name'] != params['old_dir_name']] + [params]
+
+
+def write_updated_virtual_hosts_file_to_tmp(params):
+    """Update the Apache virtual hosts file at `params['vh_path']` and write it
+    to /tmp/.
+
+    """
+
+    tmp_vhs_path = '/tmp/new_old_virtual_hosts_config'
+    olds = get_virtual_host_olds(params)
+    old_dir_names = [o['old_dir_name'] for o in olds]
+    # Get any existing ProxyPass and ProxyPassReverse lines in the virtual
+    # hosts file for OLDs that we have no record of.
+    proxy_lines = {
+        'ProxyPass': {},
+        'ProxyPassReverse': {}
+    }
+    if os.path.isfile(params['vh_path']):
+        with open(params['vh_path']) as f:
+            for line in f:
+                line_words = line.split()
+                # Only the lines that proxy to an OLD, not exclusions.
+                if len(line_words) < 3 or \
+                        not line_words[2].startswith('http://localhost:'):
+                    continue
+                if 'ProxyPass' in line_words:
+                    _dir_name = line.strip().split()[1][1:-1]
+                    proxy_lines['ProxyPass'][_dir_name] = line.strip()
+                if 'ProxyPassReverse' in line_words:
+                    _dir_name = line.strip().split()[1][1:-1]
+                    proxy_lines['ProxyPassReverse'][_dir_name] = line.strip()
+    for line_type in proxy_lines:
+        for _dir_name in old_dir_names:
+            proxy_lines[line_type].pop(_dir_name, None)
+    proxy_lines = '\n    '.join(
+        sorted(proxy_lines['ProxyPass'].values()) +
+        sorted(proxy_lines['ProxyPassReverse'].values())) + ''.join(
+        get_old_virtual_host_directives(params, old) for old in
+        sorted(olds, key=lambda o: o['old_dir_name']))
+    if response_cache_enabled(params, olds):
+        proxy_lines += get_response_cache_root_directives(params)
+
+    # Write the new virtual hosts file to /tmp/, including any previously
+    # existing proxying statements.
+    with open(tmp_vhs_path, 'w') as fo:
+        fo.write('''<IfModule mod_ssl.c>
+<VirtualHost *:443>
+    ServerName %s:443
+    ServerAlias %s:443
+
+    # Logfiles
+    ErrorLog %s/log/error.log
+    CustomLog %s/log/access.log combined
+
+    SSLEngine on
+    SSLCertificateFile %s
+    SSLCertificateKeyFile %s
+    SSLCertificateChainFile %s
+
+    # Proxy
+    %s
+    ProxyPreserveHost On
+    <Proxy *>
+        Order deny,allow
+        Allow from all
+    </Proxy>
+%s
+</VirtualHost>
+</IfModule>
+            ''' % (params['host'], params['host'], params['apps_path'],
+                    params['apps_path'], params['ssl_crt_path'], 
+                    params['ssl_key_path'], params['ssl_pem_path'], proxy_lines,
+                    get_dative_servers_directives(params)))
+
+    return tmp_vhs_path
+
+
+def get_old_virtual_host_directives(params, old):
+    """Return the Apache directives that serve the OLD described by `old`.
+    Requests are proxied to its paster server, except that, if
+    `params['static_files']` is `True`, its files and reduced files are served
+    by Apache itself (with sendfile, byte ranges and caching headers) at
+    /<old_dir_name>/static/files/ and /<old_dir_name>/static/reduced_files/.
+    Note that this bypasses the OLD's access restrictions on those files. If
+    mod_xsendfile is available, the OLD may also hand the sending of any file
+    in its files directory over to Apache via the X-Sendfile header. Some of
+    its responses may be cached; see `get_response_cache_directives`. The
+    worker parameters of the proxied connections and the compression of the
+    responses are set by the OLD's proxy settings; see `get_proxy_settings`.
+
+    """
+
+    files_path = os.path.join(old['old_path'], 'files')
+    proxy = get_proxy_settings(params, old)
+    lines = ['', '    # %s' % old['old_dir_name'],
+        '    <Location /%s/>' % old['old_dir_name'],
+        '        <IfModule mod_xsendfile.c>',
+        '            XSendFile On',
+        '            XSendFilePath %s' % files_path,
+        '        </IfModule>']
+    if proxy['deflate']:
+        lines += [
+            '        <IfModule mod_deflate.c>',
+            '            AddOutputFilterByType DEFLATE %s' % ' '.join(
+                proxy['deflate']),
+            '        </IfModule>']
+    lines.append('    </Location>')
+    if params.get('static_files'):
+        lines += [
+            '    Alias /%s/static/files/ %s/' % (old['old_dir_name'],
+                files_path),
+            '    Alias /%s/static/reduced_files/ %s/' % (old['old_dir_name'],
+                os.path.join(files_path, 'reduced_files')),
+            '    <Directory %s>' % files_path,
+            '        Options -Indexes',
+            '        Order deny,allow',
+            '        Allow from all',
+            '        EnableSendfile On',
+            '        FileETag MTime Size',
+            '        <IfModule mod_headers.c>',
+            '            Header set Cache-Control "public, max-age=%s"' % (
+                params.get('static_files_max_age') or 86400),
+            '        </IfModule>',
+            '    </Directory>',
+            '    ProxyPass /%s/static/files/ !' % old['old_dir_name'],
+            '    ProxyPass /%s/static/reduced_files/ !' % old['old_dir_name']]
+    cache_directives = get_response_cache_directives(params, old)
+    if cache_directives:
+        lines.append(cache_directives)
+    lines += [
+        '    ProxyPass /%s/ http://localhost:%s/ %s' % (old['old_dir_name'],
+            old['old_port'], ' '.join('%s=%s' % (key, proxy[key])
+            for key in PROXY_PARAMETERS if proxy.get(key) is not None)),
+        '    ProxyPassReverse /%s/ http://localhost:%s/' % (
+            old['old_dir_name'], old['old_port'])]
+    return '\n'.join(lines) + '\n'
+
+
+def get_old_settings(params, old, key):
+    """Return the fleet-wide settings object `params[key]` (from the config
+    file), updated with the overrides for the OLD described by `old` in the
+    config file's 'olds' object, e.g.,
+    {"olds": {"bla": {"response_cache": {"enabled": true}}}}.
+
+    """
+
+    settings = dict(params.get(key) or {})
+    settings.update((params.get('olds_config') or {}).get(
+        old['old_name'], {}).get(key, {}))
+    return settings
+
+
+def get_proxy_settings(params, old):
+    """Return the proxy settings for the OLD described by `old`: PROXY updated
+    with the 'proxy' settings of the config file and the OLD's overrides.
+
+    """
+
+    settings = PROXY.copy()
+    settings.update(get_old_settings(params, old, 'proxy'))
+    return settings
+
+
+def get_response_cache_settings(params, old):
+    """Return the response cache settings for the OLD described by `old`:
+    RESPONSE_CACHE updated with the 'response_cache' settings of the config
+    file and the OLD's overrides.
+
+    """
+
+    settings = RESPONSE_CACHE.copy()
+    settings.update(get_old_settings(params, old, 'response_cache'))
+    return settings
+
+
+def get_response_cache_directives(params, old):
+    """Return the Apache directives that cache (on disk, via mod_cache_disk)
+    the proxied GET responses of the OLD described by `old` whose paths start
+    with one of its cacheable paths, for `ttl` seconds; or the empty string if
+    its response cache is not enabled. Responses vary on the Cookie header, so
+    a cached response is only served to the session that it was generated
+    for.
+
+    """
+
+    cache = get_response_cache_settings(params, old)
+    if not cache['enabled']:
+        return ''
+    lines = ['    <IfModule mod_cache_disk.c>']
+    for path in cache['paths']:
+        lines.append('        CacheEnable disk /%s/%s' % (old['old_dir_name'],
+            path))
+    lines += [
+        '        <LocationMatch "^/%s/(%s)">' % (old['old_dir_name'],
+            '|'.join(re.escape(path) for path in cache['paths'])),
+        '            CacheDefaultExpire %s' % cache['ttl'],
+        '            CacheMaxExpire %s' % cache['ttl'],
+        '            CacheIgnoreNoLastMod On',
+        '            <IfModule mod_headers.c>',
+        '                Header merge Vary Cookie',
+        '            </IfModule>',
+        '        </LocationMatch>',
+        '    </IfModule>']
+    return '\n'.join(lines)
+
+
+def response_cache_enabled(params, olds):
+    """Return `True` if the response cache is enabled for any of `olds`.
+
+    """
+
+    return bool([o for o in olds
+        if get_response_cache_settings(params, o)['enabled']])
+
+
+def get_response_cache_root_directives(params):
+    """Return the directives that set the root of the disk cache (and its size
+    limit, which the htcacheclean cronjob enforces), if the response cache is
+    enabled for any OLD. Set-Cookie headers are never cached;
+    CacheIgnoreHeaders is only allowed here, at the virtual host level.
+
+    """
+
+    cache = get_response_cache_settings(params, params)
+    return '''
+    # Response cache (size limited to %s by htcacheclean)
+    <IfModule mod_cache_disk.c>
+        CacheRoot %s
+        CacheQuickHandler Off
+        CacheIgnoreHeaders Set-Cookie
+    </IfModule>
+''' % (cache['max_size'], cache['root'])
+
+
+def get_cache_cleaner_cmd(params):
+    """Return the Cronjob command that limits the size of the response cache.
+
+    """
+
+    cache = get_response_cache_settings(params, params)
+    return 'sudo htcacheclean -n -t -p %s -l %s >/dev/null 2>&1' % (
+        cache['root'], cache['max_size'])
+
+
+def create_cache_cleaner_cronjob(params):
+    """Create a cronjob that runs htcacheclean every 15 minutes to keep the
+    response cache under its size limit, unless there is one already.
+
+    """
+
+    cmd = get_cache_cleaner_cmd(params)
+    crontab = get_crontab()
+    if crontab:
+        cron = crontab.CronTab(user=True)
+        if list(cron.find_command(cmd)):
+            return
+        print 'Enabling cronjob to limit the size of the response cache.'
+        job = cron.new(command=cmd)
+        job.minute.every(15)
+        job.enable()
+        cron.write()
+    else:
+        print ('%sPython-crontab is not installed. To limit the size of the'
+            ' response cache, put the following line in your crontab:'
+            ' "*/15 * * * * %s".%s' % (ANSI_WARNING, cmd, ANSI_ENDC))
+
+
+def purge_cache(params, global_state):
+    """Delete the responses of the OLD named `params['old_name']` from the
+    response cache, using htcacheclean.
+
+    """
+
+    try:
+        old = [o for o in global_state
+            if o['old_name'] == params['old_name']][0]
+    except IndexError:
+        sys.exit('%sSorry, this script has no record of an OLD named %s.%s' % (
+            ANSI_FAIL, params['old_name'], ANSI_ENDC))
+    root = get_response_cache_settings(params, old)['root']
+    listing = run_command(['sudo', 'htcacheclean', '-p', root, '-a'])
+    if not listing.ok:
+        sys.exit('%sUnable to list the response cache at %s: %s%s' % (
+            ANSI_FAIL, root, listing, ANSI_ENDC))
+    prefix = '/%s/' % old['old_dir_name']
+    urls = [url for url in listing.output.split() if prefix in url]
+    for url in urls:
+        run_command(['sudo', 'htcacheclean', '-p', root, url])
+    print 'Purged %d cached response(s) of %s.' % (len(urls), old['old_name'])
+
+
+def get_http_virtual_host_file(params, proxy_lines):
+    """Use this to return a string representing an Apache virtual hosts file
+    for an HTTP domain.
+
+    """
+
+    return '''NameVirtualHost *:80
+<VirtualHost *:80>
+    ServerName %s
+    ServerAlias %s
+
+    # Logfiles
+    ErrorLog %s/log/error.log
+    CustomLog %s/log/access.log combined
+
+    # Proxy
+    %s
+    ProxyPreserveHost On
+    <Proxy *>
+        Order deny,allow
+        Allow from all
+    </Proxy>
+</VirtualHost>
+            ''' % (params['host'], params['host'], params['apps_path'],
+                    params['apps_path'], proxy_lines)
+
+
+@catcherror
+def add_virtual_host(params):
+    """Create the Apache virtual host for the OLD app.
+
+    """
+
+    print 'Modifying Apache virtual hosts file.'
+    tmp_vhs_path = write_updated_virtual_hosts_file_to_tmp(params)
+    if os.path.isfile(params['vh_path']):
+        run_command(['sudo', 'mv', params['vh_path'],
+            '%s_bk' % params['vh_path']])
+        print ('%sThe virtual hosts file %s already existed; we moved the'
+            ' pre-modified version of it to %s_bk.%s' % (ANSI_WARNING,
+            params['vh_path'], params['vh_path'], ANSI_ENDC))
+    result = run_command(['sudo', 'mv', tmp_vhs_path, params['vh_path']])
+    if result.ok:
+        params['actions'].append('virtual hosts file modified')
+    else:
+        print result
+        vhs_content = ''
+        if os.path.isfile(tmp_vhs_path):
+            with open(tmp_vhs_path) as f:
+                vhs_content = f.read()
+        abort(params)
+        if vhs_content:
+            sys.exit('%sUnable to configure the virtual host. Maybe you can do'
+                ' it manually. The file at %s should look like this:'
+                '\n\n%s%s' % (ANSI_FAIL, params['vh_path'], vhs_content, ANSI_ENDC))
+        else:
+            sys.exit('%sUnable to configure the virtual host.%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+
+    # If not enabled, we enable the virtual hosts config file here.
+    enable_virtual_hosts_config(params)
+
+    if response_cache_enabled(params, get_virtual_host_olds(params)):
+        create_cache_cleaner_cronjob(params)
+
+
+def reapply_virtual_hosts(params, global_state):
+    """Regenerate the virtual hosts file of each OLD in `global_state` with the
+    current settings (one file at a time, replacing it and keeping the
+    previous version at <vh_path>_bk), then gracefully restart Apache once.
+
+    """
+
+    print '\n%sVirtual Hosts Regenerator.%s' % (ANSI_HEADER, ANSI_ENDC)
+    vh_paths = sorted(set(o['vh_path'] for o in global_state))
+    for vh_path in vh_paths:
+        old = [o for o in global_state if o['vh_path'] == vh_path][-1]
+        regenerate_virtual_hosts_file(params, old)
+    graceful_apache()
+    print 'Done.'
+
+
+def enable_virtual_hosts_config(params):
+    """If the user-specified Apache virtual hosts config file is not enabled,
+    we enable it here.
+
+    WARNING: this is very brittle as it assumes that we can check if a config
+    file is enabled simply by replacing 'sites-available' in its path with
+    'sites-enabled' and checking if that path points to a file.
+
+    """
+
+    fail_msg = ('%sUnable to enable your Apache virtual hosts config'
+        ' file. Do it manually by running `sudo a2ensite ` followed'
+        ' by the name of your virtual hosts config file.%s' % (
+        ANSI_WARNING, ANSI_ENDC))
+    if not os.path.isfile(params['vh_path'].replace('sites-available',
+        'sites-enabled')):
+        try:
+            print 'Enabling the Apache virtual hosts config file.'
+            vh_name = os.path.split(params['vh_path'])[1]
+            result = run_command(['sudo', 'a2ensite', vh_name])
+            if not result.ok:
+                print result
+                print fail_msg
+        except:
+            print fail_msg
+
+
+def restore_virtual_hosts_file(params):
+    """Restore the Apache virtual hosts file to its previous state and restart
+    Apache.
+
+    """
+
+    try:
+        print 'Restoring Apache virtual hosts file.'
+        fail_msg = ('%sUnable to restore virtual hosts file. You should manually'
+            ' remove any lines that contain ProxyPass /%s/ or ProxyPassReverse /%s/'
+            ' from the file %s and then run `sudo /etc/init.d/apache2 restart`.%s' % (
+            ANSI_WARNING, params['old_dir_name'], params['old_dir_name'],
+            params['vh_path'], ANSI_ENDC))
+        if os.path.isfile('%s_bk' % params['vh_path']):
+            result = run_command(['sudo', 'mv', '%s_bk' % params['vh_path'],
+                params['vh_path']])
+            if result.ok:
+                restart_apache(params)
+            else:
+                print result
+                print fail_msg
+        else:
+            print fail_msg
+    except:
+        print ('%sSomething may have gone wrong when attempting to restore the'
+            ' virtual hosts file %s. Please check that it is no longer proxying'
+            ' requests to %s.%s' % (ANSI_WARNING, params['vh_path'],
+            params['old_dir_name'], ANSI_ENDC))
+
+
+@catcherror
+def restart_apache(params):
+    """Restart the Apache2 server so that the new virtual hosts file can take
+    effect.
+
+    """
+
+    print 'Restarting the Apache server.'
+    result = run_command(['sudo', '/etc/init.d/apache2', 'restart'])
+    if not result.ok:
+        print result
+        print ('%sUnable to restart Apache. Do it manually by running `sudo'
+            ' /etc/init.d/apache2 restart`.%s' % (ANSI_WARNING, ANSI_ENDC))
+
+
+def get_available_ports(params):
+    """Inspect the file at `params['vh_path']` and return the list of AVAILABLE ports,
+    i.e., those that neither it nor a slot in the pool uses.
+
+    """
+
+    all_ports = map(str, range(PORT_START, PORT_END + 1))
+    used_ports = get_used_ports(params) + get_pool_ports()
+    return [p for p in all_ports if p not in used_ports]
+
+
+def get_used_ports(params):
+    """Inspect the file at `params['vh_path']` and return the list of USED ports.
+
+    """
+
+    ports = set()
+    if os.path.isfile(params['vh_path']):
+        with open(params['vh_path']) as f:
+            for line in f:
+                match = re.search('://localhost:(\d+)', line)
+                if match:
+                    ports.add(match.group(1))
+    return list(ports)
+
+
+def add_optparser_options(parser):
+    """Add options to the optparser parser.
+
+    """
+
+    parser.add_option("--mysql-username", dest="mysql_user",
+        metavar="MYSQL_USER",
+        help="The username of a MySQL user that can create and drop"
+        " databases, alter them, and perform CRUD operations on tables.")
+
+    parser.add_option("--mysql-password", dest="mysql_pwd",
+        metavar="MYSQL_PWD",
+        help="The password of the MySQL user.")
+
+    parser.add_option("--config-file", dest="config_file",
+        metavar="CONFIG_FILE",
+        help="Path to a JSON file containing an object with any of the"
+            " following keys: 'mysql_user', 'paster_path', 'apps_path',"
+            " 'vh_path', 'host', 'ssl_crt_path', 'ssl_key_path', or"
+            " 'ssl_pem_path'. If present, these values will be used when"
+            " their corresponding options are not supplied.")
+
+    parser.add_option("--paster_path", dest="paster_path",
+        metavar="PASTER_PATH",
+        help="The path to the paster program. Defaults to 'paster'.")
+
+    parser.add_option("--apps-path", dest="apps_path",
+        metavar="APPS_PATH",
+        help="Path of the directory where you want the OLD app to be installed.")
+
+    parser.add_option("--virtual-hosts-path", dest="vh_path",
+        metavar="VH_PATH",
+        help="Path to the Apache virtual hosts config file. This file may exist"
+            " but it doesn't need to; this script will create it, if needed."
+            " Defaults to a file with the same name as HOST located in"
+            " /etc/apache2/sites-available/.")
+
+    parser.add_option("--host", dest="host", metavar="HOST",
+        help="The host name of the URL of this OLD. E.g., www.myoldurl.com")
+
+    parser.add_option("--destroy", dest="destroy",
+            action="store_true", default=False, metavar="DESTROY",
+            help="Use this option to change this program from a builder to a"
+            " destroyer. If buildold.py has created the target OLD, it will be"
+            " destroyed: it will stop being served, its directories will be"
+            " deleted, and its MySQL database will be dropped. USE WITH EXTREME"
+            " CAUTION.")
+
+    parser.add_option("--clone", dest="clone", nargs=2,
+        metavar="SOURCE TARGET",
+        help="Build a new OLD named TARGET as a copy of the OLD named SOURCE"
+            " (which must have been built by buildold.py), including its"
+            " database and files, and serve it. The database is copied without"
+            " locking SOURCE's tables, each table as of when it is copied.")
+
+    parser.add_option("--hosts-file", dest="hosts_file",
+        metavar="HOSTS_FILE",
+        help="Path to a JSON file listing the hosts that OLDs can be built on."
+            " Each host is an object with a 'name', an 'executor' ('local',"
+            " 'ssh' or 'directory'), an 'ssh' target, a 'root' directory to"
+            " run buildold.py in, the 'args' to pass to it there (e.g., a"
+            " --config-file) and, optionally, 'capacity' values that override"
+            " the probed ones. With this option, the OLD is built on the least"
+            " loaded host whose MySQL server can take its connection pool.")
+
+    parser.add_option("--place-on", dest="place_on", metavar="PLACE_ON",
+        help="Build on the named host in the --hosts-file, if it can admit"
+            " the OLD.")
+
+    parser.add_option("--plan", dest="plan",
+        action="store_true", default=False, metavar="PLAN",
+        help="Print the capacity of the hosts in the --hosts-file and the host"
+            " that an OLD would be built on, without building it; with"
+            " --apply, print what would be done, without doing it.")
+
+    parser.add_option("--apply", dest="apply", metavar="DESIRED",
+        help="Bring this host in line with the OLDs described in the JSON file"
+            " DESIRED, building the missing OLDs and taking only the missing"
+            " or changed steps for the built ones.")
+
+    parser.add_option("--server-backend", dest="server_backend",
+        type="choice", choices=sorted(SERVERS), metavar="SERVER_BACKEND",
+        help="The server to serve the OLD with: 'paster' (the default),"
+            " 'waitress' or 'gunicorn'. Defaults to the 'backend' of the"
+            " 'server' object of the config file, if any.")
+
+    parser.add_option("--service-manager", dest="service_manager",
+        type="choice", choices=['sysv', 'systemd'], metavar="SERVICE_MANAGER",
+        help="How the OLD is kept running: 'sysv' (the default: an init"
+            " script and a restart cronjob) or 'systemd' (a unit with a"
+            " restart policy and resource limits). Defaults to the config"
+            " file's 'service_manager', if any.")
+
+    parser.add_option("--print-systemd-unit", dest="print_systemd_unit",
+        action="store_true", default=False, metavar="PRINT_SYSTEMD_UNIT",
+        help="Print the systemd unit for the named OLD, without installing"
+            " it.")
+
+    parser.add_option("--switch-server", dest="switch_server",
+        action="store_true", default=False, metavar="SWITCH_SERVER",
+        help="Switch the named OLD to the server given by --server-backend.")
+
+    parser.add_option("--reapply-vhosts", dest="reapply_vhosts",
+        action="store_true", default=False, metavar="REAPPLY_VHOSTS",
+        help="Regenerate the Apache virtual hosts files of all of the OLDs"
+            " built here, e.g., to apply changes to the 'proxy',"
+            " 'response_cache' or 'static_files' settings of the config file,"
+            " and gracefully restart Apache.")
+
+    parser.add_option("--purge-cache", dest="purge_cache",
+        action="store_true", default=False, metavar="PURGE_CACHE",
+        help="Delete the named OLD's responses from Apache's response cache.")
+
+    parser.add_option("--suspend-idle", dest="suspend_idle",
+        action="store_true", default=False, metavar="SUSPEND_IDLE",
+        help="Stop each OLD that has not received a request for"
+            " --idle-minutes minutes and put an activator on its port that"
+            " starts it again on the next request. Run this from cron every"
+            " few minutes.")
+
+    parser.add_option("--idle-minutes", dest="idle_minutes", type="int",
+        metavar="IDLE_MINUTES",
+        help="How long an OLD must be idle before --suspend-idle suspends it."
+            " Defaults to 60.")
+
+    parser.add_option("--activate", dest="activate",
+        action="store_true", default=False, metavar="ACTIVATE",
+        help="Run the activator of the named OLD: listen on its port and start"
+            " it on the first connection. --suspend-idle runs this for you.")
+
+    parser.add_option("--fill-pool", dest="fill_pool",
+        action="store_true", default=False, metavar="FILL_POOL",
+        help="Pre-build generic OLDs (pool slots) until there are --pool-size"
+            " of them. Building an OLD claims one of these, if there is one,"
+            " and refills the pool in the background.")
+
+    parser.add_option("--drain-pool", dest="drain_pool",
+        action="store_true", default=False, metavar="DRAIN_POOL",
+        help="Destroy the pool slots.")
+
+    parser.add_option("--pool-size", dest="pool_size", type="int",
+        metavar="POOL_SIZE",
+        help="The number of slots that --fill-pool keeps ready. Defaults to the"
+            " config file's 'pool_size', if any, else %d." % POOL_SIZE)
+
+    add_query_options(parser)
+
+    parser.add_option("--dative-servers-path", dest="dative_servers_path",
+        metavar="DATIVE_SERVERS_PATH",
+        help="Path of a Dative servers JSON file (like the one written by"
+            " --dative-servers) that should be kept up to date automatically:"
+            " each build adds the new OLD to it and each destroy removes the"
+            " destroyed OLD from it. If the config file also specifies a"
+            " 'dative_servers_url' (e.g., '/servers.json'), the virtual host"
+            " serves the file at that URL path with caching headers.")
+
+    parser.add_option("--backup", dest="backup",
+        action="store_true", default=False, metavar="BACKUP",
+        help="Back up the MySQL database and files of the named OLD or, if no"
+            " name is given, of all OLDs built here that match the --filter-*"
+            " and --built-* options. Only the files changed since the last"
+            " backup are archived.")
+
+    parser.add_option("--backup-dir", dest="backup_dir",
+        metavar="BACKUP_DIR",
+        help="The directory that --backup writes to. Defaults to ./backups.")
+
+    parser.add_option("--backup-workers", dest="backup_workers", type="int",
+        default=4, metavar="BACKUP_WORKERS",
+        help="The number of OLDs that --backup backs up at once. Defaults to"
+            " 4.")
+
+    parser.add_option("--backup-nice", dest="backup_nice", type="int",
+        default=10, metavar="BACKUP_NICE",
+        help="The niceness of the dump, archive and compression processes run"
+            " by --backup; they also run in the idle I/O scheduling class."
+            " Defaults to 10.")
+
+    parser.add_option("--full-backup", dest="full_backup",
+        action="store_true", default=False, metavar="FULL_BACKUP",
+        help="Archive all of the OLDs' files, not just those that have changed"
+            " since the last backup.")
+
+    parser.add_option("--ssl-crt-path", dest="ssl_crt_path",
+        metavar="SSL_CRT_PATH",
+        help="Path to your SSL .crt file.")
+
+    parser.add_option("--ssl-pem-path", dest="ssl_pem_path",
+        metavar="SSL_PEM_PATH",
+        help="Path to your SSL .pem file, i.e., the intermediate certificate,"
+            " the one that Apache calls the SSLCertificateChainFile.")
+
+    parser.add_option("--ssl-key-path", dest="ssl_key_path",
+        metavar="SSL_KEY_PATH",
+        help="Path to your SSL .key file.")
+
+
+def get_config_from_file(options):
+    """If the user specified a value for the --config-file option, attempt to
+    parse the JSON of this file and return it as a dict.
+
+    """
+
+    config_from_file = {}
+    config_file = getattr(options, 'config_file', None)
+    if config_file:
+        if os.path.isfile(config_file):
+            try:
+                config_from_file = json.load(open(config_file))
+                assert type(config_from_file) is type({})
+            except Exception, e:
+                config_from_file = {}
+    return config_from_file
+
+
+def prompt_for_name(p):
+    """Prompt the user for an OLD name if we don't have one.
+
+    """
+
+    if not p['old_name']:
+        prompt, fail_msg = {
+            True: ('%sPlease enter the name of the OLD that you want to'
+                ' destroy:%s ' % (ANSI_WARNING, ANSI_ENDC),
+                '%sYou must provide the name of the OLD to destroy.%s' % (
+                ANSI_FAIL, ANSI_ENDC)),
+            False: ('%sPlease enter a name for the OLD that you want to build'
+                ' (use only letters, numbers and/or the underscore):%s ' % (
+                ANSI_WARNING, ANSI_ENDC),
+                '%sYou must provide a name for the OLD that you want to'
+                ' build.%s' % (ANSI_FAIL, ANSI_ENDC))}[p['destroy']]
+        p['old_name'] = raw_input(prompt)
+        if not p['old_name']:
+            sys.exit(fail_msg)
+
+
+def prompt_for_mysql_user(p):
+    """Prompt user for MySQL username, if we don't have it yet.
+
+    """
+
+    if not p['mysql_user']:
+        p['mysql_user'] = raw_input('%sPlease enter the username of a MySQL'
+            ' user with sufficient privileges:%s ' % (ANSI_WARNING, ANSI_ENDC))
+        if not p['mysql_user']:
+            sys.exit('%sYou must provide a MySQL username.%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+
+
+def prompt_for_mysql_password(p):
+    """Prompt user for MySQL password, if we don't have it yet.
+
+    """
+
+    if not p['mysql_pwd']:
+        p['mysql_pwd'] = getpass.getpass('%sPlease enter the password for the'
+            ' MySQL user %s:%s ' % (ANSI_WARNING, p['mysql_user'], ANSI_ENDC))
+        if not p['mysql_pwd']:
+            sys.exit('%sYou must provide the MySQL user\'s password.%s' % (
+                ANSI_FAIL, ANSI_ENDC))
+
+
+def validate_mysql_credentials(params):
+    """Check if we can actually access MySQL with the provided credentials;
+    also check if we have sufficient privileges to do what we need to do.
+
+    WARNING: requiring that the output to 'SHOW GRANTS;' contain "GRANT ALL
+    PRIVILEGES ON *.* TO '<mysql-user>'" might be too stringent.
+
+    """
+
+    result = run_mysql(params, 'show grants;')
+    if 'Access denied' in result.output:
+        sys.exit('%sSorry, we cannot access MySQL with user %s and the provided'
+            ' password.%s' % (ANSI_FAIL, params['mysql_user'], ANSI_ENDC))
+    elif not result.ok:
+        sys.exit('%sSorry, we cannot access MySQL: %s%s' % (ANSI_FAIL, result,
+            ANSI_ENDC))
+    elif "GRANT ALL PRIVILEGES ON *.* TO '%s'" % params['mysql_user'] not in \
+            result.output:
+        print 'INSUFF PRIV'
+        sys.exit('%sSorry, user %s does not have sufficient MySQL privileges to'
+            ' build an OLD.%s' % (ANSI_FAIL, params['mysql_user'], ANSI_ENDC))
+
+
+def get_params():
+    """Get parameters based on the arg and/or options entered at the command
+    line. Prompt the user for missing params, as needed. Fail if we cannot
+    acquire valid params.
+
+    """
+
+    usage = "usage: ./%prog old-name [options]"
+    parser = optparse.OptionParser(usage)
+    add_optparser_options(parser)
+    (options, args) = parser.parse_args()
+    try:
+        old_name = args[0]
+    except:
+        old_name = None
+    clone_source = None
+    if options.clone:
+        clone_source, old_name = options.clone
+    conf = get_config_from_file(options)
+    p = {
+        'old_name': old_name,
+        'config_file': options.config_file and os.path.abspath(
+            options.config_file),
+        'mysql_user': options.mysql_user or conf.get('mysql_user'),
+        'mysql_pwd': options.mysql_pwd,
+        'paster_path': options.paster_path or conf.get('paster_path'),
+        'apps_path': options.apps_path or conf.get('apps_path'),
+        'vh_path': options.vh_path or conf.get('vh_path'),
+        'ssl_crt_path': options.ssl_crt_path or conf.get('ssl_crt_path'),
+        'ssl_key_path': options.ssl_key_path or conf.get('ssl_key_path'),
+        'ssl_pem_path': options.ssl_pem_path or conf.get('ssl_pem_path'),
+        'host': options.host or conf.get('host'),
+        'dative_servers_path': (options.dative_servers_path or
+            conf.get('dative_servers_path')),
+        'dative_servers_url': conf.get('dative_servers_url'),
+        'dative_servers_max_age': conf.get('dative_servers_max_age'),
+        'logrotate': conf.get('logrotate'),
+        'static_files': conf.get('static_files', False),
+        'static_files_max_age': conf.get('static_files_max_age'),
+        'response_cache': conf.get('response_cache'),
+        'proxy': conf.get('proxy'),
+        'server': conf.get('server'),
+        'server_backend': (options.server_backend or
+            (conf.get('server') or {}).get('backend') or 'paster'),
+        'switch_server': options.switch_server,
+        'service_manager': (options.service_manager or
+            conf.get('service_manager') or 'sysv'),
+        'systemd': conf.get('systemd'),
+        'print_systemd_unit': options.print_systemd_unit,
+        'reapply_vhosts': options.reapply_vhosts,
+        'olds_config': conf.get('olds'),
+        'purge_cache': options.purge_cache,
+        'destroy': options.destroy,
+        'clone_source': clone_source,
+        'suspend_idle': options.suspend_idle,
+        # Not from the config file: the hosts' buildold.py may well be run
+        # with the same one, and would then place the OLD again.
+        'hosts_file': options.hosts_file,
+        'place_on': options.place_on,
+        'plan': options.plan,
+        'pool_connections': conf.get('pool_connections', POOL_CONNECTIONS),
+        'mysql_reserved_connections': conf.get('mysql_reserved_connections',
+            MYSQL_RESERVED_CONNECTIONS),
+        'idle_minutes': (options.idle_minutes or conf.get('idle_minutes') or
+            60),
+        'activate': options.activate,
+        'list': options.list,
+        'dative_servers': options.dative_servers,
+        'filter_host': options.filter_host,
+        'filter_ports': options.filter_ports,
+        'built_after': options.built_after,
+        'built_before': options.built_before,
+        'format': options.format,
+        'backup': options.backup,
+        'apply': options.apply,
+        'fill_pool': options.fill_pool,
+        'drain_pool': options.drain_pool,
+        'pool_size': (options.pool_size or conf.get('pool_size') or
+            POOL_SIZE),
+        'backup_dir': (options.backup_dir or conf.get('backup_dir') or
+            'backups'),
+        'backup_workers': options.backup_workers,
+        'backup_nice': options.backup_nice,
+        'full_backup': options.full_backup,
+        'actions': [] # remembers what we've done, in case abort needed.
+    }
+
+    # If the user wants to list all of the OLDs installed, we exit here--don't
+    # need a name. These read-only queries use the index, not the state.
+    if p['list'] or p['dative_servers']:
+        return p, None
+
+    # Printing an OLD's systemd unit only needs its name and the state.
+    if p['print_systemd_unit']:
+        prompt_for_name(p)
+        return p, get_state()
+
+    # Switching an OLD's server only needs its name and the state.
+    if p['switch_server']:
+        prompt_for_name(p)
+        if not options.server_backend:
+            sys.exit('%sYou must specify the server to switch to with'
+                ' --server-backend.%s' % (ANSI_FAIL, ANSI_ENDC))
+        return p, get_state()
+
+    # Regenerating the virtual hosts files needs the state and the SSL paths,
+    # which the state does not record.
+    if p['reapply_vhosts']:
+        for key in ['ssl_crt_path', 'ssl_key_path', 'ssl_pem_path']:
+            if not p[key]:
+                sys.exit('%sYou must provide the %s in an option or the config'
+                    ' file.%s' % (ANSI_FAIL, key, ANSI_ENDC))
+        return p, get_state()
+
+    # Purging an OLD's cached responses only needs its name and the state.
+    if p['purge_cache']:
+        prompt_for_name(p)
+        return p, get_state()
+
+    # Suspending and activating OLDs only need the state.
+    if p['suspend_idle']:
+        return p, get_state()
+    if p['activate']:
+        prompt_for_name(p)
+        return p, get_state()
+
+    # Backups only need MySQL credentials; the OLD name is optional.
+    if p['backup']:
+        prompt_for_mysql_user(p)
+        prompt_for_mysql_password(p)
+        return p, None
+
+    # Filling and draining the pool need the apps and virtual hosts paths
+    # (which the slots belong to) and MySQL credentials.
+    if p['fill_pool'] or p['drain_pool']:
+        for key in ['apps_path', 'vh_path']:
+            if not p[key]:
+                sys.exit('%sYou must provide the %s in an option or the config'
+                    ' file.%s' % (ANSI_FAIL, key, ANSI_ENDC))
+        prompt_for_mysql_user(p)
+        prompt_for_mysql_password(p)
+        validate_mysql_credentials(p)
+        if not p['paster_path']:
+            p['paster_path'] = 'paster'
+        return p, None
+
+    # Reconciling needs MySQL credentials (to list the databases) and the
+    # state; what building the missing OLDs needs is checked once we know
+    # whether any are missing.
+    if p['apply']:
+        prompt_for_mysql_user(p)
+        prompt_for_mysql_password(p)
+        validate_mysql_credentials(p)
+        if not p['paster_path']:
+            p['paster_path'] = 'paster'
+        return p, get_state()
+
+    # Placing an OLD on one of several hosts needs its name and MySQL
+    # credentials (to read each server's max_connections); the chosen host's
+    # buildold.py does the rest.
+    if p['hosts_file'] and not (p['destroy'] or p['clone_source']):
+        if not p['plan']:
+            prompt_for_name(p)
+        if p['mysql_user']:
+            prompt_for_mysql_password(p)
+        return p, None
+
+    global_state = get_state()
+
+    # Prompt user for an OLD name if we don't have one.
+    prompt_for_name(p)
+
+    # If we're destroying an OLD, all we need it its name.
+    if p['destroy']:
+        return p, global_state
+
+    # Prompt the user for the apps path, if we don't have it yet.
+    if not p['apps_path']:
+        p['apps_path'] = raw_input('%sPlease enter the path of the directory'
+            ' where you want your OLD\'s files to be written. This script will'
+            ' create the directory, if needed:%s ' % (ANSI_WARNING, ANSI_ENDC))
+        if not p['apps_path']:
+            sys.exit('%sYou must specify the directory where the OLD app\'s'
+                ' directory will be located.%s' % (ANSI_FAIL, ANSI_ENDC))
+
+    # Exit if the OLD name is invalid
+    if not re.search('^\w+$', p['old_name'].strip()):
+        sys.exit('%sYour OLD name can only contain letters, numbers'
+            ' and/or the underscore.%s' % (ANSI_FAIL, ANSI_ENDC))
+
+    # Exit if the OLD name is already in use.
+    if old_already_exists(p):
+        sys.exit('%sThere is already an OLD with the name %s installed here.'
+            ' Please try again with a different name.%s' % (ANSI_FAIL,
+            p['old_name'], ANSI_ENDC))
+
+    # Prompt user for MySQL username, if we don't have it yet.
+    prompt_for_mysql_user(p)
+    prompt_for_mysql_password(p)
+    validate_mysql_credentials(p)
+
+    # Prompt user for path to Paster executable, if we don't have it yet.
+    if not p['paster_path']:
+        p['paster_path'] = raw_input('%sPlease tell us where the paste'
+            ' executable is; type nothing if it\'s in your PATH and can be'
+            ' accessed with \'paster\':%s' % (ANSI_WARNING, ANSI_ENDC))
+        if not p['paster_path']:
+            p['paster_path'] = conf.get('paster_path', 'paster')
+
+    # Check if paster is really available at the specified path.
+    if not which(p['paster_path']):
+        sys.exit('%sSorry, there is no (paster) executable at %s.'
+            ' Please install Paste and tell us where it is.%s' % (
+            ANSI_FAIL, p['paster_path'], ANSI_ENDC))
+
+    # Exit if the OLD name corresponds to an already-existing MySQL database
+    p['old_dir_name'] = get_dir_name_from_old_name(p['old_name'])
+    if database_already_exists(p['old_dir_name'], p['mysql_user'],
+        p['mysql_pwd']):
+        sys.exit('%sThere is already a MySQL database with the name %s. Please'
+            ' choose a name for your OLD other than %s.%s' % (ANSI_FAIL,
+            p['old_dir_name'], p['old_name'], ANSI_ENDC))
+
+    # Exit if this script has already built an OLD with this name.
+    exists = len([old_p for old_p in global_state
+        if old_p['old_dir_name'] == p['old_dir_name']]) > 0
+    if exists:
+        sys.exit('%sThis script has already installed an OLD with the name %s.'
+            ' Please try again with a different name.%s' % (ANSI_FAIL,
+            p['old_name'], ANSI_ENDC))
+
+    # Prompt the user for the host, if we don't have it yet.
+    if not p['host']:
+        p['host'] = raw_input('%sPlease enter the host name of the URL where'
+            ' your OLD will be served, e.g., something like'
+            ' "www.myoldurl.com":%s ' % (ANSI_WARNING, ANSI_ENDC))
+        if not p['host']:
+            sys.exit('%sYou must provide a host value.%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+
+    # Prompt the user for the virtual hosts path, if we don't have it yet.
+    if not p['vh_path']:
+        default = '/etc/apache2/sites-available/%s' % p['host']
+        p['vh_path'] = raw_input('%sPlease enter the path for the Apache'
+            ' virtual hosts path for this OLD. We will use %s if you enter'
+            ' nothing:%s ' % (ANSI_WARNING, default, ANSI_ENDC))
+        if not p['vh_path']:
+            p['vh_path'] = default
+
+    # Prompt the user for the SSL .crt file path, if we don't have it yet.
+    if not p['ssl_crt_path']:
+        p['ssl_crt_path'] = raw_input('%sPlease enter the absolute path to'
+            ' your SSL .crt file:%s ' % (ANSI_WARNING, ANSI_ENDC))
+        if not p['ssl_crt_path']:
+            sys.exit('%sYou must provide a SSL .crt file path%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+
+    # Prompt the user for the SSL .key file path, if we don't have it yet.
+    if not p['ssl_key_path']:
+        p['ssl_key_path'] = raw_input('%sPlease enter the absolute path to'
+            ' your SSL .key file:%s ' % (ANSI_WARNING, ANSI_ENDC))
+        if not p['ssl_key_path']:
+            sys.exit('%sYou must provide a SSL .key file path%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+
+    # Prompt the user for the SSL .key file path, if we don't have it yet.
+    if not p['ssl_pem_path']:
+        p['ssl_pem_path'] = raw_input('%sPlease enter the absolute path to'
+            ' your SSL .pem file:%s ' % (ANSI_WARNING, ANSI_ENDC))
+        if not p['ssl_pem_path']:
+            sys.exit('%sYou must provide a SSL .pem file path%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+
+    return p, global_state
+
+
+def old_already_exists(params):
+    """Return `True` if there is already an OLD installed here with name `old_name`.
+
+    """
+
+    return get_dir_name_from_old_name(params['old_name']) in \
+        get_old_dirs(params)
+
+
+def get_old_dirs(params):
+    """Return the list of directories in params['apps_path']. These should only
+    be OLD-containing directories.
+
+    """
+
+    existing_old_dirs = []
+    if os.path.isdir(params['apps_path']):
+        existing_old_dirs = [o for o in os.listdir(params['apps_path']) if
+            os.path.isdir(os.path.join(params['apps_path'], o))]
+    return existing_old_dirs
+
+
+def create_directory_safely(path):
+    """Create a directory. If `path` is an existing file, fail. If `path` is an
+    existing directory, return `path`. If `path` doesn't exist, create it and
+    return `path`.
+
+    """
+
+    if os.path.isfile(path):
+        raise DirPathIsFile
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def get_next_available_port(params):
+    """Get the next available port for creating OLDs with.
+
+    """
+
+    available_ports = get_available_ports(params)
+    if available_ports:
+        return available_ports[0]
+    else:
+        abort(params)
+        sys.exit('%sAborting: no more ports available; you are already using'
+            ' ports %s through %s.%s' % (ANSI_FAIL, PORT_START, PORT_END,
+            ANSI_ENDC))
+
+
+def get_dir_name_from_old_name(old_name):
+    """Given the user-supplied OLD name, return the name that we will use for
+    the directory that holds the files of this new OLD.
+
+    """
+
+    return '%sold' % old_name.lower()
+
+
+@catcherror
+def create_dirs(params):
+    """Create the directories needed to build the OLD.
+
+    """
+
+    print 'Creating directories.'
+    log_path = os.path.join(params['old_path'], 'log')
+    general_log_path = os.path.join(params['apps_path'], 'log')
+    create_directory_safely(params['apps_path'])
+    create_directory_safely(general_log_path)
+    create_directory_safely(params['old_path'])
+    create_directory_safely(log_path)
+    params['actions'].append('created old directory')
+
+
+@catcherror
+def make_config(params):
+    """Get Python Paster to create the production.ini config file for the new
+    OLD.
+
+    """
+
+    print 'Creating the OLD config file.'
+    cnf_pth = os.path.join(params['old_path'], 'production.ini')
+    result = run_command([params['paster_path'], 'make-config',
+        'onlinelinguisticdatabase', cnf_pth])
+    if not result.ok or not os.path.isfile(cnf_pth):
+        print result
+        abort(params)
+        sys.exit('%sUnable to create the OLD config file. Aborting.%s' % (
+            ANSI_FAIL, ANSI_ENDC))
+
+
+def __get_serve_command__(params):
+    """Return the string of the command that serves this OLD.
+
+    """
+
+    # pid_pth = os.path.join(params['old_path'], 'old.pid')
+    # log_pth = os.path.join(params['old_path'], 'log', 'paster-old.log')
+    # cnf_pth = os.path.join(params['old_path'], 'production.ini')
+    pid_pth = 'old.pid'
+    log_pth = os.path.join('log', 'paster-old.log')
+    cnf_pth = 'production.ini'
+    return ('cd %s; %s serve --daemon --pid-file=%s --log-file=%s %s' % (
+        params['old_path'], params['paster_path'], pid_pth, log_pth, cnf_pth))
+
+
+def get_process_cmdline(pid):
+    """Return the command line (a list) of the live process `pid`, from
+    /proc/<pid>/cmdline, or `None` if there is no such process (or it is a
+    zombie).
+
+    """
+
+    try:
+        with open('/proc/%d/cmdline' % pid) as f:
+            return [arg for arg in f.read().split('\0') if arg] or None
+    except IOError:
+        return None
+
+
+def stop_process(pid_path, is_owner, grace):
+    """Stop the process whose pid is in the pid file at `pid_path`, provided
+    that `is_owner` returns `True` given its command line: send it SIGTERM
+    and, if it has not exited after `grace` seconds, SIGKILL. The pid file is
+    removed, also if it is stale (i.e., its process is gone or belongs to
+    something else). Return `True` if the process is no longer running.
+
+    """
+
+    try:
+        pid = int(open(pid_path).read().strip())
+    except (IOError, ValueError):
+        pid = None
+    cmdline = pid and get_process_cmdline(pid)
+
+    def wait(seconds):
+        deadline = time.time() + seconds
+        while get_process_cmdline(pid) == cmdline and time.time() < deadline:
+            time.sleep(0.1)
+        return get_process_cmdline(pid) != cmdline
+
+    if cmdline and is_owner(cmdline):
+        try:
+            os.kill(pid, signal.SIGTERM)
+            if not wait(grace):
+                print '%sProcess %d ignored SIGTERM for %ss; killing it.%s' % (
+                    ANSI_WARNING, pid, grace, ANSI_ENDC)
+                os.kill(pid, signal.SIGKILL)
+                if not wait(COMMAND_KILL_GRACE):
+                    return False
+        except OSError:
+            pass
+    if os.path.isfile(pid_path):
+        os.remove(pid_path)
+    return True
+
+
+def get_shell_stop_command(pid_path, marker, grace):
+    """Return a shell command that does what `stop_process` does, for the init
+    script (which runs under `sh -e`): signal the process in the pid file at
+    `pid_path` if its command line contains `marker`.
+
+    """
+
+    return ('pid=$(cat %(pid)s 2>/dev/null || true); if [ -n "$pid" ] &&'
+        ' grep -qF %(marker)s /proc/$pid/cmdline 2>/dev/null; then kill -TERM'
+        ' $pid || true; i=0; while [ $i -lt %(grace)s ] && kill -0 $pid'
+        ' 2>/dev/null; do sleep 1; i=$((i+1)); done; kill -KILL $pid'
+        ' 2>/dev/null || true; fi; rm -f %(pid)s' % {
+        'pid': pipes.quote(pid_path), 'marker': pipes.quote(marker),
+        'grace': int(grace)})
+
+
+class PasterServer(object):
+    """Serves an OLD with `paster serve --daemon`, i.e., with Paste's threaded
+    HTTP server (the [server:main] of production.ini), which writes the
+    server's pid to old.pid and its output to log/paster-old.log. paster
+    itself refuses to start a server whose pid file names a live process. It is
+    stopped by signalling that process directly (see `stop_process`), rather
+    than by running `paster serve --stop-daemon`.
+
+    """
+
+    name = 'paster'
+    use = 'egg:Paste#http'
+    # The [server:main] options that this server's get_options sets.
+    options = []
+
+    def __init__(self, params):
+        self.params = params
+        self.settings = get_server_settings(params, params)
+        self.pid_path = os.path.join(params['old_path'], 'old.pid')
+        self.log_path = os.path.join(params['old_path'], 'log',
+            'paster-old.log')
+        self.config_path = os.path.join(params['old_path'], 'production.ini')
+
+    def get_command(self, action=None):
+        """Return the command (a list) that serves the OLD or, given an
+        `action` ('start', 'stop' or 'restart'), performs it.
+
+        """
+
+        cmd = [self.params['paster_path'], 'serve', '--daemon',
+            '--pid-file=%s' % self.pid_path, '--log-file=%s' % self.log_path,
+            self.config_path]
+        return cmd + [action] if action else cmd
+
+    def get_shell_command(self, action):
+        """Return the shell command that performs `action` ('start', 'stop' or
+        'restart'), for the cronjob and init script.
+
+        """
+
+        if action == 'stop':
+            return get_shell_stop_command(self.pid_path, self.config_path,
+                self.settings['stop_grace'])
+        if action == 'restart':
+            return '%s; %s' % (self.get_shell_command('stop'),
+                self.get_shell_command('start'))
+        return ' '.join(self.get_command(action))
+
+    def configure(self):
+        """Point the [server:main] section of production.ini at this server.
+
+        """
+
+        set_server_config(self.config_path, self.use, self.get_options())
+
+    def get_options(self):
+        return {}
+
+    def start(self):
+        """Start serving the OLD in a daemon process. Return `True` on success.
+
+        """
+
+        result = run_command(self.get_command(), cwd=self.params['old_path'])
+        if not result.ok:
+            print result
+        return result.ok
+
+    def owns(self, cmdline):
+        """Return `True` if `cmdline` is that of this OLD's server, i.e., it
+        names the OLD's config file, or of the activator standing in for it
+        while it is suspended.
+
+        """
+
+        return self.config_path in cmdline or (
+            '--activate' in cmdline and self.params['old_name'] in cmdline)
+
+    def stop(self):
+        """Stop serving the OLD, giving the server `stop_grace` seconds to
+        exit after SIGTERM. Return `True` on success.
+
+        """
+
+        return stop_process(self.pid_path, self.owns,
+            self.settings['stop_grace'])
+
+    def healthy(self):
+        """Return `True` if the process in the pid file is alive and the OLD's
+        port accepts connections.
+
+        """
+
+        return bool(get_running_pid(self.params)) and port_accepts(
+            get_server_host(self.params), int(self.params['old_port']))
+
+
+class WaitressServer(PasterServer):
+    """Serves an OLD with waitress (which has a larger and more efficient
+    thread pool than Paste's server), by way of `paster serve --daemon` and a
+    [server:main] section that uses egg:waitress#main with `threads` threads.
+
+    """
+
+    name = 'waitress'
+    use = 'egg:waitress#main'
+    options = ['threads']
+
+    def get_options(self):
+        return {'threads': self.settings['threads']}
+
+
+class GunicornServer(PasterServer):
+    """Serves an OLD with gunicorn's pre-fork server: `workers` worker
+    processes, forked after loading the app once (--preload). The [server:main]
+    section of production.ini is ignored; gunicorn binds to the OLD's host and
+    port itself. It refuses to start if its pid file names a live process, and
+    is stopped with SIGTERM, which lets the workers finish their requests. Its
+    process name is the config path, so that a master retitled by
+    setproctitle can still be told apart from other OLDs' masters.
+
+    """
+
+    name = 'gunicorn'
+
+    def get_command(self, action=None):
+        gunicorn_path = self.settings.get('gunicorn_path') or os.path.join(
+            os.path.dirname(self.params['paster_path']), 'gunicorn')
+        return [gunicorn_path, '--paste', self.config_path, '--preload',
+            '--daemon', '--pid', self.pid_path, '--log-file', self.log_path,
+            '--chdir', self.params['old_path'], '--bind', '%s:%s' % (
+            get_server_host(self.params), self.params['old_port']),
+            '--workers', str(self.settings['workers']), '--name',
+            self.config_path]
+
+    def configure(self):
+        pass
+
+    def owns(self, cmdline):
+        # With setproctitle installed, the master is titled 'gunicorn: master
+        # [<config_path>]' (see --name), i.e., a single argument.
+        return PasterServer.owns(self, cmdline) or \
+            self.config_path in ' '.join(cmdline)
+
+
+SERVERS = {
+    'paster': PasterServer,
+    'waitress': WaitressServer,
+    'gunicorn': GunicornServer
+}
+
+
+def get_server_settings(params, old):
+    """Return the server settings for the OLD described by `old`: SERVER
+    updated with the 'server' settings of the config file and the OLD's
+    overrides.
+
+    """
+
+    settings = SERVER.copy()
+    settings.update(get_old_settings(params, old, 'server'))
+    return settings
+
+
+def get_server(params):
+    """Return the server of the OLD described by `params`, as recorded in its
+    `server_backend` (OLDs built before there was a choice use paster).
+
+    """
+
+    return SERVERS[params.get('server_backend') or 'paster'](params)
+
+
+def set_server_config(config_path, use, options):
+    """Set the `use` line of the [server:main] section of the config file at
+    `config_path` to `use`, and set the options in the dict `options` in that
+    section. The options of every other server are removed from it, since,
+    e.g., Paste's server refuses waitress's `threads`.
+
+    """
+
+    server_options = set(options)
+    for server in SERVERS.values():
+        server_options.update(server.options)
+    new_config_file = []
+    in_server_section = False
+    with open(config_path) as fi:
+        for line in fi:
+            line = line.rstrip('\n')
+            if line.startswith('['):
+                in_server_section = line.strip() == '[server:main]'
+            elif in_server_section and \
+                    line.split('=')[0].strip() in server_options:
+                continue
+            elif in_server_section and line.startswith('use ='):
+                line = 'use = %s' % use
+                new_config_file.append(line)
+                for key in sorted(options):
+                    new_config_file.append('%s = %s' % (key, options[key]))
+                continue
+            new_config_file.append(line)
+    with open('%s.tmp' % config_path, 'w') as fo:
+        fo.write('\n'.join(new_config_file))
+    os.rename('%s.tmp' % config_path, config_path)
+
+
+@catcherror
+def configure_server(params):
+    """Configure the OLD for the server that it is to be served with.
+
+    """
+
+    server = get_server(params)
+    print 'Configuring the OLD to be served by %s.' % server.name
+    server.configure()
+
+
+def get_serve_command(params):
+    """Return an array representing the command that serves this OLD.
+
+    """
+
+    return get_server(params).get_command()
+
+
+def start_serving(params):
+    """Start serving the OLD, via its systemd unit if it has one (so that it
+    runs within the unit's resource limits), else with its server directly.
+    Return `True` on success.
+
+    """
+
+    if params.get('service_manager') == 'systemd':
+        return systemctl('start', get_systemd_unit_name(params))
+    return get_server(params).start()
+
+
+@catcherror
+def serve(params):
+    """Serve the OLD app in a daemon process.
+
+    """
+
+    server = get_server(params)
+    print 'Starting the %s server.' % server.name
+    print '\n%s\n' % ' '.join(server.get_command())
+    if start_serving(params):
+        params['actions'].append('served app')
+    else:
+        abort(params)
+        sys.exit('%sSomething went wrong when attempting to serve the OLD.'
+            ' Aborting.%s' % (ANSI_HEADER, ANSI_ENDC))
+
+
+def stop_serving(params):
+    """Stop serving the OLD app.
+
+    """
+
+    server = get_server(params)
+    try:
+        print 'Stopping the %s server.' % server.name
+        if params.get('service_manager') == 'systemd':
+            stopped = systemctl('stop', get_systemd_unit_name(params))
+        else:
+            stopped = server.stop()
+        if not stopped:
+            print ('%sSomething may have gone wrong when attempting to stop the'
+                ' %s server.%s' % (ANSI_HEADER, server.name, ANSI_ENDC))
+    except Exception, e:
+        print 'An error occurred when attempting to stop the %s server' % (
+            server.name)
+        print e
+        print ('%sSomething may have gone wrong when attempting to stop the'
+            ' %s server.%s' % (ANSI_WARNING, server.name, ANSI_ENDC))
+
+
+def switch_server(params, global_state):
+    """Switch the OLD named `params['old_name']` to the server
+    `params['server_backend']`: stop it, reconfigure it, start it with the new
+    server and, once it is healthy, replace its cronjob and init script and
+    record the new server in the state. If it does not become healthy within
+    SERVE_TIMEOUT seconds, switch back.
+
+    """
+
+    print '\n%sOLD Server Switcher.%s' % (ANSI_HEADER, ANSI_ENDC)
+    try:
+        old = [o for o in global_state
+            if o['old_name'] == params['old_name']][0]
+    except IndexError:
+        sys.exit('%sSorry, this script has no record of an OLD named %s.%s' % (
+            ANSI_FAIL, params['old_name'], ANSI_ENDC))
+    # Don't let a failure here abort (i.e., undo) the OLD's build actions.
+    current = dict(old, actions=[])
+    current['olds_config'] = params['olds_config']
+    current['server'] = params['server']
+    new = dict(current, server_backend=params['server_backend'])
+    print 'Switching %s from %s to %s.' % (old['old_name'],
+        get_server(current).name, get_server(new).name)
+    for from_params, to_params in [(current, new), (new, current)]:
+        stop_serving(from_params)
+        configure_server(to_params)
+        if 'systemd unit' in old['actions']:
+            systemd_unit(to_params)
+        server = get_server(to_params)
+        print 'Starting the %s server.' % server.name
+        start_serving(to_params)
+        start = time.time()
+        while time.time() - start < SERVE_TIMEOUT and not server.healthy():
+            time.sleep(0.5)
+        if server.healthy():
+            break
+        print '%sThe %s server did not become healthy within %ss.%s' % (
+            ANSI_WARNING, server.name, SERVE_TIMEOUT, ANSI_ENDC)
+    if to_params is current:
+        sys.exit('%sSwitched %s back to %s.%s' % (ANSI_FAIL, old['old_name'],
+            server.name, ANSI_ENDC))
+    if 'cronjob created' in old['actions']:
+        destroy_cronjob(current)
+        create_cronjob(new)
+    if 'init script' in old['actions']:
+        init_script(new)
+    old['server_backend'] = new['server_backend']
+    write_state(global_state)
+    print 'Done.'
+
+
+def get_cronjob_cmd(params):
+    """Return the Cronjob command to restart the OLD if it has stopped.
+
+    """
+
+    return 'cd %s; %s >/dev/null 2>&1' % (params['old_path'],
+        get_server(params).get_shell_command('start'))
+
+
+@catcherror
+def create_cronjob(params):
+    """Create a crontab to check every minute if the OLD has stopped and
+    restart it if so.
+
+    """
+
+    print 'Enabling cronjob to restart your OLD in case it goes down.'
+    cmd = get_cronjob_cmd(params)
+    crontab = get_crontab()
+    if crontab:
+        cron  = crontab.CronTab(user=True)
+        job = cron.new(command=cmd)
+        job.minute.every(1)
+        job.enable()
+        if True == job.is_valid():
+            params['actions'].append('cronjob created')
+            cron.write()
+        else:
+            print ('%sUnable to enable the OLD restart cronjob. We suggest you'
+                ' put the following line in your crontab: "*/1 * * * * %s".%s' % (
+                ANSI_WARNING, cmd, ANSI_ENDC))
+    else:
+        print ('%sPython-crontab is not installed. You should probably install'
+            ' it (e.g., via `easy_install python-crontab`) before you run this'
+            ' script again. For the OLD that has just been built, we suggest'
+            ' you put the following line in your crontab: "*/1 * * * * %s".%s' % (
+            ANSI_WARNING, cmd, ANSI_ENDC))
+
+
+def destroy_cronjob(params):
+    """Create a crontab to check every minute if the OLD has stopped and
+    restart it if so.
+
+    """
+
+    print 'Destroying cronjob.'
+    try:
+        cmd = get_cronjob_cmd(params)
+        crontab = get_crontab()
+        if crontab:
+            cron  = crontab.CronTab(user=True)
+            for job in cron.find_command(cmd):
+                cron.remove(job)
+            cron.write()
+        else:
+            print ('%sPython-crontab is not installed. You should probably install'
+                ' it (e.g., via `easy_install python-crontab`) before you run this'
+                ' script again. For now, we suggest that you manually remove the'
+                ' following line from your crontab: "* * * * * %s".%s' % (
+                ANSI_WARNING, cmd, ANSI_ENDC))
+    except:
+        print ('%sSorry, something went wrong when attempting to destroy the'
+            ' cronjob. Try to do it yourself.%s' % (ANSI_WARNING, ANSI_ENDC))
+
+
+@catcherror
+def setup_app(params):
+    """Get Python Paster to create the OLD database tables and defaults, i.e.,
+    run `setup-app`.
+
+    """
+
+    print 'Running OLD setup: building tables and entering defaults.'
+    cnf_pth = os.path.join(params['old_path'], 'production.ini')
+    result = run_command([params['paster_path'], 'setup-app', cnf_pth],
+        timeout=LONG_COMMAND_TIMEOUT, cwd=params['old_path'], echo=True)
+    if not result.ok:
+        print result
+        abort(params)
+        sys.exit('%sSomething went wrong when attempting to set up the OLD.'
+            ' Aborting.%s' % (ANSI_HEADER, ANSI_ENDC))
+
+
+@catcherror
+def edit_config(params):
+    """Edit the OLD's config file production.ini:
+
+    - Change the port to `params['port']`
+    - Comment out the SQLite lines and uncomment MySQL lines.
+    - Change the first MySQL so it holds the credentials and correct db name.
+
+    """
+
+    print 'Editing the OLD\'s config file (production.ini).'
+    try:
+        new_config_file = []
+        cnf_pth = os.path.join(params['old_path'], 'production.ini')
+        mysql_line = ('sqlalchemy.url ='
+            ' mysql://%s:%s@localhost:3306/%s?charset=utf8' % (params['mysql_user'],
+            params['mysql_pwd'], params['db_name']))
+        with open(cnf_pth) as fi:
+            for line in fi:
+                if line.startswith('port ='):
+                    new_config_file.append('port = %s' % params['old_port'])
+                elif 'sqlalchemy.url' in line and 'sqlite' in line and \
+                        not line.startswith('#'):
+                    new_config_file.append('# %s' % line.strip())
+                elif 'sqlalchemy.url' in line and 'mysql' in line:
+                    new_config_file.append(mysql_line)
+                elif 'sqlalchemy.pool_recycle' in line:
+                    new_config_file.append('sqlalchemy.pool_recycle = 3600')
+                else:
+                    new_config_file.append(line.strip())
+        with open(cnf_pth, 'w') as fo:
+            fo.write('\n'.join(new_config_file))
+    except Exception, e:
+        print e
+        abort(params)
+        sys.exit('%sSomething went wrong when attempting to edit the OLD\'s'
+            ' config file. Aborting.%s' % (ANSI_HEADER, ANSI_ENDC))
+
+
+@catcherror
+def create_database(params):
+    """Create MySQL database `params['db_name']`.
+
+    """
+
+    print 'Creating MySQL database %s.' % params['db_name']
+    result = run_mysql(params, 'create database %s default character set'
+        ' utf8;' % params['db_name'])
+    try:
+        params['actions'].append('mysql database created')
+        if not result.ok:
+            print result
+            abort(params)
+            if 'database exists' in result.output:
+                sys.exit('%sThe MySQL database %s already exists; please drop'
+                    ' it manually or choose a different name for your'
+                    ' OLD.%s' % (ANSI_FAIL, params['db_name'], ANSI_ENDC))
+            else:
+                sys.exit('%sAn error occurred when attempting to create the'
+                    ' MySQL database %s. Aborting.%s' % (ANSI_FAIL,
+                    params['db_name'], ANSI_ENDC))
+    except:
+        abort(params)
+        sys.exit('%sAn error occurred when attempting to create the'
+            ' MySQL database %s. Aborting.%s' % (ANSI_FAIL, params['db_name'],
+            ANSI_ENDC))
+
+
+def drop_database(params):
+    """Drop the MySQL database corresponding to the OLD encoded in `params`.
+
+    """
+
+    fail_msg = ('%sSomething may have gone wrong when attempting to drop the'
+        ' MySQL database %s. Please check to ensure that it has been'
+        ' dropped.%s' % (ANSI_WARNING, params['db_name'], ANSI_ENDC))
+    try:
+        print 'Dropping MySQL database %s.' % params['db_name']
+        result = run_mysql(params, 'drop database %s;' % params['db_name'])
+        if not result.ok:
+            print result
+            print fail_msg
+    except Exception, e:
+        print e
+        print fail_msg
+
+
+def database_already_exists(db_name, mysql_user, mysql_pwd):
+    """Return `True` if MySQL database `db_name` already exists; `False`
+    otherwise.
+
+    """
+
+    result = run_mysql({'mysql_user': mysql_user, 'mysql_pwd': mysql_pwd},
+        'SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME'
+        ' = \'%s\';' % db_name, '-N')
+    if not result.ok:
+        print result
+        raise DBCheckError
+    return db_name in result.output.split()
+
+
+@catcherror
+def fix_tag_name_col(params):
+    """Change the collation of the MySQL tag table's "name" column to
+    "utf8_bin" so that capitalized duplicate tags can be migrated.
+
+    """
+
+    print 'Setting the tag table\'s "name" colummn to UTF-8 collation.'
+    result = run_mysql(params, 'use %s; alter table tag modify name'
+        ' varchar(255) collate utf8_bin;' % params['db_name'])
+    if not result.ok:
+        abort(params)
+        sys.exit('%sAn error occurred when attempting to create the'
+            ' MySQL database %s. %s. Aborting.%s' % (ANSI_FAIL,
+            params['db_name'], result, ANSI_ENDC))
+
+
+
+def which(program):
+    """Return the path to `program` if it is an executable; otherwise return
+    `None`. From
+    http://stackoverflow.com/questions/377017/test-if-executable-exists-in-python.
+
+    """
+
+    def is_exe(fpath):
+        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+
+    fpath, fname = os.path.split(program)
+    if fpath:
+        if is_exe(program):
+            return program
+    else:
+        for path in os.environ["PATH"].split(os.pathsep):
+            path = path.strip('"')
+            exe_file = os.path.join(path, program)
+            if is_exe(exe_file):
+                return exe_file
+
+    return None
+
+
+def abort(params):
+    """This is called when the script aborts mid-build. It should undo what has
+    been done, in reverse order.
+
+    created old directory -> destroy_old_directory
+    mysql database created -> drop_database
+    served app -> stop_serving
+    virtual hosts file modified -> restore_virtual_hosts_file
+    cronjob created -> destroy_cronjob
+    logrotate config -> remove_logrotate_config
+    systemd unit -> remove_systemd_unit
+    port reserved -> release_port
+
+    """
+
+    actions_taken = params['actions']
+    if 'port reserved' in actions_taken:
+        release_port(params)
+    if 'systemd unit' in actions_taken:
+        remove_systemd_unit(params)
+    if 'logrotate config' in actions_taken:
+        remove_logrotate_config(params,
+            'apache logrotate config' in actions_taken)
+    if 'init script' in actions_taken:
+        remove_init_script(params)
+    if 'cronjob created' in actions_taken:
+        destroy_cronjob(params)
+    if 'virtual hosts file modified' in actions_taken:
+        restore_virtual_hosts_file(params)
+    if 'served app' in actions_taken:
+        stop_serving(params)
+    if 'mysql database created' in actions_taken:
+        drop_database(params)
+    if 'created old directory' in actions_taken:
+        destroy_old_directory(params)
+
+
+def destroy_old_directory(params):
+    """Destroy the OLD directory for the OLD encoded in `params`. Useful for
+    cleaning up an OLD whose build has been aborted because of an error or for
+    destroying an existing OLD.
+
+    """
+
+    try:
+        print 'Destroying directory for the OLD %s.' % params['old_name']
+        if os.path.isdir(params['old_path']):
+            shutil.rmtree(params['old_path'])
+    except:
+        print ('%sSomething may have gone wrong when attempting to destroy the'
+            ' directory %s. Check to ensure that it has been destroyed.%s' % (
+            ANSI_WARNING, params['old_path'], ANSI_ENDC))
+
+
+def save_state(params):
+    """Document the OLD that we have built in our JSON file at `STORE`. This is
+    just good practice. But it will also allow this script to destroy and/or
+    shut down OLDs that it has previously built.
+
+    """
+
+    try:
+        global_state = get_state()
+        params['build_date'] = datetime.datetime.utcnow().isoformat()
+        state = {}
+        for attr in ['actions', 'apps_path', 'build_date', 'db_name', 'host',
+            'mysql_user', 'old_dir_name', 'old_name', 'old_path', 'old_port',
+            'paster_path', 'vh_path', 'dative_servers_path', 'logrotate',
+            'server_backend', 'service_manager']:
+            state[attr] = params.get(attr)
+        global_state.append(state)
+        write_state(global_state)
+    except:
+        print ('%sWarning: an error occurred when attempting to save state to'
+            ' %s. Because of this, this script cannot be used in the future to'
+            ' destroy or shut down this OLD.%s' % (ANSI_WARNING, STORE,
+            ANSI_ENDC))
+
+
+def destroy(params, global_state):
+    """Destroy the OLD with name `params['old_name']`. `global_state` is a list
+    of dicts representing the OLDs that this buildold.py has built.
+
+    Note: we prompt the user to confirm that they want to proceed with the
+    destruction.
+
+    """
+
+    print '\n%sOLD Destroyer.%s' % (ANSI_HEADER, ANSI_ENDC)
+
+    # Check if we have a record of this to-be-destroyed OLD.
+    try:
+        destroyee_params = [o for o in global_state
+            if o['old_name'] == params['old_name']][0]
+    except:
+        sys.exit('%sSorry, this script has no record of an OLD named %s. If it'
+            ' exists, you will need to destroy it manually.%s' % (ANSI_FAIL,
+            params['old_name'], ANSI_ENDC))
+
+    # Make sure the user wants to do this.
+    proceed = raw_input('%sAre you sure that you want to destroy the OLD named'
+        ' %s? THIS CANNOT BE UNDONE. Enter \'y\' or \'Y\' to proceed with the'
+        ' destruction. You may want to backup its database and files, prior'
+        ' to destruction.%s' % (ANSI_WARNING, params['old_name'], ANSI_ENDC))
+    if proceed not in ['y', 'Y']:
+        sys.exit('Aborted, phewf.')
+
+    # Get MySQL password and verify we can access MySQL.
+    params = destroyee_params
+    params['mysql_pwd'] = None
+    prompt_for_mysql_password(params)
+    validate_mysql_credentials(params)
+
+    # Remove the params for the to-be-destroyed OLD from buildold.py's state.
+    global_state = [o for o in global_state
+        if o['old_name'] != params['old_name']]
+    write_state(global_state)
+
+    # Do the destroyin'
+    actions_taken = params['actions']
+    if 'systemd unit' in actions_taken:
+        remove_systemd_unit(params)
+    if 'logrotate config' in actions_taken:
+        remove_logrotate_config(params, not [o for o in global_state
+            if o['apps_path'] == params['apps_path']])
+    if 'init script' in actions_taken:
+        remove_init_script(params)
+    if 'cronjob created' in actions_taken:
+        destroy_cronjob(params)
+    if 'virtual hosts file modified' in actions_taken:
+        restore_virtual_hosts_file(params)
+    if 'served app' in actions_taken:
+        stop_serving(params)
+    if 'mysql database created' in actions_taken:
+        drop_database(params)
+    if 'created old directory' in actions_taken:
+        destroy_old_directory(params)
+    update_dative_servers_file(params, remove=True)
+    print 'Done.'
+
+
+def build(params):
+    """Build an OLD, given `params`.
+
+    """
+
+    print '\n%sOLD Builder.%s' % (ANSI_HEADER, ANSI_ENDC)
+    print 'Building an OLD called %s%s%s.' % (ANSI_OKGREEN, params['old_name'],
+        ANSI_ENDC)
+
+    params['old_path'] = os.path.join(params['apps_path'],
+        params['old_dir_name'])
+    params['db_name'] = params['old_dir_name']
+
+    params['slot'] = take_pool_slot(params)
+    if params['slot']:
+        claim_pool_slot(params)
+        configure_server(params)
+    else:
+        params['old_port'] = reserve_port(params)
+        create_dirs(params)
+        make_config(params)
+        create_database(params)
+        edit_config(params)
+        configure_server(params)
+        setup_app(params)
+        fix_tag_name_col(params)
+    if params['service_manager'] == 'systemd':
+        systemd_unit(params)
+    serve(params)
+    add_virtual_host(params)
+    release_port(params)
+    restart_apache(params)
+    if params['service_manager'] != 'systemd':
+        create_cronjob(params)
+        init_script(params)
+    logrotate_config(params)
+    save_state(params)
+    update_dative_servers_file(params)
+
+    print ('The %s OLD is being served at %shttps://%s/%s%s.\nIts files are'
+        ' stored at %s%s%s.' % (params['old_name'], ANSI_OKGREEN, params['host'],
+        params['old_dir_name'], ANSI_ENDC, ANSI_OKGREEN,
+        os.path.join(params['apps_path'], params['old_dir_name']), ANSI_ENDC))
+    if params['slot']:
+        refill_pool_in_background(params)
+    print 'Done.'
+
+
+@catcherror
+def clone_database(params):
+    """Copy the tables of the MySQL database of the source OLD (described by
+    `params['source']`) into the (empty) database `params['db_name']`. Each table is
+    copied server-side, via `CREATE TABLE ... LIKE` and `INSERT ... SELECT`, so
+    no data passes through this script or a dump file. The copy runs at the
+    READ COMMITTED isolation level, at which the SELECTs read the source
+    without locking it (at MySQL's default, REPEATABLE READ, they would take
+    shared locks that block writes to the source OLD for the whole copy). So
+    each table is copied as of the start of its own INSERT: if the source OLD
+    is written to meanwhile, the clone may mix moments. With the binary log
+    on, this needs row-based logging (MySQL's default since 5.7).
+
+    """
+
+    source = params['source']
+    print 'Copying MySQL database %s to %s.' % (source['db_name'],
+        params['db_name'])
+    fail_msg = ('%sSomething went wrong when attempting to copy the MySQL'
+        ' database %s. Aborting.%s' % (ANSI_FAIL, source['db_name'], ANSI_ENDC))
+    list_tables = run_mysql(params, 'SELECT table_name FROM'
+        ' information_schema.tables WHERE table_schema = \'%s\' AND table_type'
+        ' = \'BASE TABLE\';' % source['db_name'], '-N', '-B')
+    tables = list_tables.output.split()
+    if not list_tables.ok or not tables:
+        print list_tables
+        abort(params)
+        sys.exit(fail_msg)
+    sql = ['SET FOREIGN_KEY_CHECKS = 0;']
+    for table in tables:
+        sql.append('CREATE TABLE `%s`.`%s` LIKE `%s`.`%s`;' % (
+            params['db_name'], table, source['db_name'], table))
+    sql.append('SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED;')
+    for table in tables:
+        sql.append('INSERT INTO `%s`.`%s` SELECT * FROM `%s`.`%s`;' % (
+            params['db_name'], table, source['db_name'], table))
+    copy_tables = run_command(['mysql', '-u', params['mysql_user'],
+        '-p%s' % params['mysql_pwd']], timeout=LONG_COMMAND_TIMEOUT,
+        input='\n'.join(sql))
+    if not copy_tables.ok:
+        print copy_tables
+        abort(params)
+        sys.exit(fail_msg)
+
+
+@catcherror
+def clone_old_directory(params):
+    """Copy the directory of the source OLD (described by `params['source']`) to
+    `params['old_path']`, leaving out its pid file and logs. The (potentially
+    very large) files directory is reflinked where the filesystem supports it
+    and hard-linked otherwise; the OLD never modifies an uploaded file in place,
+    so the two OLDs can safely share them. Everything else is copied.
+
+    """
+
+    source = params['source']
+    print 'Copying the directory of the OLD %s.' % source['old_name']
+    for name in os.listdir(source['old_path']):
+        if name in ['old.pid', 'log']:
+            continue
+        src = os.path.join(source['old_path'], name)
+        dst = os.path.join(params['old_path'], name)
+        if name == 'files':
+            cmds = [['cp', '-a', '--reflink=always', src, dst],
+                ['cp', '-al', src, dst]]
+        else:
+            cmds = [['cp', '-a', '--reflink=auto', src, dst]]
+        for cmd in cmds:
+            copy = run_command(cmd, timeout=LONG_COMMAND_TIMEOUT)
+            if copy.ok:
+                break
+            if os.path.isdir(dst):
+                shutil.rmtree(dst)
+        else:
+            print copy
+            abort(params)
+            sys.exit('%sUnable to copy %s. Aborting.%s' % (ANSI_FAIL, src,
+                ANSI_ENDC))
+
+
+def clone(params, global_state):
+    """Build a new OLD named `params['old_name']` as a copy of the OLD named
+    `params['clone_source']`, including its data and files, and serve it.
+
+    """
+
+    print '\n%sOLD Cloner.%s' % (ANSI_HEADER, ANSI_ENDC)
+    try:
+        source = [o for o in global_state
+            if o['old_name'] == params['clone_source']][0]
+    except IndexError:
+        sys.exit('%sSorry, this script has no record of an OLD named %s.%s' % (
+            ANSI_FAIL, params['clone_source'], ANSI_ENDC))
+    print 'Cloning the OLD %s%s%s as %s%s%s.' % (ANSI_OKGREEN, source['old_name'],
+        ANSI_ENDC, ANSI_OKGREEN, params['old_name'], ANSI_ENDC)
+    start = datetime.datetime.now()
+
+    params['old_port'] = reserve_port(params)
+    params['old_path'] = os.path.join(params['apps_path'],
+        params['old_dir_name'])
+    params['db_name'] = params['old_dir_name']
+
+    params['source'] = source
+
+    create_dirs(params)
+    clone_old_directory(params)
+    create_database(params)
+    clone_database(params)
+    edit_config(params)
+    configure_server(params)
+    if params['service_manager'] == 'systemd':
+        systemd_unit(params)
+    serve(params)
+    add_virtual_host(params)
+    release_port(params)
+    restart_apache(params)
+    if params['service_manager'] != 'systemd':
+        create_cronjob(params)
+        init_script(params)
+    logrotate_config(params)
+    save_state(params)
+    update_dative_servers_file(params)
+
+    print ('The %s OLD is being served at %shttps://%s/%s%s.\nIts files are'
+        ' stored at %s%s%s.' % (params['old_name'], ANSI_OKGREEN, params['host'],
+        params['old_dir_name'], ANSI_ENDC, ANSI_OKGREEN, params['old_path'],
+        ANSI_ENDC))
+    print 'Cloned in %.1fs.' % (datetime.datetime.now() - start).total_seconds()
+    print 'Done.'
+
+
+@catcherror
+def init_script(params):
+    """Create and install a Debian-based init script to restart the OLD in case
+    the server goes down.
+
+    """
+
+    print 'Creating an init script.'
+
+    server = get_server(params)
+    init_name = '%s_init' % params['old_dir_name']
+
+    script = """#!/bin/sh -e
+### BEGIN INIT INFO
+# Provides:          %s
+# Required-Start:    mysql networking
+# Required-Stop:     mysql networking
+# Default-Start:     2 3 4 5
+# Default-Stop:      0 1 6
+# Short-Description: Start an OLD web application daemon at boot time
+# Description:       Start an OLD web application daemon at boot time
+### END INIT INFO
+
+cd %s
+
+case "$1" in
+start)
+    %s
+    ;;
+stop)
+    %s
+    ;;
+restart)
+    %s
+    ;;
+force-reload)
+    %s
+    /etc/init.d/apache2 restart
+    ;;
+*)
+    echo $"Usage: $0 {start|stop|restart|force-reload}"
+    exit 1
+esac
+
+exit 0
+
+    """ % (init_name, params['old_path'],
+            server.get_shell_command('start'),
+            server.get_shell_command('stop'),
+            server.get_shell_command('restart'),
+            server.get_shell_command('restart'))
+
+    tmp_pth = '/tmp/%s' % init_name
+    initd_pth = '/etc/init.d/%s' % init_name
+    with open(tmp_pth, 'w') as f:
+        f.write(script)
+
+    fail_msg = ('Something went wrong when attempting to install the init'
+        ' script. You can try doing it yourself. See'
+        ' http://pylonsbook.com/en/1.1/deployment.html. Also check to see if'
+        ' there is a file at %s and whether it contains errors.' % (
+        initd_pth,))
+
+    for cmd in [['sudo', 'cp', tmp_pth, initd_pth],
+            ['sudo', 'chmod', 'o+x', initd_pth],
+            ['sudo', '/usr/sbin/update-rc.d', '-f', init_name, 'defaults']]:
+        result = run_command(cmd)
+        if not result.ok:
+            print result
+            print fail_msg
+            return
+    params['actions'].append('init script')
+
+
+def remove_init_script(params):
+    """Remove the init script.
+
+    """
+
+    print 'Removing init script.'
+
+    init_name = '%s_init' % params['old_dir_name']
+    initd_pth = '/etc/init.d/%s' % init_name
+    fail_msg = ('%sSomething may have gone wrong when attempting to remove'
+        ' the init script.%s' % (ANSI_WARNING, ANSI_ENDC))
+    if os.path.isfile(initd_pth):
+        for cmd in [['sudo', 'rm', initd_pth],
+                ['sudo', 'update-rc.d', '-f', init_name, 'remove']]:
+            result = run_command(cmd)
+            if not result.ok:
+                print result
+                print fail_msg
+                return
+
+
+def get_logrotate_options(params):
+    """Return the log rotation options: LOGROTATE, updated with any given in
+    the 'logrotate' object of the config file.
+
+    """
+
+    options = LOGROTATE.copy()
+    options.update(params.get('logrotate') or {})
+    return options
+
+
+def get_apache_logrotate_name(apps_path):
+    """Return the name of the logrotate config file for the Apache logs in
+    `apps_path`/log/, which are shared by all the OLDs in `apps_path`.
+
+    """
+
+    return 'buildold_apache_%s' % re.sub(r'\W+', '_', apps_path).strip('_')
+
+
+def install_logrotate_config(name, config):
+    """Install the logrotate config `config` as LOGROTATE_DIR/`name`. Return
+    `True` on success.
+
+    """
+
+    tmp_pth = '/tmp/%s' % name
+    with open(tmp_pth, 'w') as fo:
+        fo.write(config)
+    for cmd in [['sudo', 'cp', tmp_pth, os.path.join(LOGROTATE_DIR, name)],
+            ['sudo', 'chmod', '644', os.path.join(LOGROTATE_DIR, name)]]:
+        result = run_command(cmd)
+        if not result.ok:
+            print result
+            return False
+    os.remove(tmp_pth)
+    return True
+
+
+@catcherror
+def logrotate_config(params):
+    """Install a logrotate config that rotates the OLD's logs (paster-old.log,
+    etc.) and, if there isn't one already, one that rotates the Apache logs
+    shared by the OLDs in `params['apps_path']`. Rotated logs are compressed
+    (one rotation later, so that a process still writing to the old file is
+    not disturbed). The OLD's logs are copied and truncated in place, which
+    paster (which opens its log for appending) tolerates; Apache is gracefully
+    reloaded so that it reopens its logs.
+
+    """
+
+    print 'Configuring log rotation.'
+    options = get_logrotate_options(params)
+    rotation = LOGROTATE_TEMPLATE % options
+    old_config = '%s {\n%s    copytruncate\n}\n' % (
+        os.path.join(params['old_path'], 'log', '*.log'), rotation)
+    fail_msg = ('%sUnable to install the logrotate config for %s; its logs'
+        ' will not be rotated.%s')
+    if install_logrotate_config('%s_old' % params['old_dir_name'], old_config):
+        params['actions'].append('logrotate config')
+    else:
+        print fail_msg % (ANSI_WARNING, params['old_name'], ANSI_ENDC)
+    apache_name = get_apache_logrotate_name(params['apps_path'])
+    if os.path.isfile(os.path.join(LOGROTATE_DIR, apache_name)):
+        return
+    log_path = os.path.join(params['apps_path'], 'log')
+    apache_config = ('%s %s {\n%s    sharedscripts\n    postrotate\n'
+        '        /usr/sbin/apache2ctl graceful > /dev/null 2>&1 || true\n'
+        '    endscript\n}\n' % (os.path.join(log_path, 'access.log'),
+        os.path.join(log_path, 'error.log'), rotation))
+    if install_logrotate_config(apache_name, apache_config):
+        params['actions'].append('apache logrotate config')
+    else:
+        print fail_msg % (ANSI_WARNING, 'Apache', ANSI_ENDC)
+
+
+def remove_logrotate_config(params, remove_apache=False):
+    """Remove the OLD's logrotate config and, if `remove_apache` is `True`,
+    the one for the Apache logs of `params['apps_path']`.
+
+    """
+
+    print 'Removing log rotation config.'
+    names = ['%s_old' % params['old_dir_name']]
+    if remove_apache:
+        names.append(get_apache_logrotate_name(params['apps_path']))
+    for name in names:
+        path = os.path.join(LOGROTATE_DIR, name)
+        if os.path.isfile(path):
+            result = run_command(['sudo', 'rm', path])
+            if not result.ok:
+                print result
+                print ('%sSomething may have gone wrong when attempting to'
+                    ' remove %s.%s' % (ANSI_WARNING, path, ANSI_ENDC))
+
+
+def get_systemd_settings(params, old):
+    """Return the systemd settings for the OLD described by `old`: SYSTEMD
+    updated with the 'systemd' settings of the config file and the OLD's
+    overrides.
+
+    """
+
+    settings = SYSTEMD.copy()
+    settings.update(get_old_settings(params, old, 'systemd'))
+    return settings
+
+
+def get_systemd_unit_name(params):
+    """Return the name of the systemd unit of the OLD described by `params`.
+
+    """
+
+    return 'old-%s.service' % params['old_dir_name']
+
+
+def render_systemd_unit(params):
+    """Return the systemd unit that runs the OLD described by `params` with its
+    server, restarting it if it fails and limiting its memory, CPU, number of
+    tasks and I/O weight according to its systemd settings. The server runs as
+    the user that runs this script (see `get_service_user`), as it would under
+    the cronjob, and its executable is given by absolute path, as systemd
+    requires.
+
+    """
+
+    server = get_server(params)
+    settings = get_systemd_settings(params, params)
+    command = server.get_command()
+    command[0] = os.path.abspath(which(command[0]) or command[0])
+    user, group = get_service_user()
+    lines = [
+        '[Unit]',
+        'Description=The %s OLD (%s)' % (params['old_name'], server.name),
+        'After=network.target mysql.service',
+        'Wants=mysql.service',
+        '',
+        '[Service]',
+        'Type=forking',
+        'PIDFile=%s' % server.pid_path,
+        'User=%s' % user,
+        'Group=%s' % group,
+        'WorkingDirectory=%s' % params['old_path'],
+        'ExecStart=%s' % ' '.join(command),
+        'TimeoutStopSec=%s' % server.settings['stop_grace'],
+        'Restart=on-failure',
+        'RestartSec=%s' % settings['restart_sec']]
+    for key, directive in SYSTEMD_LIMITS:
+        if settings.get(key) is not None:
+            lines.append('%s=%s' % (directive, settings[key]))
+    lines += ['', '[Install]', 'WantedBy=multi-user.target', '']
+    return '\n'.join(lines)
+
+
+def get_service_user():
+    """Return the names of the user that runs this script (the one who invoked
+    sudo, if it is run with sudo) and of that user's primary group.
+
+    """
+
+    user = os.environ.get('SUDO_USER') or getpass.getuser()
+    group = grp.getgrgid(pwd.getpwnam(user).pw_gid).gr_name
+    return user, group
+
+
+def systemctl(*args):
+    """Run `sudo systemctl` with `args`. Return `True` on success.
+
+    """
+
+    result = run_command(['sudo', 'systemctl'] + list(args))
+    if not result.ok:
+        print result
+    return result.ok
+
+
+@catcherror
+def systemd_unit(params):
+    """Install and enable a systemd unit for the OLD, in place of the init
+    script and the restart cronjob. The OLD is then started via systemd (see
+    `serve`), so that it runs within its resource limits.
+
+    """
+
+    print 'Installing a systemd unit.'
+    name = get_systemd_unit_name(params)
+    tmp_pth = '/tmp/%s' % name
+    with open(tmp_pth, 'w') as fo:
+        fo.write(render_systemd_unit(params))
+    cp = run_command(['sudo', 'cp', tmp_pth, os.path.join(SYSTEMD_DIR, name)])
+    os.remove(tmp_pth)
+    if not cp.ok:
+        print cp
+    if not cp.ok or not systemctl('daemon-reload') or \
+            not systemctl('enable', name):
+        abort(params)
+        sys.exit('%sUnable to install the systemd unit %s. Aborting.%s' % (
+            ANSI_FAIL, name, ANSI_ENDC))
+    params['actions'].append('systemd unit')
+
+
+def remove_systemd_unit(params):
+    """Stop and disable the OLD's systemd unit and remove it.
+
+    """
+
+    print 'Removing systemd unit.'
+    name = get_systemd_unit_name(params)
+    path = os.path.join(SYSTEMD_DIR, name)
+    if not os.path.isfile(path):
+        return
+    systemctl('disable', '--now', name)
+    rm = run_command(['sudo', 'rm', path])
+    if not rm.ok:
+        print rm
+    if not rm.ok or not systemctl('daemon-reload'):
+        print ('%sSomething may have gone wrong when attempting to remove the'
+            ' systemd unit %s.%s' % (ANSI_WARNING, path, ANSI_ENDC))
+
+
+def print_systemd_unit(params, global_state):
+    """Print the systemd unit for the OLD named `params['old_name']`.
+
+    """
+
+    try:
+        old = [o for o in global_state
+            if o['old_name'] == params['old_name']][0]
+    except IndexError:
+        sys.exit('%sSorry, this script has no record of an OLD named %s.%s' % (
+            ANSI_FAIL, params['old_name'], ANSI_ENDC))
+    old = dict(old, olds_config=params['olds_config'],
+        systemd=params['systemd'], server=params['server'])
+    print render_systemd_unit(old)
+
+
+class PoolLock(object):
+    """Holds an exclusive lock on the pool (on the file POOL.lock) while it is
+    entered, so that concurrent builds and refills cannot claim the same slot
+    or reserve the same port.
+
+    """
+
+    def __enter__(self):
+        self.fo = open('%s.lock' % POOL, 'w')
+        fcntl.flock(self.fo, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.fo, fcntl.LOCK_UN)
+        self.fo.close()
+
+
+def read_pool():
+    """Return the list of the pool's slot records, from the JSON file at POOL.
+
+    """
+
+    if os.path.isfile(POOL):
+        try:
+            return json.load(open(POOL))
+        except ValueError:
+            print ('%sWarning: unable to read the pool of pre-built OLDs at'
+                ' %s.%s' % (ANSI_WARNING, POOL, ANSI_ENDC))
+    return []
+
+
+def write_pool(slots):
+    """Write the slot records `slots` to the JSON file at POOL.
+
+    """
+
+    with open('%s.tmp' % POOL, 'w') as fo:
+        json.dump(slots, fo, indent=4, sort_keys=True)
+    os.rename('%s.tmp' % POOL, POOL)
+
+
+def get_pool_ports():
+    """Return the ports reserved by the slots in the pool.
+
+    """
+
+    return [str(slot['old_port']) for slot in read_pool()]
+
+
+def reserve_port(params):
+    """Return the next available port for the OLD described by `params`,
+    reserving it in the pool (under the pool lock) so that no concurrent build
+    can take it before the OLD's virtual host entry exists; `release_port`
+    then drops the reservation.
+
+    """
+
+    with PoolLock():
+        port = get_next_available_port(params)
+        write_pool(read_pool() + [get_port_reservation(params, port)])
+    params['actions'].append('port reserved')
+    return port
+
+
+def get_port_reservation(params, port):
+    """Return the pool record that reserves `port` for the OLD described by
+    `params` on behalf of this process.
+
+    """
+
+    return {'old_name': params['old_name'], 'old_port': port,
+        'apps_path': params['apps_path'], 'vh_path': params['vh_path'],
+        'ready': False, 'reservation': True, 'pid': os.getpid()}
+
+
+def release_port(params):
+    """Drop the pool's reservation of the port of the OLD described by
+    `params`.
+
+    """
+
+    with PoolLock():
+        write_pool([s for s in read_pool() if not (s.get('reservation') and
+            s['old_name'] == params['old_name'])])
+    if 'port reserved' in params['actions']:
+        params['actions'].remove('port reserved')
+
+
+def prune_pool(params):
+    """Remove from the pool the slots that are not ready and whose builder
+    process is gone (e.g., because it was killed), destroying whatever those
+    builders left behind, and the port reservations of such processes.
+
+    """
+
+    with PoolLock():
+        slots = read_pool()
+        stale = [s for s in slots if not s['ready'] and
+            not get_process_cmdline(s.get('pid', 0))]
+        write_pool([s for s in slots if s not in stale])
+    for slot in stale:
+        print 'Removing stale pool record %s on port %s.' % (slot['old_name'],
+            slot['old_port'])
+        if slot.get('reservation'):
+            continue
+        slot_params = dict(params)
+        slot_params.update(slot)
+        destroy_old_directory(slot_params)
+        drop_database(slot_params)
+
+
+def build_pool_slot(params):
+    """Build a generic OLD for the pool: everything that `build` does up to and
+    including setup-app, under a placeholder name, with its port reserved in
+    the pool while it is built. Return `True` on success.
+
+    """
+
+    name = 'pool%s' % datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    slot = dict(params, old_name=name, actions=[],
+        old_dir_name=get_dir_name_from_old_name(name))
+    slot['old_path'] = os.path.join(slot['apps_path'], slot['old_dir_name'])
+    slot['db_name'] = slot['old_dir_name']
+    record = dict((key, slot[key]) for key in ['old_name', 'old_dir_name',
+        'old_path', 'db_name', 'apps_path', 'vh_path', 'mysql_user'])
+    record['ready'] = False
+    record['pid'] = os.getpid()
+    with PoolLock():
+        slot['old_port'] = record['old_port'] = get_next_available_port(slot)
+        write_pool(read_pool() + [record])
+    print 'Building pool slot %s on port %s.' % (name, slot['old_port'])
+    start = time.time()
+    try:
+        create_dirs(slot)
+        make_config(slot)
+        create_database(slot)
+        edit_config(slot)
+        configure_server(slot)
+        setup_app(slot)
+        fix_tag_name_col(slot)
+    except SystemExit, e:
+        print e
+        ready = False
+    else:
+        ready = True
+    with PoolLock():
+        slots = [s for s in read_pool() if s['old_name'] != name]
+        if ready:
+            record['ready'] = True
+            record['build_date'] = datetime.datetime.utcnow().isoformat()
+            slots.append(record)
+        write_pool(slots)
+    if ready:
+        print 'Built pool slot %s in %.0fs.' % (name, time.time() - start)
+    return ready
+
+
+def fill_pool(params):
+    """Build pool slots for `params['apps_path']` and `params['vh_path']` until
+    the pool holds `params['pool_size']` of them.
+
+    """
+
+    print '\n%sOLD Pool Filler.%s' % (ANSI_HEADER, ANSI_ENDC)
+    prune_pool(params)
+    while True:
+        slots = [s for s in read_pool() if not s.get('reservation') and
+            s['apps_path'] == params['apps_path'] and
+            s['vh_path'] == params['vh_path']]
+        if len(slots) >= params['pool_size']:
+            break
+        if not build_pool_slot(params):
+            sys.exit('%sUnable to build a pool slot.%s' % (ANSI_FAIL,
+                ANSI_ENDC))
+    print 'The pool holds %d slot(s).' % len(slots)
+
+
+def refill_pool_in_background(params):
+    """Refill the pool (see `fill_pool`) in a child process, detached from this
+    one and logging to <apps_path>/log/pool.log, so that this process can
+    return as soon as the OLD that claimed a slot is served.
+
+    """
+
+    log_path = os.path.join(params['apps_path'], 'log', 'pool.log')
+    print 'Refilling the pool in the background; see %s.' % log_path
+    sys.stdout.flush()
+    if os.fork():
+        return
+    try:
+        os.setsid()
+        log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+        os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        fill_pool(dict(params, actions=[]))
+    except BaseException, e:
+        print e
+    finally:
+        sys.stdout.flush()
+        os._exit(0)
+
+
+def take_pool_slot(params):
+    """Take a ready slot for `params['apps_path']` and `params['vh_path']`
+    from the pool and return it, or return `None` if there is none. In the
+    pool, the slot's record is replaced by a reservation of its port for the
+    OLD described by `params`, which lasts until `release_port` is called.
+
+    """
+
+    with PoolLock():
+        slots = read_pool()
+        for slot in slots:
+            if slot['ready'] and slot['apps_path'] == params['apps_path'] and \
+                    slot['vh_path'] == params['vh_path']:
+                slots.remove(slot)
+                write_pool(slots + [get_port_reservation(params,
+                    slot['old_port'])])
+                params['actions'].append('port reserved')
+                return slot
+
+
+@catcherror
+def claim_pool_slot(params):
+    """Make the pool slot `params['slot']` the OLD described by `params`:
+    rename its directory, move its tables into the OLD's (new) database with
+    RENAME TABLE (MySQL cannot rename a database; moving tables within a server
+    is a metadata change) and point its production.ini at the OLD's path,
+    database and the slot's port.
+
+    """
+
+    slot = params['slot']
+    params['old_port'] = slot['old_port']
+    print 'Claiming pool slot %s on port %s.' % (slot['old_name'],
+        slot['old_port'])
+    os.rename(slot['old_path'], params['old_path'])
+    params['actions'].append('created old directory')
+    list_tables = run_mysql(params, 'SELECT table_name FROM'
+        ' information_schema.tables WHERE table_schema = \'%s\';' %
+        slot['db_name'], '-N', '-B')
+    tables = list_tables.output.split()
+    if not list_tables.ok or not tables:
+        print list_tables
+        abort(params)
+        sys.exit('%sUnable to read the tables of the pool slot %s.'
+            ' Aborting.%s' % (ANSI_FAIL, slot['db_name'], ANSI_ENDC))
+    create_database(params)
+    rename = run_mysql(params, 'RENAME TABLE %s; DROP DATABASE `%s`;' % (
+        ', '.join('`%s`.`%s` TO `%s`.`%s`' % (slot['db_name'], table,
+        params['db_name'], table) for table in tables), slot['db_name']))
+    if not rename.ok:
+        print rename
+        abort(params)
+        sys.exit('%sUnable to move the tables of the pool slot %s.'
+            ' Aborting.%s' % (ANSI_FAIL, slot['db_name'], ANSI_ENDC))
+    cnf_pth = os.path.join(params['old_path'], 'production.ini')
+    with open(cnf_pth) as fi:
+        config = fi.read()
+    with open(cnf_pth, 'w') as fo:
+        fo.write(config.replace(slot['old_path'], params['old_path']))
+    edit_config(params)
+
+
+def drain_pool(params):
+    """Destroy the ready slots in the pool for `params['apps_path']` and
+    `params['vh_path']`, freeing their ports, and the slots whose builds died.
+
+    """
+
+    print '\n%sOLD Pool Drainer.%s' % (ANSI_HEADER, ANSI_ENDC)
+    prune_pool(params)
+    while True:
+        slot = take_pool_slot(params)
+        if not slot:
+            break
+        slot_params = dict(params)
+        slot_params.update(slot)
+        destroy_old_directory(slot_params)
+        drop_database(slot_params)
+        release_port(params)
+    print 'Done.'
+
+
+def update_dative_servers_file(params, remove=False):
+    """Add (or, if `remove` is `True`, remove) the OLD described by `params` to
+    (from) the Dative servers file at `params['dative_servers_path']`, if there
+    is one. Only this OLD's entry is changed; the other entries are left as
+    they are.
+
+    """
+
+    path = params.get('dative_servers_path')
+    if not path:
+        return
+    try:
+        servers = []
+        if os.path.isfile(path):
+            servers = json.load(open(path))
+        server = get_dative_server(params)
+        index = [i for i, s in enumerate(servers) if s['url'] == server['url']]
+        if remove:
+            servers = [s for s in servers if s['url'] != server['url']]
+        elif index:
+            servers[index[0]] = server
+        else:
+            servers.append(server)
+        write_dative_servers(path, servers)
+        print 'Updated the Dative servers file %s.' % path
+    except Exception, e:
+        print ('%sWarning: unable to update the Dative servers file %s: %s.%s' % (
+            ANSI_WARNING, path, e, ANSI_ENDC))
+
+
+def get_dative_servers_directives(params):
+    """Return the Apache directives that serve the Dative servers file at
+    `params['dative_servers_path']` at the URL path
+    `params['dative_servers_url']`, or the empty string if either is not
+    configured. Clients that accept gzip are served the precompressed copy;
+    responses carry a long-lived Cache-Control header and an ETag (from the
+    file's mtime and size, which only change when its content does), so
+    Apache answers conditional GETs with 304 Not Modified. The rewrite to the
+    gzipped copy is nested in the mod_headers guard, since without the
+    Content-Encoding header that module sets, clients would get gzip bytes
+    they do not decode. Without mod_rewrite or mod_headers, the uncompressed
+    file is served without these refinements.
+
+    """
+
+    path = params.get('dative_servers_path')
+    url = params.get('dative_servers_url')
+    if not path or not url:
+        return ''
+    dir_path, name = os.path.split(os.path.abspath(path))
+    url_dir = os.path.dirname(url.rstrip('/')) or '/'
+    return '''
+    # Dative servers file
+    Alias %(url)s %(path)s
+    Alias %(url)s.gz %(path)s.gz
+    <Directory %(dir_path)s>
+        Order deny,allow
+        Allow from all
+        FileETag MTime Size
+        <IfModule mod_headers.c>
+            <IfModule mod_rewrite.c>
+                RewriteEngine On
+                RewriteBase %(url_dir)s
+                RewriteCond %%{HTTP:Accept-Encoding} gzip
+                RewriteCond %%{REQUEST_FILENAME}.gz -f
+                RewriteRule ^%(name_re)s$ %(name)s.gz [L]
+            </IfModule>
+            <FilesMatch "^%(name_re)s(\\.gz)?$">
+                Header set Cache-Control "public, max-age=%(max_age)s"
+                Header append Vary Accept-Encoding
+            </FilesMatch>
+            <FilesMatch "^%(name_re)s\\.gz$">
+                ForceType application/json
+                Header set Content-Encoding gzip
+                SetEnv no-gzip 1
+            </FilesMatch>
+        </IfModule>
+    </Directory>
+''' % {'url': url, 'path': os.path.abspath(path), 'dir_path': dir_path,
+        'url_dir': url_dir, 'name': name, 'name_re': re.escape(name),
+        'max_age': params.get('dative_servers_max_age') or 86400}
+
+
+def get_limited_command(params, cmd):
+    """Return the command `cmd` (a list) prefixed so that it runs at a low CPU
+    priority (nice) and in the idle I/O scheduling class (ionice), so that a
+    backup does not starve the OLDs that are being served.
+
+    """
+
+    prefix = []
+    if which('nice'):
+        prefix += ['nice', '-n', str(params['backup_nice'])]
+    if which('ionice'):
+        prefix += ['ionice', '-c', '3']
+    return prefix + cmd
+
+
+def stream_compressed(params, cmd, path, input=None, env=None):
+    """Run the command `cmd` and stream its stdout through a compressor (pigz,
+    if available, else gzip) into the file at `path`, without writing any
+    uncompressed intermediate file. `input`, if given, is written to the
+    command's stdin; `env`, if given, is added to the command's environment.
+    The output is written to `path`.tmp and only renamed to `path` if the
+    command succeeds; otherwise an exception is raised.
+
+    """
+
+    compressor = 'pigz' if which('pigz') else 'gzip'
+    tmp_path = '%s.tmp' % path
+    if env is not None:
+        env = dict(os.environ, **env)
+    with open(tmp_path, 'wb') as fo:
+        producer = Popen(get_limited_command(params, cmd), env=env,
+            stdin=None if input is None else PIPE, stdout=PIPE, stderr=PIPE)
+        compress = Popen(get_limited_command(params, [compressor, '-c']),
+            stdin=producer.stdout, stdout=fo)
+        producer.stdout.close()
+        if input is not None:
+            producer.stdin.write(input)
+            producer.stdin.close()
+        stderr = producer.stderr.read()
+        producer.wait()
+        compress.wait()
+    if producer.returncode or compress.returncode:
+        os.remove(tmp_path)
+        raise Exception('%s failed: %s' % (cmd[0], stderr.strip() or
+            'exit status %s' % (producer.returncode or compress.returncode)))
+    os.rename(tmp_path, path)
+
+
+def hash_file(path):
+    """Return the SHA-1 hash of the contents of the file at `path`.
+
+    """
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_files(path, previous):
+    """Return a dict mapping the path (relative to `path`) of each file under
+    `path` to its `[mtime, size, sha1]`. A file is only hashed if its mtime or
+    size differ from those recorded for it in the `previous` manifest.
+
+    """
+
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            rel_path = os.path.relpath(file_path, path)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            entry = previous.get(rel_path)
+            if entry and entry[:2] == [stat.st_mtime, stat.st_size]:
+                manifest[rel_path] = entry
+            else:
+                manifest[rel_path] = [stat.st_mtime, stat.st_size,
+                    hash_file(file_path)]
+    return manifest
+
+
+def backup_old(params, old):
+    """Back up the OLD described by `old` to a new timestamped directory under
+    `params['backup_dir']`/<old_dir_name>/. Its MySQL database is dumped (in a
+    single transaction, so the dump is consistent without locking the tables)
+    and streamed through a compressor into db.sql.gz; the MySQL password is
+    passed to mysqldump in MYSQL_PWD, so that it does not appear in ps. The files in its
+    directory that have been added or changed since the last backup (according
+    to the hashes in the OLD's manifest.json) are streamed by tar through a
+    compressor into files.tar.gz and the files that have been deleted since
+    are listed in deleted.json. The manifest is only updated once both parts
+    have succeeded. Return a dict summarizing the backup.
+
+    """
+
+    start = datetime.datetime.now()
+    old_backup_dir = os.path.join(params['backup_dir'], old['old_dir_name'])
+    path = os.path.join(old_backup_dir, start.strftime('%Y%m%dT%H%M%S.%f'))
+    manifest_path = os.path.join(old_backup_dir, 'manifest.json')
+    result = {'old_name': old['old_name'], 'path': path}
+    try:
+        os.makedirs(path)
+        stream_compressed(params, ['mysqldump', '--single-transaction',
+            '--quick', '-u', params['mysql_user'], old['db_name']],
+            os.path.join(path, 'db.sql.gz'),
+            env={'MYSQL_PWD': params['mysql_pwd']})
+        previous = {}
+        if os.path.isfile(manifest_path) and not params['full_backup']:
+            previous = json.load(open(manifest_path))
+        manifest = scan_files(old['old_path'], previous)
+        changed = sorted([rel_path for rel_path, entry in manifest.iteritems()
+            if previous.get(rel_path, [None] * 3)[2] != entry[2]])
+        deleted = sorted(set(previous) - set(manifest))
+        if changed:
+            stream_compressed(params, ['tar', '-c', '-f', '-', '-C',
+                old['old_path'], '--null', '-T', '-'],
+                os.path.join(path, 'files.tar.gz'), '\0'.join(changed))
+        with open(os.path.join(path, 'deleted.json'), 'w') as fo:
+            json.dump(deleted, fo, indent=4)
+        with open('%s.tmp' % manifest_path, 'w') as fo:
+            json.dump(manifest, fo)
+        os.rename('%s.tmp' % manifest_path, manifest_path)
+        result.update({
+            'type': 'incremental' if previous else 'full',
+            'changed': len(changed),
+            'deleted': len(deleted)
+        })
+    except Exception, e:
+        result['error'] = str(e)
+    result['seconds'] = (datetime.datetime.now() - start).total_seconds()
+    return result
+
+
+def backup(params, olds):
+    """Back up the OLDs in `olds` (or just the one named in `params`, if there
+    is one) using a pool of `params['backup_workers']` threads. The heavy
+    lifting is done by the mysqldump, tar and gzip subprocesses, so threads
+    suffice to run several OLDs' backups at once.
+
+    """
+
+    if params['old_name']:
+        olds = [o for o in olds if o['old_name'] == params['old_name']]
+    else:
+        olds = list(olds)
+    if not olds:
+        sys.exit('%sThere are no OLDs to back up.%s' % (ANSI_WARNING,
+            ANSI_ENDC))
+    print '\n%sOLD Backup.%s' % (ANSI_HEADER, ANSI_ENDC)
+    print 'Backing up %d OLD(s) to %s using %d worker(s).' % (len(olds),
+        params['backup_dir'], params['backup_workers'])
+    pool = ThreadPool(min(params['backup_workers'], len(olds)))
+    failed = 0
+    for result in pool.imap_unordered(lambda old: backup_old(params, old),
+            olds):
+        if 'error' in result:
+            failed += 1
+            print '%sFailed to back up %s: %s%s' % (ANSI_FAIL,
+                result['old_name'], result['error'], ANSI_ENDC)
+        else:
+            print ('Backed up %s (%s; %d changed file(s), %d deleted) to %s in'
+                ' %.1fs.' % (result['old_name'], result['type'],
+                result['changed'], result['deleted'], result['path'],
+                result['seconds']))
+    pool.close()
+    pool.join()
+    if failed:
+        sys.exit('%sFailed to back up %d of %d OLD(s).%s' % (ANSI_FAIL, failed,
+            len(olds), ANSI_ENDC))
+    print '%sBacked up %d OLD(s).%s' % (ANSI_OKGREEN, len(olds), ANSI_ENDC)
+
+
+def get_running_pid(old):
+    """Return the pid in the pid file of the OLD described by `old` if that
+    process is alive, else `None`.
+
+    """
+
+    try:
+        pid_path = os.path.join(old['old_path'], 'old.pid')
+        pid = int(open(pid_path).read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (IOError, ValueError, OSError):
+        return None
+
+
+def get_suspended_path(old):
+    """Return the path of the file that marks the OLD described by `old` as
+    suspended, i.e., as having an activator listening on its port in place of
+    the app.
+
+    """
+
+    return os.path.join(old['old_path'], 'old.suspended')
+
+
+def get_server_host(old):
+    """Return the host that the OLD described by `old` is served on, according
+    to its production.ini.
+
+    """
+
+    try:
+        with open(os.path.join(old['old_path'], 'production.ini')) as f:
+            for line in f:
+                if line.startswith('host ='):
+                    return line.split('=', 1)[1].strip()
+    except IOError:
+        pass
+    return '127.0.0.1'
+
+
+def port_accepts(host, port):
+    """Return `True` if something accepts TCP connections at `host`:`port`.
+
+    """
+
+    try:
+        socket.create_connection((host, port), 1).close()
+        return True
+    except socket.error:
+        return False
+
+
+def get_activity(olds):
+    """Return a dict mapping the `old_dir_name` of each OLD in `olds` to the
+    time (seconds since the epoch) at which a request for it was last seen in
+    an Apache access log, and the time of the previous call. Only the lines
+    appended to each access log since the last call are read; the read offsets
+    and last-seen times are kept in the JSON file at ACTIVITY. A request is dated by the time it is first seen, so
+    the resolution is the interval between calls. OLDs not seen before are
+    treated as having just been active.
+
+    """
+
+    now = time.time()
+    try:
+        activity = json.load(open(ACTIVITY))
+    except (IOError, ValueError):
+        activity = {'logs': {}, 'last_seen': {}, 'last_run': now}
+    for apps_path in set([old['apps_path'] for old in olds]):
+        log_path = os.path.join(apps_path, 'log', 'access.log')
+        try:
+            stat = os.stat(log_path)
+        except OSError:
+            continue
+        inode, offset = activity['logs'].get(log_path, [None, 0])
+        if inode != stat.st_ino or offset > stat.st_size:
+            offset = 0  # the log has been rotated.
+        with open(log_path) as f:
+            f.seek(offset)
+            for line in f:
+                match = ACCESS_LOG_PATH_RE.search(line)
+                if match:
+                    activity['last_seen'][match.group(1)] = now
+            activity['logs'][log_path] = [stat.st_ino, f.tell()]
+    for old in olds:
+        activity['last_seen'].setdefault(old['old_dir_name'], now)
+    last_run, activity['last_run'] = activity['last_run'], now
+    with open('%s.tmp' % ACTIVITY, 'w') as fo:
+        json.dump(activity, fo)
+    os.rename('%s.tmp' % ACTIVITY, ACTIVITY)
+    return activity['last_seen'], last_run
+
+
+def suspend_old(params, old):
+    """Stop serving the OLD described by `old` and start an activator (this
+    script, run with --activate and this run's --config-file, so that it
+    serves the OLD with the same settings) in its place, detached from this
+    process.
+
+    """
+
+    old = get_old_params(params, old)
+    stop_serving(old)
+    for i in range(50):
+        if not port_accepts(get_server_host(old), int(old['old_port'])):
+            break
+        time.sleep(0.1)
+    log = open(os.path.join(old['old_path'], 'log', 'activator.log'), 'a')
+    cmd = [sys.executable, SCRIPT, old['old_name'], '--activate']
+    if params['config_file']:
+        cmd.append('--config-file=%s' % params['config_file'])
+    Popen(cmd, stdin=open(os.devnull), stdout=log, stderr=STDOUT,
+        close_fds=True, preexec_fn=os.setsid)
+
+
+def suspend_idle(params, global_state):
+    """Suspend each OLD in `global_state` that is running and has not received
+    a request in the last `params['idle_minutes']` minutes, and report the
+    cold-start times of the activations since the last run. This is meant to
+    be run every few minutes from cron.
+
+    """
+
+    print '\n%sOLD Idle Suspender.%s' % (ANSI_HEADER, ANSI_ENDC)
+    last_seen, last_run = get_activity(global_state)
+    cutoff = time.time() - params['idle_minutes'] * 60
+    for old in global_state:
+        activations_path = os.path.join(old['old_path'], 'log',
+            'activations.log')
+        if os.path.isfile(activations_path):
+            with open(activations_path) as f:
+                for line in f:
+                    # Skip a malformed line, e.g., one cut short by a crash.
+                    try:
+                        activation = json.loads(line)
+                        activated = activation['activated']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if activated <= last_run:
+                        continue
+                    if activation.get('error'):
+                        print ('%s%s failed to activate at %s: %s.%s' % (
+                            ANSI_FAIL, old['old_name'],
+                            datetime.datetime.fromtimestamp(
+                            activation['activated']).isoformat(),
+                            activation['error'], ANSI_ENDC))
+                    else:
+                        print ('%s was activated at %s; its cold start'
+                            ' took %.1fs.' % (old['old_name'],
+                            datetime.datetime.fromtimestamp(
+                            activation['activated']).isoformat(),
+                            activation['cold_start_seconds']))
+        if os.path.exists(get_suspended_path(old)) or \
+                not get_running_pid(old):
+            continue
+        if last_seen[old['old_dir_name']] < cutoff:
+            print 'Suspending %s, which has been idle for over %d minutes.' % (
+                old['old_name'], params['idle_minutes'])
+            suspend_old(params, old)
+
+
+def relay(client, server):
+    """Copy bytes between the sockets `client` and `server` in both directions
+    until both sides have closed their ends.
+
+    """
+
+    peers = {client: server, server: client}
+    open_socks = [client, server]
+    while open_socks:
+        readable, writable, exceptional = select.select(open_socks, [], [])
+        for sock in readable:
+            data = sock.recv(65536)
+            if data:
+                peers[sock].sendall(data)
+            else:
+                open_socks.remove(sock)
+                try:
+                    peers[sock].shutdown(socket.SHUT_WR)
+                except socket.error:
+                    pass
+
+
+def activate(params, global_state):
+    """Listen on the port of the suspended OLD named `params['old_name']` until
+    a connection arrives, then start the OLD, hand the connection over to it
+    and exit. While listening, this process's pid is in the OLD's pid file, so
+    the restart cronjob and init script treat the OLD as running and
+    `paster serve --stop` stops the activator. The time from accepting the
+    connection to the OLD accepting connections (the cold start) is appended
+    to the OLD's log/activations.log. If the OLD fails to start, that is
+    logged there instead, the OLD is no longer marked as suspended and this
+    process exits with an error.
+
+    Note: connections that arrive while the OLD is starting are refused, and
+    Apache answers them with 503 until the OLD is up.
+
+    """
+
+    try:
+        old = get_old_params(params, [o for o in global_state
+            if o['old_name'] == params['old_name']][0])
+    except IndexError:
+        sys.exit('%sSorry, this script has no record of an OLD named %s.%s' % (
+            ANSI_FAIL, params['old_name'], ANSI_ENDC))
+    host, port = get_server_host(old), int(old['old_port'])
+    pid_path = os.path.join(old['old_path'], 'old.pid')
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    with open(pid_path, 'w') as fo:
+        fo.write('%s\n' % os.getpid())
+    with open(get_suspended_path(old), 'w') as fo:
+        fo.write('%s\n' % time.time())
+    print 'Suspended %s; waiting for a connection on %s:%s.' % (
+        old['old_name'], host, port)
+
+    client, address = listener.accept()
+    start = time.time()
+    listener.close()
+    os.remove(pid_path)
+    error = None
+    if not start_serving(old):
+        error = 'the %s server failed to start' % get_server(old).name
+    while not error and not port_accepts(host, port):
+        if time.time() - start > ACTIVATION_TIMEOUT:
+            error = 'it did not start within %ss' % ACTIVATION_TIMEOUT
+        time.sleep(0.05)
+    cold_start = time.time() - start
+    os.remove(get_suspended_path(old))
+    activation = {'activated': start, 'cold_start_seconds': cold_start}
+    if error:
+        activation['error'] = error
+    with open(os.path.join(old['old_path'], 'log', 'activations.log'),
+            'a') as fo:
+        fo.write('%s\n' % json.dumps(activation))
+    if error:
+        client.close()
+        sys.exit('%sUnable to activate %s: %s.%s' % (ANSI_FAIL,
+            old['old_name'], error, ANSI_ENDC))
+    print 'Activated %s in %.2fs.' % (old['old_name'], cold_start)
+    relay(client, socket.create_connection((host, port)))
+
+
+class LocalExecutor(object):
+    """Runs commands on this machine, in the directory that buildold.py was run
+    from.
+
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.cwd = os.getcwd()
+
+    def get_command(self, cmd, interactive=False):
+        return cmd
+
+    def run(self, cmd, interactive=False, input=None):
+        """Run the command `cmd` (a list) and return its exit status and (unless
+        `interactive` is `True`, in which case it uses this process's terminal)
+        its output. `input` is written to its stdin.
+
+        """
+
+        if interactive:
+            return Popen(self.get_command(cmd, True), cwd=self.cwd).wait(), ''
+        result = run_command(self.get_command(cmd), cwd=self.cwd, input=input)
+        return result.returncode, result.output
+
+
+class DirectoryExecutor(LocalExecutor):
+    """Runs commands on this machine, in the host's `root` directory. A host
+    with a directory of its own (holding its own buildold state) stands in for
+    a remote host when testing placement.
+
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.cwd = host['root']
+
+
+class SSHExecutor(LocalExecutor):
+    """Runs commands on the host's `ssh` target (e.g., 'old@apps2.example.com')
+    over SSH, in the host's `root` directory there.
+
+    """
+
+    def get_command(self, cmd, interactive=False):
+        remote = ' '.join(pipes.quote(arg) for arg in cmd)
+        if self.host.get('root'):
+            remote = 'cd %s && %s' % (pipes.quote(self.host['root']), remote)
+        if interactive:
+            return ['ssh', '-t', self.host['ssh'], remote]
+        return ['ssh', '-o', 'BatchMode=yes', self.host['ssh'], remote]
+
+
+EXECUTORS = {
+    'local': LocalExecutor,
+    'directory': DirectoryExecutor,
+    'ssh': SSHExecutor
+}
+
+
+def get_executor(host):
+    """Return an executor for the host record `host`, based on its `executor`
+    value (defaults to 'ssh' if it has an `ssh` target, else 'local').
+
+    """
+
+    name = host.get('executor') or ('ssh' if host.get('ssh') else 'local')
+    try:
+        return EXECUTORS[name](host)
+    except KeyError:
+        sys.exit('%sUnknown executor %s for host %s.%s' % (ANSI_FAIL, name,
+            host['name'], ANSI_ENDC))
+
+
+def get_hosts(params):
+    """Return the list of host records in the JSON file at
+    `params['hosts_file']`, which must list at least one host.
+
+    """
+
+    try:
+        hosts = json.load(open(params['hosts_file']))
+    except (IOError, ValueError), e:
+        sys.exit('%sUnable to read the hosts file %s: %s%s' % (ANSI_FAIL,
+            params['hosts_file'], e, ANSI_ENDC))
+    if type(hosts) is not type([]) or not hosts:
+        sys.exit('%sThe hosts file %s does not list any hosts.%s' % (ANSI_FAIL,
+            params['hosts_file'], ANSI_ENDC))
+    return hosts
+
+
+def probe_host(params, host):
+    """Return the capacity record of `host`: its total and available RAM, its
+    number of cores, its total and free disk space, its MySQL server's
+    max_connections and the number of OLDs that buildold.py has built on it.
+    These are measured by running HOST_PROBE_SCRIPT via the host's executor;
+    any values in the host's `capacity` object override the measured ones.
+    If buildold.py --list fails on the host, the record has no 'olds', so that
+    `get_load` refuses the host rather than take it to be empty.
+
+    """
+
+    script = HOST_PROBE_SCRIPT % {
+        'apps_path': pipes.quote(host.get('apps_path') or '.'),
+        'mysql_user': pipes.quote(params['mysql_user'] or ''),
+        'mysql_pwd': pipes.quote(params['mysql_pwd'] or ''),
+        'python': pipes.quote(host.get('python') or 'python'),
+        'buildold': pipes.quote(host.get('buildold_path') or './buildold.py')
+    }
+    status, stdout = get_executor(host).run(['sh', '-s'], input=script)
+    capacity = {'host': host['name'],
+        'probed': datetime.datetime.utcnow().isoformat()}
+    for line in stdout.splitlines():
+        key, sep, value = line.partition('=')
+        if sep:
+            try:
+                capacity[key.strip()] = int(value.strip())
+            except ValueError:
+                pass
+    if 'olds' in capacity:
+        capacity['olds'] = max(capacity['olds'] - 1, 0)  # the TSV header.
+    capacity.update(host.get('capacity', {}))
+    return capacity
+
+
+def get_load(params, capacity):
+    """Return the load of the host with the capacity record `capacity`, the
+    largest of the fractions of its MySQL connections (given one more OLD), RAM
+    and disk that are in use, and an explanation if the host cannot admit
+    another OLD (or `None` if it can).
+
+    """
+
+    if capacity.get('olds') is None:
+        return None, 'the number of OLDs on it is unknown'
+    connections = (capacity['olds'] + 1) * params['pool_connections']
+    max_connections = capacity.get('max_connections')
+    if not max_connections:
+        return None, 'its MySQL max_connections is unknown'
+    available = max_connections - params['mysql_reserved_connections']
+    if connections > available:
+        return None, ('%d OLDs would need %d MySQL connections but only %d are'
+            ' available' % (capacity['olds'] + 1, connections, available))
+    fractions = [float(connections) / max_connections]
+    if capacity.get('mem_total_kb'):
+        fractions.append(1 - float(capacity.get('mem_available_kb', 0)) /
+            capacity['mem_total_kb'])
+    if capacity.get('disk_total_kb'):
+        fractions.append(1 - float(capacity.get('disk_free_kb', 0)) /
+            capacity['disk_total_kb'])
+    return max(fractions), None
+
+
+def plan_placement(params):
+    """Probe the hosts in the hosts file (in parallel), save their capacity
+    records to CAPACITY and return the host records paired with their
+    capacity, load and refusal reason, least loaded admissible host first.
+
+    """
+
+    hosts = get_hosts(params)
+    if params['place_on']:
+        hosts = [h for h in hosts if h['name'] == params['place_on']]
+        if not hosts:
+            sys.exit('%sThere is no host named %s in %s.%s' % (ANSI_FAIL,
+                params['place_on'], params['hosts_file'], ANSI_ENDC))
+    pool = ThreadPool(len(hosts))
+    capacities = pool.map(lambda host: probe_host(params, host), hosts)
+    pool.close()
+    pool.join()
+    with open('%s.tmp' % CAPACITY, 'w') as fo:
+        json.dump(capacities, fo, indent=4, sort_keys=True)
+    os.rename('%s.tmp' % CAPACITY, CAPACITY)
+    plan = []
+    for host, capacity in zip(hosts, capacities):
+        load, refusal = get_load(params, capacity)
+        plan.append((host, capacity, load, refusal))
+    return sorted(plan, key=lambda p: (p[3] is not None, p[2],
+        p[1].get('olds')))
+
+
+def print_plan(plan):
+    """Print the capacity and load of each host in `plan`.
+
+    """
+
+    for host, capacity, load, refusal in plan:
+        summary = ('%s: %s OLD(s), %s cores, %s/%s MB RAM available, %s/%s GB'
+            ' disk free, max_connections %s' % (host['name'],
+            capacity.get('olds', '?'),
+            capacity.get('cores', '?'),
+            capacity.get('mem_available_kb', 0) / 1024,
+            capacity.get('mem_total_kb', 0) / 1024,
+            capacity.get('disk_free_kb', 0) / 1024 / 1024,
+            capacity.get('disk_total_kb', 0) / 1024 / 1024,
+            capacity.get('max_connections', '?')))
+        if refusal:
+            print '%s%s; refused: %s.%s' % (ANSI_WARNING, summary, refusal,
+                ANSI_ENDC)
+        else:
+            print '%s; load %.0f%%.' % (summary, load * 100)
+
+
+def place_and_build(params):
+    """Build the OLD named `params['old_name']` on the least loaded host in the
+    hosts file that can admit it, by running buildold.py there via the host's
+    executor. If `params['plan']` is `True`, only print the plan.
+
+    """
+
+    print '\n%sOLD Placement.%s' % (ANSI_HEADER, ANSI_ENDC)
+    plan = plan_placement(params)
+    print_plan(plan)
+    host, capacity, load, refusal = plan[0]
+    if refusal:
+        sys.exit('%sNo host can admit another OLD.%s' % (ANSI_FAIL, ANSI_ENDC))
+    print 'The least loaded host that can admit another OLD is %s%s%s.' % (
+        ANSI_OKGREEN, host['name'], ANSI_ENDC)
+    if params['plan']:
+        return
+    cmd = [host.get('python') or 'python',
+        host.get('buildold_path') or './buildold.py', params['old_name']] + \
+        host.get('args', [])
+    status, stdout = get_executor(host).run(cmd, interactive=True)
+    if status:
+        sys.exit('%sBuilding %s on %s failed.%s' % (ANSI_FAIL,
+            params['old_name'], host['name'], ANSI_ENDC))
+
+
+def get_desired_state(path):
+    """Return the OLDs described in the JSON file at `path`: a list (or an
+    object with an 'olds' list) whose items are OLD names or objects with an
+    'old_name' and, optionally, the OLD's 'server_backend' and
+    'service_manager' and, for OLDs that are to be built, its 'host',
+    'apps_path' and 'vh_path'.
+
+    """
+
+    try:
+        desired = json.load(open(path))
+        if type(desired) is type({}):
+            desired = desired['olds']
+        assert type(desired) is type([])
+    except Exception, e:
+        sys.exit('%sUnable to read the desired state in %s: %s%s' % (ANSI_FAIL,
+            path, e, ANSI_ENDC))
+    olds = []
+    for old in desired:
+        if not isinstance(old, dict):
+            old = {'old_name': old}
+        if not re.search('^\w+$', old.get('old_name') or ''):
+            sys.exit('%sInvalid OLD name in %s: %s.%s' % (ANSI_FAIL, path,
+                old.get('old_name'), ANSI_ENDC))
+        olds.append(old)
+    return olds
+
+
+def get_old_params(params, old):
+    """Return the params for operating on the already-built OLD described by
+    `old`: `params` (for its settings) updated with `old`, without its
+    actions, so that a failure does not abort (i.e., undo) its build.
+
+    """
+
+    old_params = dict(params)
+    old_params.update(old)
+    old_params['actions'] = []
+    return old_params
+
+
+def list_directory(path):
+    """Return the set of the names in the directory at `path`, if it exists.
+
+    """
+
+    if os.path.isdir(path):
+        return set(os.listdir(path))
+    return set()
+
+
+def get_databases(params):
+    """Return the set of the names of the MySQL databases.
+
+    """
+
+    result = run_mysql(params, 'SHOW DATABASES;', '-N')
+    if not result.ok:
+        sys.exit('%sUnable to list the MySQL databases: %s%s' % (ANSI_FAIL,
+            result, ANSI_ENDC))
+    return set(result.output.split())
+
+
+def inspect_host(params, olds, databases):
+    """Inspect the host's actual state in bulk, given the set of its MySQL
+    `databases`: one read of the crontab and of each virtual hosts file and
+    one listing of each relevant directory. Return a dict from the name of
+    each OLD in `olds` to a dict of what exists of it.
+
+    """
+
+    crontab = run_command(['crontab', '-l']).output
+    init_scripts = list_directory('/etc/init.d')
+    units = list_directory(SYSTEMD_DIR)
+    logrotate_configs = list_directory(LOGROTATE_DIR)
+    ports = {}
+    dirs = {}
+    for old in olds:
+        if old['vh_path'] not in ports:
+            ports[old['vh_path']] = get_used_ports(old)
+        if old['apps_path'] not in dirs:
+            dirs[old['apps_path']] = list_directory(old['apps_path'])
+    facts = {}
+    for old in olds:
+        old_params = get_old_params(params, old)
+        facts[old['old_name']] = {
+            'directory': old['old_dir_name'] in dirs[old['apps_path']],
+            'database': old['db_name'] in databases,
+            'running': get_running_pid(old) is not None,
+            'virtual host': str(old['old_port']) in ports[old['vh_path']],
+            'cronjob': get_cronjob_cmd(old_params) in crontab,
+            'init script': '%s_init' % old['old_dir_name'] in init_scripts,
+            'systemd unit': get_systemd_unit_name(old) in units,
+            'logrotate': '%s_old' % old['old_dir_name'] in logrotate_configs}
+    return facts
+
+
+def plan_reconcile(params, global_state, desired):
+    """Compare the `desired` OLDs with the OLDs in `global_state` and what
+    actually exists of them. Return a list of (name, steps, problems) triples,
+    where steps are what must be done to bring the OLD in line (in the order
+    in which they must be done) and problems are what this script cannot fix,
+    and a list of the names of the recorded OLDs that are not desired.
+
+    """
+
+    built = dict((o['old_name'], o) for o in global_state)
+    databases = get_databases(params)
+    facts = inspect_host(params, [built[o['old_name']] for o in desired
+        if o['old_name'] in built], databases)
+    plan = []
+    for wanted in desired:
+        name = wanted['old_name']
+        old = built.get(name)
+        if not old:
+            old_dir_name = get_dir_name_from_old_name(name)
+            apps_path = wanted.get('apps_path') or params['apps_path']
+            problems = []
+            if apps_path and old_dir_name in list_directory(apps_path):
+                problems.append('its directory exists but was not built by'
+                    ' this script')
+            if old_dir_name in databases:
+                problems.append('its database exists but was not built by'
+                    ' this script')
+            plan.append((name, [] if problems else ['build'], problems))
+            continue
+        fact = facts[name]
+        problems = ['its %s is missing' % thing
+            for thing in ['directory', 'database'] if not fact[thing]]
+        if problems:
+            plan.append((name, [], problems))
+            continue
+        manager = old.get('service_manager') or 'sysv'
+        new_manager = wanted.get('service_manager') or manager
+        steps = []
+        if new_manager != manager:
+            steps.append('service manager')
+        if new_manager == 'systemd':
+            if not fact['systemd unit']:
+                steps.append('systemd unit')
+            if not fact['running'] or 'service manager' in steps:
+                steps.append('serve')
+        else:
+            if not fact['running'] or 'service manager' in steps:
+                steps.append('serve')
+            if not fact['cronjob'] or 'service manager' in steps:
+                steps.append('cronjob')
+            if not fact['init script'] or 'service manager' in steps:
+                steps.append('init script')
+        if wanted.get('server_backend') and wanted['server_backend'] != \
+                (old.get('server_backend') or 'paster'):
+            steps.append('server')
+        if not fact['logrotate']:
+            steps.append('logrotate')
+        if not fact['virtual host']:
+            steps.append('virtual host')
+        plan.append((name, steps, problems))
+    wanted_names = set(o['old_name'] for o in desired)
+    unwanted = [o['old_name'] for o in global_state
+        if o['old_name'] not in wanted_names]
+    return plan, unwanted
+
+
+def print_reconcile_plan(plan, unwanted):
+    """Print the steps and problems of each OLD in `plan` and the OLDs that
+    are built but not desired.
+
+    """
+
+    for name, steps, problems in plan:
+        if problems:
+            print '%s%s: %s.%s' % (ANSI_FAIL, name, '; '.join(problems),
+                ANSI_ENDC)
+        elif steps:
+            print '%s: %s.' % (name, ', '.join(steps))
+    for name in unwanted:
+        print ('%s%s is not in the desired state; destroy it with --destroy if'
+            ' it is no longer needed.%s' % (ANSI_WARNING, name, ANSI_ENDC))
+    if not [steps for name, steps, problems in plan if steps]:
+        print 'Nothing to do.'
+
+
+def convert_service_manager(params, old, manager):
+    """Stop the already-built OLD described by `params` (whose record is `old`)
+    and remove what keeps it running under its current service manager, so
+    that it can be set up under `manager`.
+
+    """
+
+    print 'Switching %s to %s.' % (old['old_name'], manager)
+    stop_serving(params)
+    if 'systemd unit' in old['actions']:
+        remove_systemd_unit(params)
+    if 'cronjob created' in old['actions']:
+        destroy_cronjob(params)
+    if 'init script' in old['actions']:
+        remove_init_script(params)
+    old['actions'] = [a for a in old['actions'] if a not in ['systemd unit',
+        'cronjob created', 'init script']]
+    old['service_manager'] = params['service_manager'] = manager
+
+
+def reconcile_old(params, global_state, wanted, steps):
+    """Take the `steps` needed to bring the already-built OLD named
+    `wanted['old_name']` in line with `wanted`, recording any new actions in
+    its record in `global_state`.
+
+    """
+
+    old = [o for o in global_state if o['old_name'] == wanted['old_name']][0]
+    old_params = get_old_params(params, old)
+    if 'service manager' in steps:
+        convert_service_manager(old_params, old, wanted['service_manager'])
+    for step, func in [('systemd unit', systemd_unit), ('serve', serve),
+            ('cronjob', create_cronjob), ('init script', init_script),
+            ('logrotate', logrotate_config)]:
+        if step in steps:
+            func(old_params)
+    old['actions'] += [a for a in old_params['actions']
+        if a not in old['actions']]
+    write_state(global_state)
+    if 'server' in steps:
+        switch_server(dict(params, old_name=old['old_name'],
+            server_backend=wanted['server_backend']), global_state)
+
+
+def regenerate_virtual_hosts_file(params, old):
+    """Regenerate the virtual hosts file of the OLD described by `old` (which
+    the OLDs with the same vh_path share) with the current settings, keeping
+    the previous version at <vh_path>_bk. Return `True` on success.
+
+    """
+
+    vh_path = old['vh_path']
+    vh_params = dict(params)
+    vh_params.update(dict((key, old[key]) for key in ['old_name',
+        'old_dir_name', 'old_path', 'old_port', 'apps_path', 'host',
+        'vh_path']))
+    tmp_vhs_path = write_updated_virtual_hosts_file_to_tmp(vh_params)
+    if os.path.isfile(vh_path):
+        run_command(['sudo', 'cp', vh_path, '%s_bk' % vh_path])
+    result = run_command(['sudo', 'mv', tmp_vhs_path, vh_path])
+    if not result.ok:
+        print result
+        print '%sUnable to replace %s.%s' % (ANSI_FAIL, vh_path, ANSI_ENDC)
+        return False
+    print 'Regenerated %s.' % vh_path
+    return True
+
+
+def graceful_apache():
+    """Gracefully restart Apache, so that it rereads its config.
+
+    """
+
+    result = run_command(['sudo', 'apache2ctl', 'graceful'])
+    if not result.ok:
+        print result
+        print ('%sUnable to restart Apache. Do it manually by running `sudo'
+            ' apache2ctl graceful`.%s' % (ANSI_WARNING, ANSI_ENDC))
+
+
+def check_build_params(params):
+    """Exit if `params` lacks any of what is needed to build an OLD or write
+    its virtual host.
+
+    """
+
+    for key in ['apps_path', 'host', 'vh_path', 'ssl_crt_path',
+            'ssl_key_path', 'ssl_pem_path']:
+        if not params[key]:
+            sys.exit('%sYou must provide the %s in an option, the config file'
+                ' or the desired state.%s' % (ANSI_FAIL, key, ANSI_ENDC))
+    if not which(params['paster_path']):
+        sys.exit('%sSorry, there is no (paster) executable at %s.%s' % (
+            ANSI_FAIL, params['paster_path'], ANSI_ENDC))
+
+
+def apply_desired_state(params, global_state):
+    """Bring this host in line with the desired state in the JSON file at
+    `params['apply']`: inspect what actually exists in bulk, then build the
+    missing OLDs and take only the missing or changed steps for the built
+    ones. If `params['plan']` is `True`, only print what would be done.
+
+    """
+
+    print '\n%sOLD Reconciler.%s' % (ANSI_HEADER, ANSI_ENDC)
+    desired = get_desired_state(params['apply'])
+    plan, unwanted = plan_reconcile(params, global_state, desired)
+    print_reconcile_plan(plan, unwanted)
+    if params['plan']:
+        return
+    wanted = dict((o['old_name'], o) for o in desired)
+    builds = []
+    vh_olds = {}
+    for name, steps, problems in plan:
+        if 'build' in steps:
+            build_params = dict(params, old_name=name, actions=[],
+                old_dir_name=get_dir_name_from_old_name(name))
+            build_params.update(wanted[name])
+            if not build_params['vh_path'] and build_params['host']:
+                build_params['vh_path'] = ('/etc/apache2/sites-available/%s' %
+                    build_params['host'])
+            check_build_params(build_params)
+            builds.append(build_params)
+        elif 'virtual host' in steps:
+            check_build_params(params)
+    for name, steps, problems in plan:
+        if steps and 'build' not in steps:
+            reconcile_old(params, global_state, wanted[name], steps)
+        if 'virtual host' in steps:
+            old = [o for o in global_state if o['old_name'] == name][0]
+            vh_olds[old['vh_path']] = old
+    for vh_path in sorted(vh_olds):
+        regenerate_virtual_hosts_file(params, vh_olds[vh_path])
+    if vh_olds:
+        graceful_apache()
+    for build_params in builds:
+        build(build_params)
+    print 'Done.'
+
+
+def main():
+    params, global_state = get_params()
+    if params['list']:
+        list_built(params, query_olds(params))
+    elif params['dative_servers']:
+        create_dative_servers_file(params, query_olds(params))
+    elif params['backup']:
+        backup(params, query_olds(params))
+    elif params['fill_pool']:
+        fill_pool(params)
+    elif params['drain_pool']:
+        drain_pool(params)
+    elif params['apply']:
+        apply_desired_state(params, global_state)
+    elif params['destroy']:
+        destroy(params, global_state)
+    elif params['print_systemd_unit']:
+        print_systemd_unit(params, global_state)
+    elif params['switch_server']:
+        switch_server(params, global_state)
+    elif params['reapply_vhosts']:
+        reapply_virtual_hosts(params, global_state)
+    elif params['purge_cache']:
+        purge_cache(params, global_state)
+    elif params['suspend_idle']:
+        suspend_idle(params, global_state)
+    elif params['activate']:
+        activate(params, global_state)
+    elif params['clone_source']:
+        clone(params, global_state)
+    elif params['hosts_file']:
+        place_and_build(params)
+    else:
+        build(params)
+
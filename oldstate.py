@@ -0,0 +1,326 @@
+"""The record of the OLDs that buildold.py has built (STORE) and its index
+(INDEX), and the read-only queries over them: --list and --dative-servers.
+These live apart from buildold.py so that those queries can be answered (see
+`main`) without importing and compiling the whole builder.
+
+"""
+
+import os
+import sys
+import json
+import mmap
+
+# A hidden JSON file will be written at this path in order to keep track of
+# OLDs that have been built by this OLD builder script.
+STORE = '.buildold.json'
+
+# A tab-separated index of the OLDs in STORE is kept at this path. It holds
+# only the fields that --list and --dative-servers need, one OLD per line, so
+# that those read-only queries can be answered by memory-mapping it instead of
+# loading STORE. It is rewritten whenever STORE is.
+INDEX = '.buildold.index'
+INDEX_FIELDS = ['old_name', 'old_dir_name', 'db_name', 'host', 'old_port',
+    'build_date', 'old_path']
+
+# ANSI escape sequences for formatting command-line output.
+ANSI_HEADER = '\033[95m'
+ANSI_OKBLUE = '\033[94m'
+ANSI_OKGREEN = '\033[92m'
+ANSI_WARNING = '\033[93m'
+ANSI_FAIL = '\033[91m'
+ANSI_ENDC = '\033[0m'
+ANSI_BOLD = '\033[1m'
+ANSI_UNDERLINE = '\033[4m'
+
+
+def get_state():
+    """Return our global state (a record of the OLDs that we have built) as
+    encoded in the file at STORE, defaults to ./.buildold.json.
+
+    """
+
+    global_state = []
+    if os.path.isfile(STORE):
+        try:
+            global_state = json.load(open(STORE))
+            assert type(global_state) is type([])
+        except:
+            print ('%sWarning: unable to retrieve buildold\'s state at %s. The'
+                ' file exists but is not properly formatted. If this build'
+                ' succeeds, we will overwrite it.%s' % (ANSI_WARNING, STORE,
+                ANSI_ENDC))
+            global_state = []
+    return global_state
+
+
+def write_state(global_state):
+    """Write `global_state` to the JSON file at STORE and rewrite the index of
+    it at INDEX.
+
+    """
+
+    with open(STORE, 'w') as fo:
+        json.dump(global_state, fo, indent=4, sort_keys=True)
+    write_index(global_state)
+
+
+def write_index(global_state):
+    """Write the tab-separated index of the OLDs in `global_state` to INDEX,
+    sorted by port. The file is written to a temporary path and renamed into
+    place so that readers never see a partial index.
+
+    """
+
+    rows = []
+    for old in global_state:
+        values = [old.get(field) for field in INDEX_FIELDS]
+        values = [u'' if v is None else unicode(v).replace('\t', ' ')
+            for v in values]
+        rows.append((int(old.get('old_port') or 0),
+            u'\t'.join(values).encode('utf8')))
+    lines = [line for port, line in sorted(rows)]
+    tmp_path = '%s.tmp' % INDEX
+    with open(tmp_path, 'w') as fo:
+        fo.write('\t'.join(INDEX_FIELDS) + '\n')
+        for line in lines:
+            fo.write(line + '\n')
+    os.rename(tmp_path, INDEX)
+
+
+def read_index():
+    """Generate a dict for each OLD in the index at INDEX. The index is
+    rebuilt from STORE first if it is missing or older than STORE.
+
+    """
+
+    try:
+        stale = os.path.getmtime(INDEX) < os.path.getmtime(STORE)
+    except OSError:
+        stale = os.path.isfile(STORE)
+    if stale:
+        write_index(get_state())
+    if not os.path.isfile(INDEX) or os.path.getsize(INDEX) == 0:
+        return
+    with open(INDEX, 'rb') as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            fields = m.readline().rstrip('\n').split('\t')
+            for line in iter(m.readline, ''):
+                values = line.rstrip('\n').decode('utf8').split('\t')
+                yield dict(zip(fields, values))
+        finally:
+            m.close()
+
+
+def parse_port_range(ports):
+    """Return the inclusive `(start, end)` range of ports expressed by
+    `ports`, e.g., '9000-9050' or '9007'.
+
+    """
+
+    try:
+        start, sep, end = ports.partition('-')
+        return int(start), int(end or start)
+    except ValueError:
+        sys.exit('%sInvalid port range: %s.%s' % (ANSI_FAIL, ports, ANSI_ENDC))
+
+
+def query_olds(params):
+    """Generate the OLDs in the index that match the --filter-host, --filter-ports,
+    --built-after and --built-before filters in `params`.
+
+    """
+
+    ports = None
+    if params['filter_ports']:
+        ports = parse_port_range(params['filter_ports'])
+    for old in read_index():
+        if params['filter_host'] and old['host'] != params['filter_host']:
+            continue
+        if ports and not ports[0] <= int(old['old_port']) <= ports[1]:
+            continue
+        if params['built_after'] and old['build_date'] < params['built_after']:
+            continue
+        if params['built_before'] and \
+                old['build_date'] >= params['built_before']:
+            continue
+        yield old
+
+
+def list_built(params, olds):
+    """Print out info on the OLDs that were built by this script, in the
+    format given by `params['format']`.
+
+    """
+
+    olds = list(olds)
+    if params['format'] == 'json':
+        print json.dumps(olds, indent=4, sort_keys=True)
+    elif params['format'] == 'tsv':
+        print '\t'.join(INDEX_FIELDS)
+        for old in olds:
+            print '\t'.join(old[field] for field in
+                INDEX_FIELDS).encode('utf8')
+    elif olds:
+        print '%sOLDs built here by this script:%s' % (ANSI_HEADER, ANSI_ENDC)
+        sys.stdout.write(u''.join(
+            u'%s%s%s in %s being served at %shttps://%s/%s%s.\n' % (
+            ANSI_OKGREEN, old['old_name'], ANSI_ENDC, old['old_path'],
+            ANSI_OKGREEN, old['host'], old['old_dir_name'], ANSI_ENDC)
+            for old in olds).encode('utf8'))
+    else:
+        print '%sNo OLDs have been built here by this script.%s' % (
+            ANSI_HEADER, ANSI_ENDC)
+
+
+def create_dative_servers_file(params, olds):
+    """Create a JSON file summarizing the OLD instances in `olds`, i.e., those
+    being served by this build script. This file can be served by a Dative web
+    site in order to define the default available servers.
+
+    """
+
+    path = params['dative_servers']
+    if os.path.isfile(path):
+        r = raw_input('There is already a file at %s. Do you want to overwrite'
+            ' it? ' % path)
+        if r not in ['y', 'Y']:
+            sys.exit('%sDative servers file was NOT written at %s.%s' % (
+                ANSI_WARNING, path, ANSI_ENDC))
+    write_dative_servers(path, [get_dative_server(old) for old in olds])
+
+
+def get_dative_server(old):
+    """Return the Dative server object for the OLD described by `old`.
+
+    """
+
+    return {
+        'name': '%s OLD' % old['old_name'].capitalize(),
+        'type': 'OLD',
+        'url': 'https://%s/%s' % (old['host'], old['db_name']),
+        'serverCode': None,
+        'corpusServerURL': None,
+        'website': 'http://www.onlinelinguisticdatabase.org'
+    }
+
+
+def write_dative_servers(path, servers):
+    """Write the list of Dative server objects `servers` as JSON to `path`,
+    along with a gzipped copy at `path`.gz (for Apache to serve to clients
+    that accept gzip). Each file is written to a temporary path and renamed
+    into place. If the JSON has not changed, nothing is rewritten, so the
+    files' modification times, and hence the ETags that Apache derives from
+    them, change exactly when their content does.
+
+    """
+
+    content = json.dumps(servers, indent=4, sort_keys=True)
+    try:
+        with open(path) as f:
+            unchanged = f.read() == content and \
+                os.path.isfile('%s.gz' % path)
+    except IOError:
+        unchanged = False
+    if unchanged:
+        return
+    with open('%s.tmp' % path, 'w') as fo:
+        fo.write(content)
+    import gzip
+    with open('%s.gz.tmp' % path, 'wb') as fo:
+        gz = gzip.GzipFile(os.path.basename(path), 'wb', 9, fo, mtime=0)
+        gz.write(content)
+        gz.close()
+    os.rename('%s.tmp' % path, path)
+    os.rename('%s.gz.tmp' % path, '%s.gz' % path)
+
+
+# The options of the read-only queries, as (flag, optparse keyword arguments)
+# pairs. buildold.py adds them to its parser; `parse_query_args` reads them
+# without optparse, which takes longer to import than a query takes to run.
+QUERY_OPTIONS = [
+    ('--list', {'dest': 'list', 'action': 'store_true', 'default': False,
+        'metavar': 'LIST',
+        'help': "Print a list of all OLDs that have been installed here by"
+            " buildold.py."}),
+    ('--dative-servers', {'dest': 'dative_servers',
+        'metavar': 'DATIVE_SERVERS',
+        'help': "Specify the path for a JSON file that this script should"
+            " produce; that JSON file will summarize the OLD instances that are"
+            " being served by this script; this JSON summary can be served by"
+            " Dative as servers.json so that Dative's default servers match"
+            " those being served here."}),
+    ('--filter-host', {'dest': 'filter_host', 'metavar': 'FILTER_HOST',
+        'help': "With --list or --dative-servers, only include the OLDs served"
+            " on host FILTER_HOST."}),
+    ('--filter-ports', {'dest': 'filter_ports', 'metavar': 'FILTER_PORTS',
+        'help': "With --list or --dative-servers, only include the OLDs served"
+            " on a port in FILTER_PORTS, a port or an inclusive range of ports,"
+            " e.g., 9000-9050."}),
+    ('--built-after', {'dest': 'built_after', 'metavar': 'BUILT_AFTER',
+        'help': "With --list or --dative-servers, only include the OLDs built"
+            " on or after BUILT_AFTER, an ISO 8601 date, e.g., 2015-12-31."}),
+    ('--built-before', {'dest': 'built_before', 'metavar': 'BUILT_BEFORE',
+        'help': "With --list or --dative-servers, only include the OLDs built"
+            " before BUILT_BEFORE, an ISO 8601 date."}),
+    ('--format', {'dest': 'format', 'default': 'text', 'type': 'choice',
+        'choices': ['text', 'json', 'tsv'], 'metavar': 'FORMAT',
+        'help': "The output format of --list: 'text' (the default), 'json' or"
+            " 'tsv'."})
+]
+
+
+def add_query_options(parser):
+    """Add the QUERY_OPTIONS to the optparse parser `parser`.
+
+    """
+
+    for flag, kwargs in QUERY_OPTIONS:
+        parser.add_option(flag, **kwargs)
+
+
+def parse_query_args(args):
+    """Return a dict of the values of the QUERY_OPTIONS in the command-line
+    arguments `args`, or `None` if `args` hold anything else (or anything that
+    optparse would reject), so that buildold.py's own parser can handle them.
+
+    """
+
+    params = dict((kwargs['dest'], kwargs.get('default'))
+        for flag, kwargs in QUERY_OPTIONS)
+    options = dict(QUERY_OPTIONS)
+    args = list(args)
+    while args:
+        flag, sep, value = args.pop(0).partition('=')
+        kwargs = options.get(flag)
+        if not kwargs:
+            return None
+        if kwargs.get('action') == 'store_true':
+            if sep:
+                return None
+            value = True
+        elif not sep:
+            if not args:
+                return None
+            value = args.pop(0)
+        if value not in kwargs.get('choices', [value]):
+            return None
+        params[kwargs['dest']] = value
+    return params
+
+
+def main(args):
+    """Answer --list or --dative-servers from the index if the command-line
+    arguments `args` of buildold.py hold nothing but the QUERY_OPTIONS; return
+    `True` if they were answered.
+
+    """
+
+    params = parse_query_args(args)
+    if not params or not (params['list'] or params['dative_servers']):
+        return False
+    if params['list']:
+        list_built(params, query_olds(params))
+    else:
+        create_dative_servers_file(params, query_olds(params))
+    return True
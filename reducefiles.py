@@ -0,0 +1,461 @@
+#!/usr/bin/python
+
+"""
+================================================================================
+  Reduce Files
+================================================================================
+
+This is a command-line utility for (re-)generating the reduced-size copies of
+the files that have been uploaded to an OLD. It generalizes tests/pil.py and
+the `test_FFmpeg()` check of installold.py:
+
+- every image in an OLD's files directory is thumbnailed using PIL's
+  `Image.thumbnail(..., Image.ANTIALIAS)` and the result is saved, under the
+  same file name, in the OLD's reduced files directory;
+- with --audio, every .wav file is instead transcoded to both .mp3 and .ogg by
+  a single FFmpeg invocation (one decode, two outputs).
+
+This is useful when migrating an OLD with many uploaded files. The files are
+processed by a pool of worker processes sized to the number of CPUs. JPEGs are
+downscaled at decode time using `Image.draft()` and images whose reduced copy is
+newer than the original are skipped. Completed .wav files are recorded in a
+manifest (.transcoded.json in the output directory) so that an interrupted
+transcoding run resumes where it left off.
+
+
+Usage
+================================================================================
+
+This script needs PIL, so run it with the Python of the virtual environment
+that the OLD is installed in. To reduce all of the images in the files
+directory of the OLD at /home/me/oldapps/blaold::
+
+    $ ~/env/bin/python reducefiles.py /home/me/oldapps/blaold/files
+
+To transcode all of its .wav files (this does not need PIL)::
+
+    $ ./reducefiles.py /home/me/oldapps/blaold/files --audio
+
+The reduced copies are written to files/reduced_files/ unless you specify
+another directory with --output-dir. To see available options::
+
+    $ ~/env/bin/python reducefiles.py -h
+
+"""
+
+import os
+import sys
+import time
+import json
+import optparse
+import itertools
+import multiprocessing
+from subprocess import Popen, PIPE, STDOUT
+
+# Try to import PIL under its old and new names.
+try:
+    import Image
+except ImportError:
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+
+
+# File extensions of the images that the OLD makes reduced-size copies of.
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+# File extensions of the audio files that the OLD makes lossy copies of, and
+# the extensions of the lossy copies that are made of each of them.
+AUDIO_EXTENSIONS = ('.wav',)
+AUDIO_OUTPUT_EXTENSIONS = ('.mp3', '.ogg')
+
+# The name of the file in the output directory that records which audio files
+# have been transcoded.
+TRANSCODED_MANIFEST = '.transcoded.json'
+
+# The number of files that are handed to the process pool at a time. The
+# files directory is walked lazily, so only this many jobs are in memory.
+BATCH_SIZE = 1000
+
+# ANSI escape sequences for formatting command-line output.
+ANSI_HEADER = '\033[95m'
+ANSI_OKBLUE = '\033[94m'
+ANSI_OKGREEN = '\033[92m'
+ANSI_WARNING = '\033[93m'
+ANSI_FAIL = '\033[91m'
+ANSI_ENDC = '\033[0m'
+ANSI_BOLD = '\033[1m'
+ANSI_UNDERLINE = '\033[4m'
+
+
+def add_optparser_options(parser):
+    """Add options to the optparser parser.
+
+    """
+
+    parser.add_option("--output-dir", dest="output_dir",
+        metavar="OUTPUT_DIR",
+        help="The directory that reduced-size copies are written to. Defaults"
+            " to the reduced_files/ subdirectory of the files directory.")
+
+    parser.add_option("--audio", dest="audio",
+        action="store_true", default=False, metavar="AUDIO",
+        help="Transcode the .wav files to .mp3 and .ogg instead of reducing"
+            " the images.")
+
+    parser.add_option("--ffmpeg-path", dest="ffmpeg_path", default="ffmpeg",
+        metavar="FFMPEG_PATH",
+        help="The path to the ffmpeg program. Defaults to 'ffmpeg'.")
+
+    parser.add_option("--size", dest="size", type="int", default=500,
+        metavar="SIZE",
+        help="The maximum width and height, in pixels, of the reduced-size"
+            " copies. Defaults to 500.")
+
+    parser.add_option("--processes", dest="processes", type="int",
+        metavar="PROCESSES",
+        help="The number of worker processes. Defaults to the number of"
+            " CPUs.")
+
+    parser.add_option("--force", dest="force",
+        action="store_true", default=False, metavar="FORCE",
+        help="Reduce every file, even those whose reduced-size copy is newer"
+            " than the original or that the manifest records as transcoded.")
+
+
+def get_params():
+    """Get parameters based on the arg and/or options entered at the command
+    line.
+
+    """
+
+    usage = "usage: %prog files-dir [options]"
+    parser = optparse.OptionParser(usage)
+    add_optparser_options(parser)
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error('you must specify the path to an OLD\'s files directory.')
+    files_path = os.path.abspath(args[0])
+    if not os.path.isdir(files_path):
+        sys.exit('%sThere is no directory at %s.%s' % (ANSI_FAIL, files_path,
+            ANSI_ENDC))
+    params = {
+        'files_path': files_path,
+        'output_path': os.path.abspath(options.output_dir or
+            os.path.join(files_path, 'reduced_files')),
+        'audio': options.audio,
+        'ffmpeg_path': options.ffmpeg_path,
+        'size': options.size,
+        'processes': options.processes or multiprocessing.cpu_count(),
+        'force': options.force
+    }
+    return params
+
+
+def which(program):
+    """Return the path to `program` if it is an executable; otherwise return
+    `None`. From
+    http://stackoverflow.com/questions/377017/test-if-executable-exists-in-python.
+
+    """
+
+    def is_exe(fpath):
+        return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
+
+    fpath, fname = os.path.split(program)
+    if fpath:
+        if is_exe(program):
+            return program
+    else:
+        for path in os.environ["PATH"].split(os.pathsep):
+            path = path.strip('"')
+            exe_file = os.path.join(path, program)
+            if is_exe(exe_file):
+                return exe_file
+
+    return None
+
+
+def find_files(params, extensions):
+    """Generate the paths of the files in the files directory (and its
+    subdirectories, except for the output directory) whose extensions are in
+    `extensions`.
+
+    """
+
+    for dirpath, dirnames, filenames in os.walk(params['files_path']):
+        dirnames[:] = [d for d in sorted(dirnames) if
+            os.path.join(dirpath, d) != params['output_path']]
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                yield os.path.join(dirpath, filename)
+
+
+def get_output_path(params, inpath, ext=None):
+    """Return the path that the reduced copy of `inpath` is written to. The
+    relative path of `inpath` within the files directory is preserved; if
+    `ext` is given, it replaces the extension of `inpath`.
+
+    """
+
+    relpath = os.path.relpath(inpath, params['files_path'])
+    if ext:
+        relpath = '%s%s' % (os.path.splitext(relpath)[0], ext)
+    return os.path.join(params['output_path'], relpath)
+
+
+def is_up_to_date(inpath, outpath):
+    """Return `True` if there is a file at `outpath` that is newer than the
+    file at `inpath`.
+
+    """
+
+    try:
+        return os.path.getmtime(outpath) >= os.path.getmtime(inpath)
+    except OSError:
+        return False
+
+
+def get_image_jobs(params, paths, counts):
+    """Generate `(inpath, outpath, size)` jobs for the images in `paths`,
+    skipping (and counting) those whose reduced copy is up to date.
+
+    """
+
+    for inpath in paths:
+        outpath = get_output_path(params, inpath)
+        if not params['force'] and is_up_to_date(inpath, outpath):
+            counts['skipped'] += 1
+            continue
+        yield inpath, outpath, params['size']
+
+
+def reduce_image(job):
+    """Save a reduced-size copy of the image at `inpath` to `outpath`. Return
+    a `(inpath, error)` 2-tuple where `error` is `None` on success. This is a
+    module-level function so that it can be mapped over a process pool.
+
+    """
+
+    inpath, outpath, size = job
+    try:
+        im = Image.open(inpath)
+        if im.format == 'JPEG':
+            # Let the JPEG decoder downscale by a power of two while decoding.
+            im.draft(im.mode, (size, size))
+        im.thumbnail((size, size), Image.ANTIALIAS)
+        outdir = os.path.dirname(outpath)
+        if not os.path.isdir(outdir):
+            try:
+                os.makedirs(outdir)
+            except OSError:
+                if not os.path.isdir(outdir):
+                    raise
+        im.save(outpath)
+        return inpath, None
+    except Exception, e:
+        return inpath, str(e)
+
+
+def batches(iterable, size):
+    """Generate lists of (at most) `size` items from `iterable`.
+
+    """
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run_pool(worker, jobs, params):
+    """Map `worker` over `jobs` using a pool of `params['processes']` processes
+    and generate the results as they are completed. `jobs` is consumed
+    `BATCH_SIZE` jobs at a time so that memory use stays bounded.
+
+    """
+
+    pool = multiprocessing.Pool(params['processes'])
+    try:
+        chunksize = max(1, min(32, BATCH_SIZE / (params['processes'] * 4)))
+        for batch in batches(jobs, BATCH_SIZE):
+            for result in pool.imap_unordered(worker, batch, chunksize):
+                yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def report(label, counts, seconds, unit='files'):
+    """Print a summary of the work done, including the throughput.
+
+    """
+
+    rate = counts['done'] / seconds if seconds else 0
+    print ('%s%s: %d %s done, %d skipped (up to date), %d failed in %.1f'
+        ' seconds (%.2f %s/sec).%s' % (ANSI_OKGREEN, label, counts['done'],
+        unit, counts['skipped'], counts['failed'], seconds, rate, unit,
+        ANSI_ENDC))
+
+
+def reduce_images(params):
+    """Write reduced-size copies of all of the images in the files directory.
+
+    """
+
+    if Image is None:
+        sys.exit('%sPIL is not installed; run this script with the Python of'
+            ' the OLD\'s virtual environment.%s' % (ANSI_FAIL, ANSI_ENDC))
+    print 'Reducing images in %s using %d processes.' % (params['files_path'],
+        params['processes'])
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    start = time.time()
+    jobs = get_image_jobs(params, find_files(params, IMAGE_EXTENSIONS), counts)
+    for inpath, error in run_pool(reduce_image, jobs, params):
+        if error:
+            counts['failed'] += 1
+            print '%sUnable to reduce %s: %s%s' % (ANSI_WARNING, inpath,
+                error, ANSI_ENDC)
+        else:
+            counts['done'] += 1
+    report('Images', counts, time.time() - start, 'images')
+    return counts
+
+
+def get_manifest_path(params):
+    """Return the path to the manifest of transcoded audio files.
+
+    """
+
+    return os.path.join(params['output_path'], TRANSCODED_MANIFEST)
+
+
+def load_manifest(params):
+    """Return a dict from the relative paths of the audio files that have been
+    transcoded to their modification times when they were transcoded. The
+    manifest has one JSON object per line; a truncated last line (from an
+    interrupted run) is ignored.
+
+    """
+
+    manifest = {}
+    path = get_manifest_path(params)
+    if os.path.isfile(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    manifest[record['path']] = record['mtime']
+                except (ValueError, KeyError, TypeError):
+                    continue
+    return manifest
+
+
+def record_transcoded(params, manifest_file, inpath):
+    """Append a record of the transcoding of `inpath` to the manifest.
+
+    """
+
+    relpath = os.path.relpath(inpath, params['files_path'])
+    manifest_file.write('%s\n' % json.dumps({'path': relpath,
+        'mtime': os.path.getmtime(inpath)}))
+    manifest_file.flush()
+
+
+def get_audio_jobs(params, paths, manifest, counts):
+    """Generate `(ffmpeg_path, inpath, outpaths)` jobs for the audio files in
+    `paths`, skipping (and counting) those that the manifest records as
+    transcoded and whose outputs all still exist.
+
+    """
+
+    for inpath in paths:
+        outpaths = [get_output_path(params, inpath, ext) for ext in
+            AUDIO_OUTPUT_EXTENSIONS]
+        relpath = os.path.relpath(inpath, params['files_path'])
+        if (not params['force'] and
+                manifest.get(relpath) == os.path.getmtime(inpath) and
+                len(filter(os.path.isfile, outpaths)) == len(outpaths)):
+            counts['skipped'] += 1
+            continue
+        yield params['ffmpeg_path'], inpath, outpaths
+
+
+def transcode_wav(job):
+    """Transcode the audio file at `inpath` to each of `outpaths` with a single
+    FFmpeg invocation, so that the input is decoded only once. Return a
+    `(inpath, error)` 2-tuple where `error` is `None` on success. This is a
+    module-level function so that it can be mapped over a process pool.
+
+    """
+
+    ffmpeg_path, inpath, outpaths = job
+    try:
+        outdir = os.path.dirname(outpaths[0])
+        if not os.path.isdir(outdir):
+            try:
+                os.makedirs(outdir)
+            except OSError:
+                if not os.path.isdir(outdir):
+                    raise
+        ffmpeg = Popen([ffmpeg_path, '-y', '-i', inpath] + outpaths,
+            stdout=PIPE, stderr=STDOUT)
+        stdout, nothing = ffmpeg.communicate()
+        if ffmpeg.returncode != 0:
+            return inpath, stdout.strip().splitlines()[-1] if stdout.strip() \
+                else 'ffmpeg exited with status %d' % ffmpeg.returncode
+        missing = [p for p in outpaths if not os.path.isfile(p)]
+        if missing:
+            return inpath, 'ffmpeg did not create %s' % ', '.join(missing)
+        return inpath, None
+    except Exception, e:
+        return inpath, str(e)
+
+
+def transcode_audio(params):
+    """Transcode all of the .wav files in the files directory to .mp3 and .ogg.
+    Each completed file is appended to the manifest as soon as it is done.
+
+    """
+
+    if not which(params['ffmpeg_path']):
+        sys.exit('%sThere is no ffmpeg executable at %s.%s' % (ANSI_FAIL,
+            params['ffmpeg_path'], ANSI_ENDC))
+    print 'Transcoding .wav files in %s using %d processes.' % (
+        params['files_path'], params['processes'])
+    if not os.path.isdir(params['output_path']):
+        os.makedirs(params['output_path'])
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    manifest = load_manifest(params)
+    start = time.time()
+    jobs = get_audio_jobs(params, find_files(params, AUDIO_EXTENSIONS),
+        manifest, counts)
+    with open(get_manifest_path(params), 'a') as manifest_file:
+        for inpath, error in run_pool(transcode_wav, jobs, params):
+            if error:
+                counts['failed'] += 1
+                print '%sUnable to transcode %s: %s%s' % (ANSI_WARNING,
+                    inpath, error, ANSI_ENDC)
+            else:
+                counts['done'] += 1
+                record_transcoded(params, manifest_file, inpath)
+    report('Audio', counts, time.time() - start, 'files')
+    return counts
+
+
+def main():
+    params = get_params()
+    if params['audio']:
+        transcode_audio(params)
+    else:
+        reduce_images(params)
+
+
+if __name__ == '__main__':
+    main()
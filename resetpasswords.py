@@ -1,42 +1,378 @@
 """This script can be used to change/reset the passwords of all users on a
 given OLD and send them emails to that effect.
 
-TODO: set up command-line arguments to make this general-purpose.
+Usage::
+
+    $ ./resetpasswords.py --old-url=https://www.myoldurl.com/blaold \\
+        --old-username=admin --language=Blackfoot \\
+        --smtp-username=me@gmail.com --from-address=me@gmail.com
+
+You will be prompted for the OLD and SMTP passwords if you do not supply them.
+The OLD updates are run concurrently by --workers threads, each of which logs
+in once and then reuses its OLD client's HTTP session. The emails are sent over
+one persistent, authenticated SMTP connection, at no more than --rate messages
+per second; a send that fails is retried (on a fresh connection) up to
+--retries times.
+
+To try this out without sending real email, run a stand-in SMTP server that
+just prints the messages it receives and point this script at it::
+
+    $ python -m smtpd -n -c DebuggingServer localhost:1025
+    $ ./resetpasswords.py ... --smtp-host=localhost --smtp-port=1025 \\
+        --no-starttls
+
+Similarly, --old-url can point to a local fake OLD server.
+
+To reset the passwords on many OLDs at once, list them in a JSON file (see
+--olds-file) or point the script at the state file of buildold.py, which
+records all of the OLDs that it has built::
+
+    $ ./resetpasswords.py --store=.buildold.json --old-username=admin \
+        --smtp-username=me@gmail.com --report=reset-report.json
+
+Up to --old-workers OLDs are processed concurrently, each with up to --workers
+concurrent user updates, and a consolidated report is written to --report.
+
+Every password change and email is recorded in a journal (--journal). If a run
+is interrupted, just run the same command again: users who were already
+emailed are skipped, and users whose password was changed but whose email was
+not sent are emailed without their password being changed again.
+
+The OLD updates do not wait for the emails. Each email is rendered and written
+to an on-disk outbox (--outbox), which a separate sender thread drains over
+the one SMTP connection at --rate messages per second, backing off on
+temporary (4xx) errors. To send what is left in the outbox without touching
+any OLD::
+
+    $ ./resetpasswords.py --send-only --smtp-username=me@gmail.com
 
 """
 
+import os
+import hashlib
 import smtplib
+import socket
 import random
 import string
+import time
+import json
+import datetime
+import threading
+import itertools
+from multiprocessing.pool import ThreadPool
 from email.MIMEMultipart import MIMEMultipart
 from email.MIMEText import MIMEText
 import old_client
+import oldstate
 import pprint
 import sys
 import optparse
 import getpass
 
-def sendemail(params):
-    """Send an email via gmail, using info in `params`.
+
+# The fields of a user that the OLD validates when a user is updated. Only these
+# are sent back to the OLD when a user's password is changed.
+USER_UPDATE_FIELDS = ('username', 'first_name', 'last_name', 'email',
+    'affiliation', 'role', 'markup_language', 'page_content',
+    'input_orthography', 'output_orthography')
+
+
+class SMTPMailer(object):
+    """Sends email over a single persistent SMTP connection. The connection is
+    opened (and STARTTLS and login are performed) on the first send and reused
+    for subsequent sends. Sends are serialized, so a mailer can be shared by
+    threads; they are throttled to at most `rate` messages per second. A send
+    that fails with a temporary (4xx) SMTP error is retried after backing off
+    exponentially from `backoff` seconds, and one that fails because the
+    connection was lost is retried on a fresh connection, up to `retries`
+    times. Permanent (5xx) errors are raised immediately.
+
+    """
+
+    def __init__(self, host, port, username=None, password=None,
+            starttls=True, rate=None, retries=3, backoff=1):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.interval = 1.0 / rate if rate else 0
+        self.retries = retries
+        self.backoff = backoff
+        self.server = None
+        self.last_send = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        server = smtplib.SMTP(self.host, self.port)
+        if self.starttls:
+            server.starttls()
+        if self.username:
+            server.login(self.username, self.password)
+        self.server = server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
+            self.server = None
+
+    def throttle(self):
+        wait = self.last_send + self.interval - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        self.last_send = time.time()
+
+    def send(self, fromaddr, toaddrs, msg):
+        """Send the message string `msg`. Raise the last error if all attempts
+        fail.
+
+        """
+
+        with self.lock:
+            for attempt in range(self.retries + 1):
+                self.throttle()
+                try:
+                    if self.server is None:
+                        self.connect()
+                    self.server.sendmail(fromaddr, toaddrs, msg)
+                    return
+                except smtplib.SMTPRecipientsRefused, e:
+                    codes = [code for code, resp in e.recipients.values()]
+                    if attempt == self.retries or not all(
+                            400 <= code < 500 for code in codes):
+                        raise
+                except smtplib.SMTPResponseException, e:
+                    if attempt == self.retries or \
+                            not 400 <= e.smtp_code < 500:
+                        raise
+                    if e.smtp_code == 421:
+                        # The server is closing the connection.
+                        self.close()
+                except (smtplib.SMTPException, socket.error):
+                    self.close()
+                    if attempt == self.retries:
+                        raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+
+class Journal(object):
+    """An append-only record of what has been done to each user, so that an
+    interrupted run can be resumed. Each line is a JSON object with 'url',
+    'username', 'event' and 'time' keys; the events are:
+
+    - 'updated': the user's password was changed on the OLD; the new password
+      and the user's email address are recorded so that the email can be
+      (re)sent without touching the OLD again;
+    - 'emailed': the user was emailed their new password;
+    - 'failed': the 'stage' ('update' or 'email') failed with 'error'.
+
+    Every line is flushed and fsync'd before `record` returns. The journal
+    holds new passwords, so it is created readable by its owner only.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.users = {}
+        self.load()
+        self.file = os.fdopen(os.open(path,
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0600), 'a')
+
+    def load(self):
+        """Replay the journal into `self.users`, a dict from `(url, username)`
+        to the latest known state of that user. A truncated last line (from
+        a crash mid-write) is ignored.
+
+        """
+
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    key = (record['url'], record['username'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                user = self.users.setdefault(key, {'status': 'failed',
+                    'password': None, 'email': None})
+                if record['event'] == 'updated':
+                    user.update(status='updated', password=record['password'],
+                        email=record['email'])
+                elif record['event'] == 'emailed':
+                    user['status'] = 'emailed'
+
+    def record(self, url, username, event, **fields):
+        fields.update(url=url, username=username, event=event,
+            time=datetime.datetime.utcnow().isoformat())
+        with self.lock:
+            self.file.write('%s\n' % json.dumps(fields, sort_keys=True))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def get(self, url, username):
+        return self.users.get((url, username))
+
+    def is_done(self, url, username):
+        """Return `True` if nothing remains to be done for this user: they were
+        emailed, or their password was changed and they have no email.
+
+        """
+
+        user = self.users.get((url, username))
+        return user is not None and (user['status'] == 'emailed' or
+            (user['status'] == 'updated' and not user['email']))
+
+    def close(self):
+        self.file.close()
+
+
+class Outbox(object):
+    """A maildir-style spool of rendered emails that are waiting to be sent.
+    A message is written to tmp/, fsync'd and then atomically renamed into
+    new/; once it has been sent it is deleted. Each message is a JSON
+    object holding the envelope ('fromaddr' and 'toaddrs'), the rendered
+    message ('msg') and the OLD 'url' and 'username' that it concerns. A
+    message's file name is derived from its OLD URL and username, so queueing
+    the same user's email twice replaces the first copy. The spool holds new
+    passwords, so its directories are readable by their owner only.
 
     """
 
-    fromaddr = params['fromaddr']
-    toaddrs = params['toaddrs']
-    mymsg = params['mymsg']
-    username = params['username']
-    password = params['password']
-    subject = params['subject']
+    def __init__(self, path):
+        self.path = path
+        for subdir in ('tmp', 'new'):
+            subpath = os.path.join(path, subdir)
+            if not os.path.isdir(subpath):
+                os.makedirs(subpath, 0700)
+
+    def get_name(self, url, username):
+        return hashlib.sha1(json.dumps([url, username])).hexdigest()
+
+    def put(self, url, username, fromaddr, toaddrs, msg):
+        name = self.get_name(url, username)
+        tmp_path = os.path.join(self.path, 'tmp', name)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, 'w') as fo:
+            json.dump({'url': url, 'username': username, 'fromaddr': fromaddr,
+                'toaddrs': toaddrs, 'msg': msg}, fo)
+            fo.flush()
+            os.fsync(fo.fileno())
+        os.rename(tmp_path, os.path.join(self.path, 'new', name))
+
+    def list(self):
+        """Return the names of the messages waiting to be sent, oldest first.
+
+        """
+
+        new_path = os.path.join(self.path, 'new')
+        names = []
+        for name in os.listdir(new_path):
+            try:
+                names.append((os.path.getmtime(os.path.join(new_path, name)),
+                    name))
+            except OSError:
+                continue
+        return [name for mtime, name in sorted(names)]
+
+    def get(self, name):
+        return json.load(open(os.path.join(self.path, 'new', name)))
+
+    def done(self, name):
+        # A sent message holds a new password; don't keep it around.
+        os.remove(os.path.join(self.path, 'new', name))
+
+
+class Sender(threading.Thread):
+    """A worker thread that drains an `Outbox` through an `SMTPMailer`, i.e.,
+    over one authenticated connection, at the mailer's rate, recording each
+    outcome in the journal. It keeps polling the outbox for new messages until
+    `finish` is called, after which it sends whatever remains and exits.
+    Messages that fail permanently are left in the outbox (so that a later run
+    retries them) but are not retried by this sender.
+
+    """
+
+    def __init__(self, outbox, mailer, journal, poll=0.5):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.outbox = outbox
+        self.mailer = mailer
+        self.journal = journal
+        self.poll = poll
+        self.finished = threading.Event()
+        self.failed = set()
+        self.results = {}
+
+    def finish(self):
+        self.finished.set()
+        self.join()
+
+    def run(self):
+        while True:
+            names = [n for n in self.outbox.list() if n not in self.failed]
+            if not names:
+                if self.finished.is_set():
+                    return
+                self.finished.wait(self.poll)
+                continue
+            for name in names:
+                self.send(name)
+
+    def send(self, name):
+        try:
+            message = self.outbox.get(name)
+        except (IOError, ValueError):
+            self.failed.add(name)
+            return
+        key = (message['url'], message['username'])
+        try:
+            self.mailer.send(message['fromaddr'], message['toaddrs'],
+                message['msg'])
+        except Exception, e:
+            self.failed.add(name)
+            self.results[key] = str(e)
+            self.journal.record(message['url'], message['username'],
+                'failed', stage='email', error=str(e))
+            print '%s: Unable to email %s: %s' % (message['url'],
+                message['username'], e)
+            return
+        self.results[key] = None
+        self.journal.record(message['url'], message['username'], 'emailed')
+        self.outbox.done(name)
+
+
+def render_email(subject, mymsg, fromaddr=None, toaddrs=None):
+    """Return the email with subject `subject` and body `mymsg` as a string.
+
+    """
 
-    # The actual mail send
-    server = smtplib.SMTP('smtp.gmail.com:587')
-    server.starttls()
-    server.login(username, password)
     msg = MIMEMultipart()
     msg['Subject'] = subject
+    if fromaddr:
+        msg['From'] = fromaddr
+    if toaddrs:
+        msg['To'] = toaddrs
     msg.attach(MIMEText(mymsg))
-    server.sendmail(fromaddr, toaddrs, msg.as_string())
-    server.quit()
+    return msg.as_string()
+
+
+def sendemail(params):
+    """Send an email via gmail, using info in `params`.
+
+    """
+
+    mailer = SMTPMailer('smtp.gmail.com', 587, params['username'],
+        params['password'])
+    try:
+        mailer.send(params['fromaddr'], params['toaddrs'],
+            render_email(params['subject'], params['mymsg']))
+    finally:
+        mailer.close()
 
 
 def get_email_msg(username, password, language):
@@ -69,56 +405,464 @@ Joel
 ''' % (language, language, language, username, password)).strip()
 
 
-def main():
+def add_optparser_options(parser):
+    """Add options to the optparser parser.
+
+    """
+
+    parser.add_option("--old-url", dest="old_url", metavar="OLD_URL",
+        help="The URL of the target OLD.")
+
+    parser.add_option("--old-username", dest="old_username",
+        metavar="OLD_USERNAME",
+        help="The username of an administrator on the target OLD. This user's"
+            " password is not changed.")
+
+    parser.add_option("--old-password", dest="old_password",
+        metavar="OLD_PASSWORD",
+        help="The password of the OLD administrator.")
+
+    parser.add_option("--language", dest="language", metavar="LANGUAGE",
+        help="The name of the language that the target OLD is about.")
+
+    parser.add_option("--olds-file", dest="olds_file", metavar="OLDS_FILE",
+        help="Path to a JSON file containing a list of objects, one per target"
+            " OLD, with 'url' and 'language' keys and, optionally, 'username'"
+            " and 'password' keys (which default to --old-username and"
+            " --old-password).")
+
+    parser.add_option("--store", dest="store", metavar="STORE",
+        help="Path to buildold.py's state file (.buildold.json). All of the"
+            " OLDs recorded there are targeted; they must all share the"
+            " administrator --old-username and --old-password.")
+
+    parser.add_option("--page-size", dest="page_size", type="int",
+        default=100, metavar="PAGE_SIZE",
+        help="The number of users fetched from an OLD per request. Defaults"
+            " to 100.")
+
+    parser.add_option("--old-workers", dest="old_workers", type="int",
+        default=4, metavar="OLD_WORKERS",
+        help="The number of OLDs that are processed concurrently. Defaults"
+            " to 4.")
+
+    parser.add_option("--journal", dest="journal",
+        default="resetpasswords.journal", metavar="JOURNAL",
+        help="Path of the journal that records the outcome for each user, so"
+            " that an interrupted run can be resumed by running the script"
+            " again. Defaults to ./resetpasswords.journal. Use a new path (or"
+            " delete the old journal) to start a fresh reset.")
+
+    parser.add_option("--report", dest="report", metavar="REPORT",
+        help="Path of a JSON file to write a report of the results for all of"
+            " the OLDs to.")
+
+    parser.add_option("--smtp-host", dest="smtp_host",
+        default="smtp.gmail.com", metavar="SMTP_HOST",
+        help="The SMTP server to send email through. Defaults to"
+            " smtp.gmail.com.")
+
+    parser.add_option("--smtp-port", dest="smtp_port", type="int",
+        default=587, metavar="SMTP_PORT",
+        help="The port of the SMTP server. Defaults to 587.")
 
-    # Get an OLD client.
-    old_url = '' # URL of target OLD
-    old_username = '' # username of OLD admin on target OLD
-    old_password = "" # password of OLD admin on target OLD
-    old_language = '' # Name of language that the target OLD is about.
-    c = old_client.OLDClient(old_url)
+    parser.add_option("--no-starttls", dest="starttls",
+        action="store_false", default=True,
+        help="Do not use STARTTLS when connecting to the SMTP server.")
 
-    # Log in to the OLD.
-    logged_in = c.login(old_username, old_password)
-    if not logged_in:
-        sys.exit(u'Unable to log in to %s with username %s and password %s.'
-            u' Aborting.' % (old_url, old_username, old_password))
+    parser.add_option("--smtp-username", dest="smtp_username",
+        metavar="SMTP_USERNAME",
+        help="The username to log in to the SMTP server with. If not given,"
+            " we do not log in.")
 
-    # Get users.
-    users = c.get('users')
+    parser.add_option("--smtp-password", dest="smtp_password",
+        metavar="SMTP_PASSWORD",
+        help="The password of the SMTP user.")
+
+    parser.add_option("--from-address", dest="fromaddr",
+        metavar="FROM_ADDRESS",
+        help="The address that emails are sent from. Defaults to"
+            " SMTP_USERNAME.")
+
+    parser.add_option("--subject", dest="subject", metavar="SUBJECT",
+        help="The subject of the emails.")
+
+    parser.add_option("--workers", dest="workers", type="int", default=4,
+        metavar="WORKERS",
+        help="The number of users of each OLD that are updated concurrently."
+            " Defaults to 4.")
+
+    parser.add_option("--rate", dest="rate", type="float", default=1.0,
+        metavar="RATE",
+        help="The maximum number of emails sent per second. Defaults to 1.")
+
+    parser.add_option("--retries", dest="retries", type="int", default=3,
+        metavar="RETRIES",
+        help="How many times a failed email send is retried. Defaults to 3.")
+
+    parser.add_option("--backoff", dest="backoff", type="float", default=5,
+        metavar="BACKOFF",
+        help="The number of seconds to wait before the first retry of an email"
+            " that failed with a temporary (4xx) error; the wait doubles with"
+            " each retry. Defaults to 5.")
+
+    parser.add_option("--outbox", dest="outbox",
+        default="resetpasswords.outbox", metavar="OUTBOX",
+        help="Path of the directory where emails are spooled until they are"
+            " sent. Defaults to ./resetpasswords.outbox.")
+
+    parser.add_option("--send-only", dest="send_only",
+        action="store_true", default=False,
+        help="Do not reset any passwords; just send the emails that are"
+            " waiting in the outbox.")
+
+
+def get_params():
+    """Get parameters based on the options entered at the command line.
+    Prompt the user for passwords, as needed.
+
+    """
+
+    usage = "usage: ./%prog [options]"
+    parser = optparse.OptionParser(usage)
+    add_optparser_options(parser)
+    (options, args) = parser.parse_args()
+    params = dict(vars(options))
+    if not (params['old_url'] or params['olds_file'] or params['store'] or
+            params['send_only']):
+        parser.error('you must supply --old-url, --olds-file, --store or'
+            ' --send-only.')
+    if params['old_url'] and not params['language']:
+        parser.error('you must supply --language with --old-url.')
+    if not params['old_username'] and not params['olds_file'] and \
+            not params['send_only']:
+        parser.error('you must supply --old-username.')
+    if params['old_username'] and not params['old_password']:
+        params['old_password'] = getpass.getpass('Password of OLD user %s: ' %
+            params['old_username'])
+    if params['smtp_username'] and not params['smtp_password']:
+        params['smtp_password'] = getpass.getpass('Password of SMTP user %s: '
+            % params['smtp_username'])
+    params['fromaddr'] = params['fromaddr'] or params['smtp_username']
+    if not params['fromaddr']:
+        parser.error('you must supply --from-address or --smtp-username.')
+    return params
+
+
+def get_olds(params):
+    """Return the list of OLDs whose users' passwords are to be reset. Each OLD
+    is a dict with 'url', 'username', 'password' and 'language' keys. The OLDs
+    come from --old-url, from the JSON list of such dicts in --olds-file
+    and/or from the OLDs recorded in buildold.py's state file (--store).
+
+    """
+
+    olds = []
+    defaults = {'username': params['old_username'],
+        'password': params['old_password']}
+    if params['old_url']:
+        olds.append(dict(defaults, url=params['old_url'],
+            language=params['language']))
+    if params['olds_file']:
+        for old in json.load(open(params['olds_file'])):
+            olds.append(dict(defaults, **old))
+    if params['store']:
+        # Use the URLs that buildold.py gives Dative for these OLDs.
+        for old in json.load(open(params['store'])):
+            olds.append(dict(defaults,
+                url=oldstate.get_dative_server(old)['url'],
+                language=old['old_name'].capitalize()))
+    for old in olds:
+        if not old.get('username') or not old.get('password'):
+            sys.exit('No OLD admin username and password for %s.' % old['url'])
+    return olds
+
+
+def get_client(old, local):
+    """Return the logged-in OLD client of the current thread, creating it and
+    logging in if this thread has not done so yet.
+
+    """
+
+    c = getattr(local, 'client', None)
+    if c is None:
+        c = old_client.OLDClient(old['url'])
+        if not c.login(old['username'], old['password']):
+            raise Exception('Unable to log in to %s with username %s.' % (
+                old['url'], old['username']))
+        local.client = c
+    return c
+
+
+def get_update_payload(user, password):
+    """Return the minimal user object that the OLD will accept as an update of
+    `user` that sets its password to `password`: only the fields that the
+    OLD's user schema validates, with relational values given as ids.
+
+    """
+
+    payload = dict((field, user.get(field)) for field in USER_UPDATE_FIELDS)
+    for field in ('input_orthography', 'output_orthography'):
+        if isinstance(payload[field], dict):
+            payload[field] = payload[field]['id']
+    if payload['markup_language'] == 'restructuredText':
+        payload['markup_language'] = 'reStructuredText'
+    payload['password'] = password
+    payload['password_confirm'] = password
+    return payload
+
+
+def iter_users(c, page_size):
+    """Generate the users of the OLD that client `c` is logged in to, fetching
+    them `page_size` at a time using the OLD's pagination parameters. If the
+    OLD ignores the pagination parameters and returns all of the users as a
+    list, those are generated instead.
+
+    """
+
+    page = 1
+    while True:
+        resp = c.get('users', {'page': page, 'items_per_page': page_size})
+        if isinstance(resp, list):
+            for user in resp:
+                yield user
+            return
+        if 'items' not in resp:
+            raise Exception('Unable to get page %d of the users: %s' % (page,
+                resp))
+        for user in resp['items']:
+            yield user
+        if not resp['items'] or page * page_size >= resp['paginator']['count']:
+            return
+        page += 1
+
+
+def get_pool_size(workers, jobs=None):
+    """Return the number of threads in a pool that runs `jobs` jobs (if known)
+    with at most `workers` of them at a time: never more threads than jobs, and
+    always at least one, since a ThreadPool cannot be empty.
+
+    """
+
+    if jobs is not None:
+        workers = min(workers, jobs)
+    return max(1, workers)
+
+
+def batches(iterable, size):
+    """Generate lists of (at most) `size` items from `iterable`.
+
+    """
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def reset_user(params, old, local, outbox, journal, user):
+    """Change the password of `user` on `old` and queue an email with the new
+    one in `outbox`, recording the change in `journal`. If the journal shows
+    that the password was already changed, the email is just queued again.
+    Return a result dict with 'username', 'status', 'password' and 'error'
+    keys; 'status' is one of 'queued', 'updated' (but no email queued) or
+    'failed'.
+
+    """
+
+    username = user['username']
+    result = {'username': username, 'status': 'failed', 'password': None,
+        'error': None}
+    journaled = journal.get(old['url'], username)
+    if journaled and journaled['status'] == 'updated':
+        result.update(status='updated', password=journaled['password'])
+        return queue_password_email(params, old, outbox, result,
+            journaled['email'])
+    try:
+        c = get_client(old, local)
+        new_password = genpwd()
+        resp = c.update('users/%d' % user['id'],
+            get_update_payload(user, new_password))
+        if resp.get('username') != username:
+            raise Exception('the OLD did not accept the update')
+    except Exception, e:
+        result['error'] = str(e)
+        journal.record(old['url'], username, 'failed', stage='update',
+            error=result['error'])
+        return result
+    result['status'] = 'updated'
+    result['password'] = new_password
+    journal.record(old['url'], username, 'updated', password=new_password,
+        email=user.get('email'))
+    return queue_password_email(params, old, outbox, result, user.get('email'))
+
+
+def queue_password_email(params, old, outbox, result, email):
+    """Render the email with the new password in `result` and put it in the
+    outbox for the sender to send to `email`. Return `result`, updated.
+
+    """
+
+    username = result['username']
+    if not email:
+        result['error'] = '%s has no email address' % username
+        return result
+    try:
+        mymsg = get_email_msg(username, result['password'], old['language'])
+        subject = params['subject'] or ('Your %s OLD password has been'
+            ' changed' % old['language'])
+        outbox.put(old['url'], username, params['fromaddr'], email,
+            render_email(subject, mymsg, params['fromaddr'], email))
+    except Exception, e:
+        result['error'] = 'unable to queue email: %s' % e
+        return result
+    result['status'] = 'queued'
+    return result
+
+
+def get_result_msg(old, result):
+    """Return a line describing `result` for printing.
+
+    """
+
+    if result['status'] == 'failed':
+        msg = 'Failed to change password of %s.' % result['username']
+    else:
+        msg = 'Successfully changed password of %s to %s.' % (
+            result['username'], result['password'])
+    if result['error']:
+        msg = '%s Error: %s.' % (msg, result['error'])
+    return '%s: %s' % (old['url'], msg)
+
+
+def get_pending_users(old, users, journal, report):
+    """Generate the users in `users` other than the admin and those that the
+    journal records as done, counting the latter in `report`.
+
+    """
 
     for user in users:
-        if user['username'] == old_username:
+        if user['username'] == old['username']:
             continue
-        username = user['username']
-        new_password = genpwd()
-        user['password'] = new_password
-        user['password_confirm'] = new_password
-        if user['input_orthography']:
-            user['input_orthography'] = user['input_orthography']['id']
-        if user['output_orthography']:
-            user['output_orthography'] = user['output_orthography']['id']
-        if user['markup_language'] == 'restructuredText':
-            user['markup_language'] = 'reStructuredText'
-        resp = c.update('users/%d' % user['id'], user)
-        if resp.get('username') == username:
-            print 'Successfully changed password of %s to %s.' % (
-                username, new_password)
-            if user.get('email'):
-                mymsg = get_email_msg(username, new_password, language)
-                params = {
-                    'fromaddr': '', # a Gmail source address
-                    'toaddrs': user['email'],
-                    'mymsg': mymsg,
-                    'username': '', # a Gmail username
-                    'password': '', # Gmail password
-                    'subject': '' # subject of email
-                }
-                sendemail(params)
-            else:
-                print 'Could not send email; %s has no email address' % username
+        if journal.is_done(old['url'], user['username']):
+            report['skipped'] += 1
+            continue
+        yield user
+
+
+def reset_old(params, old, outbox, journal):
+    """Reset the passwords of all of the users (except the admin) of `old`,
+    updating at most `params['workers']` users at a time. The users are
+    streamed from the OLD a page at a time, and each page is updated before the
+    next is fetched, so memory use does not grow with the number of users.
+    Users that the journal records as done are skipped. Return a report of
+    what happened: counts, plus the users whose reset or email failed.
+
+    """
+
+    report = {'url': old['url'], 'language': old['language'], 'emailed': 0,
+        'updated': 0, 'failed': 0, 'skipped': 0, 'error': None,
+        'failures': []}
+    queued = 0
+    local = threading.local()
+    pool = ThreadPool(get_pool_size(params['workers']))
+    try:
+        c = old_client.OLDClient(old['url'])
+        if not c.login(old['username'], old['password']):
+            raise Exception('Unable to log in with username %s.' %
+                old['username'])
+        users = get_pending_users(old, iter_users(c, params['page_size']),
+            journal, report)
+        for batch in batches(users, params['page_size']):
+            for result in pool.imap_unordered(
+                    lambda user: reset_user(params, old, local, outbox,
+                        journal, user), batch):
+                if result['status'] == 'queued':
+                    queued += 1
+                else:
+                    report[result['status']] += 1
+                    report['failures'].append({'username': result['username'],
+                        'status': result['status'], 'error': result['error']})
+                print get_result_msg(old, result)
+    except Exception, e:
+        report['error'] = str(e)
+        print '%s: %s' % (old['url'], e)
+    finally:
+        pool.close()
+        pool.join()
+    if report['skipped']:
+        print '%s: skipped %d users that the journal records as done.' % (
+            old['url'], report['skipped'])
+    print '%s: %d emails queued.' % (old['url'], queued)
+    return report
+
+
+def add_email_results(reports, sender):
+    """Count the outcomes of sending the queued emails in `reports`, adding the
+    users whose email could not be sent to their failures.
+
+    """
+
+    reports = dict((report['url'], report) for report in reports)
+    for (url, username), error in sender.results.items():
+        report = reports.get(url)
+        if not report:
+            continue
+        if error is None:
+            report['emailed'] += 1
         else:
-            print 'Failed to change password of %s.' % username
+            report['updated'] += 1
+            report['failures'].append({'username': username,
+                'status': 'updated', 'error': error})
+
+
+def main():
+    params = get_params()
+    olds = [] if params['send_only'] else get_olds(params)
+
+    # One mailer (i.e., one SMTP connection and one rate limit) for all OLDs.
+    mailer = SMTPMailer(params['smtp_host'], params['smtp_port'],
+        params['smtp_username'], params['smtp_password'], params['starttls'],
+        params['rate'], params['retries'], params['backoff'])
+    journal = Journal(params['journal'])
+    outbox = Outbox(params['outbox'])
+
+    # The OLD updates queue emails in the outbox; the sender drains it
+    # concurrently, at the SMTP server's pace.
+    sender = Sender(outbox, mailer, journal)
+    sender.start()
+    pool = ThreadPool(get_pool_size(params['old_workers'], len(olds)))
+    try:
+        reports = pool.map(lambda old: reset_old(params, old, outbox, journal),
+            olds)
+    finally:
+        pool.close()
+        pool.join()
+        print 'Waiting for the outbox to be sent.'
+        sender.finish()
+        mailer.close()
+        journal.close()
+    add_email_results(reports, sender)
+
+    totals = {'emailed': 0, 'updated': 0, 'failed': 0, 'skipped': 0,
+        'olds_failed': len([r for r in reports if r['error']]),
+        'sent': len([r for r in sender.results.values() if r is None]),
+        'unsent': len(outbox.list())}
+    for report in reports:
+        for status in ('emailed', 'updated', 'failed', 'skipped'):
+            totals[status] += report[status]
+    if params['report']:
+        with open(params['report'], 'w') as fo:
+            json.dump({'date': datetime.datetime.utcnow().isoformat(),
+                'totals': totals, 'olds': reports}, fo, indent=4,
+                sort_keys=True)
+        print 'Report written to %s.' % params['report']
+    print ('%(emailed)d users updated and emailed, %(updated)d updated but not'
+        ' emailed, %(failed)d failed, %(skipped)d skipped as already done;'
+        ' %(olds_failed)d OLDs could not be processed. %(sent)d emails sent,'
+        ' %(unsent)d left in the outbox.' % totals)
 
 
 def genpwd():
@@ -140,4 +884,3 @@ def genpwd():
 
 if __name__ == '__main__':
     main()
-
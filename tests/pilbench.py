@@ -0,0 +1,85 @@
+"""Benchmark PIL thumbnailing. This is run by `installold.py --benchmark` using
+the Python of the OLD's virtual environment. To synthesize a larger copy of an
+image (scaled up by an integer factor)::
+
+    $ python tests/pilbench.py synthesize media/sample.jpg tmp/large.jpg 8
+
+To thumbnail the images in FILES ITERATIONS times each, using PROCESSES
+processes, writing the thumbnails to OUTDIR::
+
+    $ python tests/pilbench.py run OUTDIR ITERATIONS PROCESSES FILES...
+
+The results are printed to stdout as a JSON object.
+
+"""
+
+import os
+import sys
+import time
+import json
+import multiprocessing
+
+import Image
+
+
+def thumbnail(args):
+    """Reduce the image at `inpath` to 200x200 and save it at `outpath`, just as
+    tests/pil.py does.
+
+    """
+
+    inpath, outpath = args
+    im = Image.open(inpath)
+    im.thumbnail((200, 200), Image.ANTIALIAS)
+    im.save(outpath)
+    return outpath
+
+
+def synthesize(inpath, outpath, scale):
+    """Save a copy of the image at `inpath`, scaled up by `scale`, at `outpath`.
+
+    """
+
+    im = Image.open(inpath)
+    im = im.convert('RGB') if im.mode == 'P' else im
+    width, height = im.size
+    im = im.resize((width * scale, height * scale), Image.BICUBIC)
+    im.save(outpath)
+
+
+def run(outdir, iterations, processes, paths):
+    """Thumbnail each image in `paths` `iterations` times, using a pool of
+    `processes` processes, and return a dict of timing results.
+
+    """
+
+    jobs = []
+    for i in range(iterations):
+        for path in paths:
+            name = '%d_%s' % (i, os.path.basename(path))
+            jobs.append((path, os.path.join(outdir, name)))
+    start = time.time()
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        outpaths = pool.map(thumbnail, jobs)
+        pool.close()
+        pool.join()
+    else:
+        outpaths = map(thumbnail, jobs)
+    seconds = time.time() - start
+    for outpath in outpaths:
+        os.remove(outpath)
+    return {
+        'images': len(jobs),
+        'processes': processes,
+        'seconds': seconds,
+        'images_per_second': len(jobs) / seconds if seconds else None
+    }
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'synthesize':
+        synthesize(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        print json.dumps(run(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]),
+            sys.argv[5:]))
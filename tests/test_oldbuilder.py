@@ -0,0 +1,166 @@
+"""Unit tests for the pure helpers of the OLD builder (oldbuilder.py). Run them
+from the repository's root directory with:
+
+    $ python -m unittest discover -s tests
+
+"""
+
+import os
+import pwd
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import oldbuilder
+
+
+class TestGetLoad(unittest.TestCase):
+
+    params = {'pool_connections': 10, 'mysql_reserved_connections': 20}
+
+    def get_capacity(self, **kwargs):
+        capacity = {'olds': 4, 'max_connections': 100,
+            'mem_total_kb': 1000, 'mem_available_kb': 800,
+            'disk_total_kb': 1000, 'disk_free_kb': 900}
+        capacity.update(kwargs)
+        return capacity
+
+    def test_admits(self):
+        # 5 OLDs need 50 of the 80 connections left after the reserve; the
+        # connections (50%) are more loaded than RAM (20%) and disk (10%).
+        load, refusal = oldbuilder.get_load(self.params, self.get_capacity())
+        self.assertIsNone(refusal)
+        self.assertAlmostEqual(load, 0.5)
+
+    def test_load_is_the_largest_fraction(self):
+        load, refusal = oldbuilder.get_load(self.params,
+            self.get_capacity(mem_available_kb=100))
+        self.assertIsNone(refusal)
+        self.assertAlmostEqual(load, 0.9)
+
+    def test_refuses_when_connections_run_out(self):
+        load, refusal = oldbuilder.get_load(self.params,
+            self.get_capacity(olds=8))
+        self.assertIsNone(load)
+        self.assertIn('would need 90 MySQL connections', refusal)
+
+    def test_admits_up_to_the_reserve(self):
+        load, refusal = oldbuilder.get_load(self.params,
+            self.get_capacity(olds=7))
+        self.assertIsNone(refusal)
+
+    def test_refuses_without_max_connections(self):
+        load, refusal = oldbuilder.get_load(self.params,
+            self.get_capacity(max_connections=None))
+        self.assertIsNone(load)
+        self.assertIn('max_connections is unknown', refusal)
+
+    def test_refuses_when_the_probe_failed(self):
+        capacity = self.get_capacity()
+        del capacity['olds']
+        load, refusal = oldbuilder.get_load(self.params, capacity)
+        self.assertIsNone(load)
+        self.assertIn('number of OLDs on it is unknown', refusal)
+
+
+class TestDirectoryExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_executor(self):
+        executor = oldbuilder.get_executor({'name': 'dir',
+            'executor': 'directory', 'root': self.root})
+        self.assertIsInstance(executor, oldbuilder.DirectoryExecutor)
+
+    def test_runs_in_root(self):
+        executor = oldbuilder.DirectoryExecutor({'name': 'dir',
+            'root': self.root})
+        returncode, output = executor.run(['pwd'])
+        self.assertEqual(returncode, 0)
+        self.assertEqual(output.strip(), self.root)
+
+    def test_input(self):
+        executor = oldbuilder.DirectoryExecutor({'name': 'dir',
+            'root': self.root})
+        returncode, output = executor.run(['cat'], input='olds=3\n')
+        self.assertEqual((returncode, output), (0, 'olds=3\n'))
+
+
+class TestRenderSystemdUnit(unittest.TestCase):
+
+    def setUp(self):
+        self.sudo_user = os.environ.get('SUDO_USER')
+        self.user = pwd.getpwuid(os.getuid()).pw_name
+        os.environ['SUDO_USER'] = self.user
+        self.params = {'old_name': 'bla', 'old_dir_name': 'blaold',
+            'old_path': '/var/old/blaold', 'old_port': '9001',
+            'paster_path': '/opt/old/env/bin/paster'}
+
+    def tearDown(self):
+        if self.sudo_user is None:
+            del os.environ['SUDO_USER']
+        else:
+            os.environ['SUDO_USER'] = self.sudo_user
+
+    def get_directives(self, params):
+        unit = oldbuilder.render_systemd_unit(params)
+        return dict(line.split('=', 1) for line in unit.splitlines()
+            if '=' in line)
+
+    def test_sections(self):
+        unit = oldbuilder.render_systemd_unit(self.params)
+        self.assertTrue(unit.startswith('[Unit]\n'))
+        self.assertIn('\n[Service]\n', unit)
+        self.assertTrue(unit.endswith(
+            '[Install]\nWantedBy=multi-user.target\n'))
+
+    def test_service(self):
+        directives = self.get_directives(self.params)
+        self.assertEqual(directives['Description'], 'The bla OLD (paster)')
+        self.assertEqual(directives['PIDFile'], '/var/old/blaold/old.pid')
+        self.assertEqual(directives['WorkingDirectory'], '/var/old/blaold')
+        self.assertEqual(directives['ExecStart'],
+            '/opt/old/env/bin/paster serve --daemon'
+            ' --pid-file=/var/old/blaold/old.pid'
+            ' --log-file=/var/old/blaold/log/paster-old.log'
+            ' /var/old/blaold/production.ini')
+        self.assertEqual(directives['Restart'], 'on-failure')
+
+    def test_runs_as_the_invoking_user(self):
+        directives = self.get_directives(self.params)
+        self.assertEqual(directives['User'], self.user)
+        self.assertTrue(directives['Group'])
+
+    def test_exec_start_is_absolute(self):
+        params = dict(self.params, paster_path='env/bin/paster')
+        directives = self.get_directives(params)
+        self.assertEqual(directives['ExecStart'].split()[0],
+            os.path.abspath('env/bin/paster'))
+
+    def test_limits(self):
+        directives = self.get_directives(self.params)
+        self.assertEqual(directives['MemoryMax'], '512M')
+        self.assertEqual(directives['CPUQuota'], '100%')
+        self.assertEqual(directives['TasksMax'], '64')
+        self.assertEqual(directives['IOWeight'], '100')
+
+    def test_overrides(self):
+        # A fleet-wide setting, a per-OLD override and a limit that is omitted.
+        params = dict(self.params, systemd={'memory_max': '1G'},
+            olds_config={'bla': {'systemd': {'tasks_max': None,
+            'restart_sec': 10}}})
+        directives = self.get_directives(params)
+        self.assertEqual(directives['MemoryMax'], '1G')
+        self.assertEqual(directives['RestartSec'], '10')
+        self.assertNotIn('TasksMax', directives)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Unit tests for the pure helpers of resetpasswords.py. Run them from the
+repository's root directory with:
+
+    $ python -m unittest discover -s tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resetpasswords
+
+
+class TestGetPoolSize(unittest.TestCase):
+
+    def test_workers_bound_the_pool(self):
+        self.assertEqual(resetpasswords.get_pool_size(4, 10), 4)
+
+    def test_no_more_threads_than_jobs(self):
+        self.assertEqual(resetpasswords.get_pool_size(4, 2), 2)
+
+    def test_unknown_number_of_jobs(self):
+        self.assertEqual(resetpasswords.get_pool_size(4), 4)
+
+    def test_never_empty(self):
+        self.assertEqual(resetpasswords.get_pool_size(4, 0), 1)
+        self.assertEqual(resetpasswords.get_pool_size(0, 10), 1)
+        self.assertEqual(resetpasswords.get_pool_size(0), 1)
+
+
+class TestBatches(unittest.TestCase):
+
+    def test_batches(self):
+        self.assertEqual(list(resetpasswords.batches(iter(range(5)), 2)),
+            [[0, 1], [2, 3], [4]])
+
+    def test_empty(self):
+        self.assertEqual(list(resetpasswords.batches([], 2)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()